@@ -0,0 +1,116 @@
+"""Compare the legacy str based reply decode with the bytes-native codec path.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_decode
+"""
+import argparse
+import base64
+import json
+import timeit
+import tracemalloc
+
+from Crypto.Cipher import AES
+
+from custom_components.gree.lib import codec
+
+KEY = "0123456789abcdef"
+
+STATUS_REPLY = {
+    "t": "dat",
+    "mac": "aabbccddeeff",
+    "r": 200,
+    "cols": ["Pow", "WdSpd", "Mod", "Rotate", "LRAngle", "name", "host"],
+    "dat": [1, 7, 0, 1, 12, "Living room fan", "192.168.1.42"],
+}
+
+
+def legacy_decrypt_payload(payload, key=codec.GENERIC_KEY):
+    """The pack decode as it was before the bytes-native codec."""
+    cipher = AES.new(key.encode(), AES.MODE_ECB)
+    decoded = base64.b64decode(payload)
+    decrypted = cipher.decrypt(decoded).decode()
+    t = decrypted.replace(decrypted[decrypted.rindex("}") + 1:], "")
+    return json.loads(t)
+
+
+def cached_str_decrypt_payload(payload, key=codec.GENERIC_KEY):
+    """The str based pack decode with a cached cipher, isolates the bytes path gain."""
+    decoded = base64.b64decode(payload)
+    decrypted = codec.get_cipher(key).decrypt(decoded).decode()
+    t = decrypted.replace(decrypted[decrypted.rindex("}") + 1:], "")
+    return json.loads(t)
+
+
+def legacy_decode_packet(data, key=codec.GENERIC_KEY):
+    obj = json.loads(data)
+    if obj.get("pack"):
+        obj["pack"] = legacy_decrypt_payload(obj["pack"], key)
+    return obj
+
+
+def cached_str_decode_packet(data, key=codec.GENERIC_KEY):
+    obj = json.loads(data)
+    if obj.get("pack"):
+        obj["pack"] = cached_str_decrypt_payload(obj["pack"], key)
+    return obj
+
+
+DECODERS = (
+    ("legacy", legacy_decode_packet),
+    ("str", cached_str_decode_packet),
+    ("codec", codec.decode_packet),
+)
+
+
+def time_per_reply(decode, data, rounds) -> float:
+    """Return the best of five mean decode times in microseconds."""
+    timings = timeit.repeat(lambda: decode(data, KEY), number=rounds, repeat=5)
+    return min(timings) / rounds * 1e6
+
+
+def memory_per_reply(decode, data, rounds) -> tuple[float, float]:
+    """Return the mean (new memory blocks, transient peak bytes) of one decode."""
+    blocks = 0
+    peak = 0
+    tracemalloc.start()
+    for _ in range(rounds):
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        result = decode(data, KEY)
+        _, top = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+        blocks += sum(s.count_diff for s in stats if s.count_diff > 0)
+        peak += top - base
+        del result
+    tracemalloc.stop()
+    return blocks / rounds, peak / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gree reply decode benchmark.")
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    envelope = {
+        "t": "pack",
+        "i": 0,
+        "uid": 0,
+        "cid": "aabbccddeeff",
+        "tcid": "app",
+        "pack": codec.encrypt_payload(STATUS_REPLY, KEY),
+    }
+    data = json.dumps(envelope).encode()
+    for _, decode in DECODERS:
+        assert decode(data, KEY)["pack"] == STATUS_REPLY
+
+    print(f"{'path':<8} {'us/reply':>10} {'blocks/reply':>14} {'peak B/reply':>14}")
+    for name, decode in DECODERS:
+        usec = time_per_reply(decode, data, args.rounds)
+        blocks, peak = memory_per_reply(decode, data, 50)
+        print(f"{name:<8} {usec:>10.2f} {blocks:>14.1f} {peak:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
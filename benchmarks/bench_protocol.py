@@ -0,0 +1,315 @@
+"""Micro-benchmarks of the codec, envelope, discovery and device state paths.
+
+Every case runs over realistic payload sizes and reports time, throughput
+and allocations per operation. Results can be written as JSON and compared
+against an earlier run, regressions make the command exit with status 1.
+
+Run from the repository root, once on the known good tree:
+
+    python -m benchmarks.bench_protocol --output baseline.json
+
+and after a change:
+
+    python -m benchmarks.bench_protocol --baseline baseline.json --output current.json
+
+Times are compared relative to a fixed reference workload timed in the same
+run, which absorbs some of the machine's speed changes, but results are only
+comparable between runs on the same machine.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+from custom_components.gree.lib import codec, network
+from custom_components.gree.lib.device import Device
+from custom_components.gree.lib.device_infos import create_device_info
+from custom_components.gree.lib.discovery import Discovery
+from custom_components.gree.lib.enums import Props
+
+KEY = "0123456789abcdef"
+MAC = "c8f742aabbcc"
+MID = "828211"
+
+# Status reply columns of increasing size, the full set is what a first poll asks for
+STATUS_COLS = {
+    "1col": ["Pow"],
+    "5col": ["Pow", "WdSpd", "Mod", "Rotate", "LRAngle"],
+    "full": ["Pow", "WdSpd", "Mod", "Rotate", "LRAngle", "name", "host", "hid"],
+}
+STATUS_VALUES = {
+    "Pow": 1,
+    "WdSpd": 7,
+    "Mod": 2,
+    "Rotate": 1,
+    "LRAngle": 12,
+    "name": "Living room tower fan",
+    "host": "192.168.1.42",
+    "hid": "362001000762+U-CS532AE(LT)V3.31.bin",
+}
+CMD_OPTS = {
+    "1opt": {"Pow": 1},
+    "3opt": {"Pow": 1, "WdSpd": 7, "Mod": 2},
+    "5opt": {"Pow": 1, "WdSpd": 7, "Mod": 2, "Rotate": 1, "LRAngle": 12},
+}
+SCAN_REPLY = {
+    "t": "dev",
+    "cid": MAC,
+    "bc": "",
+    "brand": "gree",
+    "catalog": "gree",
+    "mac": MAC,
+    "mid": MID,
+    "model": "gree",
+    "name": "Living room tower fan",
+    "series": "gree",
+    "vender": "1",
+    "ver": "V1.2.1",
+    "lock": 0,
+}
+
+
+def reply_packs():
+    """Return the decrypted `pack` of each reply size."""
+    packs = {
+        f"status-{size}": {"t": "dat", "mac": MAC, "r": 200, "cols": cols, "dat": [STATUS_VALUES[c] for c in cols]}
+        for size, cols in STATUS_COLS.items()
+    }
+    for size, values in CMD_OPTS.items():
+        packs[f"cmd-{size}"] = {
+            "t": "res", "mac": MAC, "r": 200, "opt": list(values), "p": list(values.values()),
+            "val": list(values.values()),
+        }
+    packs["dev"] = SCAN_REPLY
+    return packs
+
+
+def envelope(pack, generic=False):
+    return {"t": "pack", "i": 1 if generic else 0, "uid": 0, "cid": MAC, "tcid": "app", "pack": pack}
+
+
+class _ParseOnlyDiscovery(Discovery):
+    """Discovery that stops after parsing, the registry and listeners are benchmarked elsewhere."""
+
+    def _dispatch(self, device_info):
+        # Start a new round so the next identical reply is parsed again
+        self._round.clear()
+
+
+class _DedupeDiscovery(Discovery):
+    """Discovery that only sees repeated replies after the first one."""
+
+    def _dispatch(self, device_info):
+        pass
+
+
+def build_cases():
+    """Return (name, callable) pairs, every callable does one operation."""
+    cases = []
+    for size, pack in reply_packs().items():
+        key = codec.GENERIC_KEY if size == "dev" else KEY
+        encrypted = codec.encrypt_payload(pack, key)
+        env = envelope(encrypted, size == "dev")
+        data = json.dumps(env).encode()
+        cases += [
+            (f"codec.encrypt_payload[{size}]", lambda p=pack, k=key: codec.encrypt_payload(p, k)),
+            (f"codec.decrypt_payload[{size}]", lambda e=encrypted, k=key: codec.decrypt_payload(e, k)),
+            (f"envelope.dumps[{size}]", lambda e=env: json.dumps(e).encode()),
+            (f"envelope.loads[{size}]", lambda d=data: json.loads(d)),
+            (f"codec.decode_packet[{size}]", lambda d=data, k=key: codec.decode_packet(d, k)),
+        ]
+
+    batch = [codec.encrypt_payload(reply_packs()["status-5col"], KEY)] * 32
+    cases += [
+        ("codec.decrypt_payload[status-5col x32]", lambda: [codec.decrypt_payload(p, KEY) for p in batch]),
+        ("codec.decrypt_payloads[status-5col x32]", lambda: codec.decrypt_payloads(batch, KEY)),
+    ]
+
+    discovery = _ParseOnlyDiscovery()
+    repeated = _DedupeDiscovery()
+    scan_data = codec.encode_packet(envelope(SCAN_REPLY, True))
+    cases += [
+        ("discovery.datagram_received[dev]", lambda: discovery.datagram_received(scan_data, ("192.168.1.42", 7000))),
+        ("discovery.datagram_received[dup]", lambda: repeated.datagram_received(scan_data, ("192.168.1.42", 7000))),
+    ]
+
+    device_info = create_device_info(MID, "fan", "192.168.1.42", 7000, MAC)
+    for size, cols in STATUS_COLS.items():
+        cases.append(
+            (f"request_state.payload[{size}]",
+             lambda c=cols: codec.encode_packet(network.status_payload(c, device_info), KEY))
+        )
+    for size, values in CMD_OPTS.items():
+        cases.append(
+            (f"send_state.payload[{size}]",
+             lambda v=values: codec.encode_packet(network.cmd_payload(v, device_info), KEY))
+        )
+
+    device = Device(device_info)
+    device.power = 1
+
+    def set_property():
+        # Step the speed so the write is never a no-op
+        device.set_property(Props.FAN_SPEED, 1 + (device.fan_speed or 0) % 12)
+
+    cases += [
+        ("device.get_property[Pow]", lambda: device.get_property(Props.POWER)),
+        ("device.set_property[WdSpd]", set_property),
+        ("device.power", lambda: device.power),
+    ]
+    return cases
+
+
+def _reference():
+    """Fixed pure Python workload timed alongside the cases to factor out machine speed."""
+    return sum(len(str(i)) for i in range(100))
+
+
+def time_cases(cases, rounds: int, repeat: int) -> dict:
+    """Return the best seconds per operation of every case.
+
+    Repeats go round robin over the cases instead of finishing one case
+    first, so a slow spell of the machine hits every case alike.
+    """
+    for _, operation in cases:
+        operation()
+    best = {name: float("inf") for name, _ in cases}
+    for _ in range(repeat):
+        for name, operation in cases:
+            best[name] = min(best[name], timeit.timeit(operation, number=rounds) / rounds)
+    return best
+
+
+def allocations(operation) -> tuple[int, float]:
+    """Return the transient peak bytes and the blocks retained per operation."""
+    tracemalloc.start()
+    peak = 0
+    for _ in range(20):
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        result = operation()
+        _, top = tracemalloc.get_traced_memory()
+        peak = max(peak, top - base)
+        del result
+    tracemalloc.stop()
+
+    blocks = sys.getallocatedblocks()
+    for _ in range(1000):
+        operation()
+    retained = (sys.getallocatedblocks() - blocks) / 1000
+    return peak, retained
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def relative(result: dict, meta: dict) -> float:
+    """Return the time of a case in units of the reference workload of its run."""
+    return result["us_per_op"] / meta["reference_us"]
+
+
+def compare(results: dict, meta: dict, baseline: dict, threshold: float) -> dict:
+    """Return the cases slower or more memory hungry than the baseline allows, with their time ratio."""
+    regressions = {}
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        ratio = relative(result, meta) / relative(before, baseline["meta"])
+        # Small absolute growth of the peak is allocator noise
+        bigger = result["peak_bytes"] > before["peak_bytes"] * (1 + threshold) + 64
+        if ratio > 1 + threshold or bigger:
+            regressions[name] = ratio
+    return regressions
+
+
+def run(args) -> int:
+    cases = [(name, op) for name, op in build_cases() if not args.filter or args.filter in name]
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    timings = time_cases([("reference", _reference), *cases], args.rounds, args.repeat)
+    meta = metadata()
+    meta["reference_us"] = round(timings.pop("reference") * 1e6, 4)
+
+    results = {}
+    print(f"{'case':<36} {'us/op':>9} {'ops/s':>10} {'peak B':>8} {'retained':>9} {'vs base':>8}")
+    for name, operation in cases:
+        seconds = timings[name]
+        peak, retained = allocations(operation)
+        result = results[name] = {
+            "us_per_op": round(seconds * 1e6, 4),
+            "ops_per_sec": round(1 / seconds),
+            "peak_bytes": peak,
+            "retained_blocks": round(retained, 3),
+        }
+        before = baseline["results"].get(name) if baseline else None
+        if before:
+            delta = f"{relative(result, meta) / relative(before, baseline['meta']) - 1:>+8.1%}"
+        else:
+            delta = f"{'':>8}"
+        print(
+            f"{name:<36} {result['us_per_op']:>9.3f} {result['ops_per_sec']:>10} "
+            f"{peak:>8} {retained:>9.3f} {delta}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"meta": meta, "results": results}, file, indent=2)
+
+    if baseline is None:
+        return 0
+    regressions = compare(results, meta, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for name, ratio in regressions.items():
+            print(f"  {name} {ratio - 1:+.1%}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gree codec and protocol micro-benchmarks.")
+    parser.add_argument("--rounds", type=int, default=2000, help="Operations per timing repeat")
+    parser.add_argument("--repeat", type=int, default=7, help="Timing repeats, the best one counts")
+    parser.add_argument("--filter", help="Only run cases whose name contains this text")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against the JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown or peak memory growth reported as a regression")
+    args = parser.parse_args()
+
+    # The lib turns on debug logging, which would format every packet
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def _run():
+        return run(args)
+
+    sys.exit(asyncio.run(_run()))
+
+
+if __name__ == "__main__":
+    main()
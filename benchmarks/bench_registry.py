@@ -0,0 +1,82 @@
+"""Measure the cost of a discovery rescan as the fleet grows.
+
+Every device of the fleet answers the scan again, unchanged. The legacy list
+scan is quadratic in the fleet size, the mac-indexed registry stays flat per
+device. Run from the repository root:
+
+    python -m benchmarks.bench_registry
+"""
+import argparse
+import asyncio
+import time
+
+from custom_components.gree.lib.device_infos import create_device_info
+from custom_components.gree.lib.discovery import Discovery
+from custom_components.gree.lib.gree_device import GreeDeviceInfo
+
+MID = "828211"
+
+
+def make_fleet(count):
+    return [
+        create_device_info(MID, None, f"10.0.{i // 250}.{i % 250 + 1}", 7000, f"c8f742{i:06x}")
+        for i in range(count)
+    ]
+
+
+class LegacyDiscovery(Discovery):
+    """The list based device_found as it was before the registry."""
+
+    def __init__(self):
+        super().__init__()
+        self._device_infos = []
+
+    async def device_found(self, device_info: GreeDeviceInfo) -> None:
+        for index, last_info in enumerate(self._device_infos):
+            if device_info == last_info:
+                if device_info.ip != last_info.ip:
+                    self._device_infos[index] = device_info
+                    tasks = [l.device_update(device_info) for l in self._listeners]
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                return
+
+        self._device_infos.append(device_info)
+        tasks = [l.device_found(device_info) for l in self._listeners]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def rescan_time(discovery, fleet) -> float:
+    """Return the seconds one rescan of an already known fleet takes."""
+    for device_info in fleet:
+        await discovery.device_found(device_info)
+
+    rescan = make_fleet(len(fleet))
+    start = time.perf_counter()
+    for device_info in rescan:
+        await discovery.device_found(device_info)
+    return time.perf_counter() - start
+
+
+async def run(sizes, legacy_limit):
+    print(f"{'devices':>8} {'legacy ms':>10} {'registry ms':>12} {'registry us/dev':>16}")
+    for size in sizes:
+        fleet = make_fleet(size)
+        legacy = None
+        if size <= legacy_limit:
+            legacy = await rescan_time(LegacyDiscovery(), fleet) * 1e3
+        registry = await rescan_time(Discovery(), fleet)
+        legacy_text = f"{legacy:>10.2f}" if legacy is not None else f"{'skipped':>10}"
+        print(f"{size:>8} {legacy_text} {registry * 1e3:>12.2f} {registry / size * 1e6:>16.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gree discovery rescan benchmark.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--legacy-limit", type=int, default=2000,
+                        help="Largest fleet to run the quadratic legacy scan on")
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.legacy_limit))
+
+
+if __name__ == "__main__":
+    main()
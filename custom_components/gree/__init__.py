@@ -2,20 +2,84 @@
 from datetime import timedelta
 import logging
 
+import voluptuous as vol
+
 from homeassistant.components.network import async_get_ipv4_broadcast_addresses
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.event import async_track_time_interval
 
 from .bridge import DiscoveryService
+from .config_flow import parse_networks
 from .constant import DOMAIN, DATA_DISCOVERY_SERVICE, DISPATCHERS, DATA_DISCOVERY_INTERVAL, DISCOVERY_SCAN_INTERVAL, \
-    COORDINATORS
+    COORDINATORS, SERVICE_SET_PACKET_TRACE, SERVICE_EXPORT_PACKET_TRACE, ATTR_MAC, ATTR_SIZE, CONF_SCAN_NETWORKS, \
+    SERVICE_EXPORT_METRICS
+from .lib.metrics import METRICS
+from .lib.trace import DEFAULT_TRACE_SIZE
 
 _LOGGER = logging.getLogger(__name__)
 
 PLATFORMS = [Platform.FAN, Platform.SWITCH, Platform.SELECT]
 
+SET_PACKET_TRACE_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_MAC): cv.string,
+        vol.Optional(ATTR_SIZE, default=DEFAULT_TRACE_SIZE): vol.All(vol.Coerce(int), vol.Range(min=0)),
+    }
+)
+EXPORT_PACKET_TRACE_SCHEMA = vol.Schema({vol.Required(ATTR_MAC): cv.string})
+
+
+def _find_device(hass: HomeAssistant, mac: str):
+    coordinator = hass.data[DATA_DISCOVERY_SERVICE].discovery.registry.attached(mac)
+    if coordinator is None:
+        raise HomeAssistantError(f"Unknown Gree device {mac}")
+    return coordinator.device
+
+
+def _async_register_services(hass: HomeAssistant) -> None:
+    """Register the packet trace and metrics services."""
+
+    async def set_packet_trace(call: ServiceCall) -> None:
+        device = _find_device(hass, call.data[ATTR_MAC])
+        if call.data[ATTR_SIZE]:
+            device.enable_trace(call.data[ATTR_SIZE])
+        else:
+            device.disable_trace()
+
+    async def export_packet_trace(call: ServiceCall) -> None:
+        device = _find_device(hass, call.data[ATTR_MAC])
+        if device.trace is None:
+            raise HomeAssistantError(f"Packet trace is not enabled for {call.data[ATTR_MAC]}")
+
+        path = hass.config.path(f"gree_trace_{call.data[ATTR_MAC]}.jsonl")
+        data = device.trace.export()
+
+        def _write():
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(data)
+
+        await hass.async_add_executor_job(_write)
+        _LOGGER.info("Packet trace of %s written to %s", call.data[ATTR_MAC], path)
+
+    async def export_metrics(call: ServiceCall) -> None:
+        path = hass.config.path("gree_metrics.prom")
+        data = METRICS.prometheus()
+
+        def _write():
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(data)
+
+        await hass.async_add_executor_job(_write)
+        _LOGGER.info("Metrics written to %s", path)
+
+    hass.services.async_register(DOMAIN, SERVICE_SET_PACKET_TRACE, set_packet_trace, SET_PACKET_TRACE_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_EXPORT_PACKET_TRACE, export_packet_trace, EXPORT_PACKET_TRACE_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_EXPORT_METRICS, export_metrics)
+
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Gree Climate from a config entry."""
@@ -25,10 +89,24 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
     hass.data[DOMAIN].setdefault(DISPATCHERS, [])
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    _async_register_services(hass)
+
+    restored = await gree_discovery.async_restore()
+    _LOGGER.debug("Restored %i Gree devices from the snapshot", restored)
+
+    networks = parse_networks(entry.options.get(CONF_SCAN_NETWORKS, ""))
+    sweep = None
 
     async def _async_scan_update(_=None):
+        nonlocal sweep
         bcast_addr = list(await async_get_ipv4_broadcast_addresses(hass))
         await gree_discovery.discovery.scan(0, bcast_ifaces=bcast_addr)
+        # A large sweep takes minutes, it runs in the background and a new
+        # one only starts once the previous one is done
+        if networks and (sweep is None or sweep.done()):
+            sweep = entry.async_create_background_task(
+                hass, gree_discovery.discovery.sweep(networks), f"{DOMAIN} network sweep"
+            )
 
     _LOGGER.debug("Scanning network for Gree devices")
     await _async_scan_update()
@@ -36,10 +114,16 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     hass.data[DOMAIN][DATA_DISCOVERY_INTERVAL] = async_track_time_interval(
         hass, _async_scan_update, timedelta(seconds=DISCOVERY_SCAN_INTERVAL)
     )
+    entry.async_on_unload(entry.add_update_listener(_async_options_updated))
 
     return True
 
 
+async def _async_options_updated(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the entry so new sweep networks are picked up."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     if hass.data[DOMAIN].get(DISPATCHERS) is not None:
@@ -49,13 +133,22 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     if hass.data[DOMAIN].get(DATA_DISCOVERY_INTERVAL) is not None:
         hass.data[DOMAIN].pop(DATA_DISCOVERY_INTERVAL)()
 
-    if hass.data.get(DATA_DISCOVERY_SERVICE) is not None:
-        hass.data.pop(DATA_DISCOVERY_SERVICE)
-
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
 
     if unload_ok:
-        hass.data[DOMAIN].pop(COORDINATORS, None)
+        for coordinator in hass.data[DOMAIN].pop(COORDINATORS, []):
+            coordinator.device.close()
         hass.data[DOMAIN].pop(DISPATCHERS, None)
 
+    if hass.data.get(DATA_DISCOVERY_SERVICE) is not None:
+        hass.data.pop(DATA_DISCOVERY_SERVICE).close()
+
+    if unload_ok:
+        # The registry outlives the entry, drop the series of the devices it no longer polls
+        METRICS.clear()
+
+    hass.services.async_remove(DOMAIN, SERVICE_SET_PACKET_TRACE)
+    hass.services.async_remove(DOMAIN, SERVICE_EXPORT_PACKET_TRACE)
+    hass.services.async_remove(DOMAIN, SERVICE_EXPORT_METRICS)
+
     return unload_ok
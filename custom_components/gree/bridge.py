@@ -3,89 +3,209 @@ from __future__ import annotations
 
 from datetime import timedelta
 import logging
+import time
 
-from .lib.device import Device
+from .lib.device import Device, StateChange
 from .lib.discovery import Discovery, Listener
 from .lib.exceptions import DeviceNotBoundError, DeviceTimeoutError
+from .lib.network import SharedEndpoint
+from .lib.scheduler import AdaptiveInterval, FleetPoller, PollListener
+from .lib.snapshot import DeviceSnapshot
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.storage import Store
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 
-from .constant import DOMAIN, MAX_ERRORS, DISCOVERY_TIMEOUT, COORDINATORS, DISPATCH_DEVICE_DISCOVERED
+from .constant import DOMAIN, MAX_ERRORS, DISCOVERY_TIMEOUT, COORDINATORS, DISPATCH_DEVICE_DISCOVERED, POLL_INTERVAL, \
+    MAX_POLLS_IN_FLIGHT, POLL_INTERVAL_MIN, POLL_INTERVAL_MAX, FAST_POLL_WINDOW, STORAGE_KEY, STORAGE_VERSION, \
+    SNAPSHOT_SAVE_DELAY
 from .lib.gree_device import DeviceInfo
 
 _LOGGER = logging.getLogger(__name__)
 
 
-class DeviceDataUpdateCoordinator(DataUpdateCoordinator):
-    """Manages polling for state changes from the device."""
+class DeviceDataUpdateCoordinator(DataUpdateCoordinator, PollListener):
+    """Manages polling for state changes from the device.
 
-    def __init__(self, hass: HomeAssistant, device: Device) -> None:
+    When a fleet poller is given it owns the polling schedule and hands the
+    results over through `poll_finished`, otherwise the coordinator polls on
+    its own timer. Either way the interval adapts to how often the device
+    changes.
+
+    The properties that changed since listeners were last updated are kept
+    as a mask, entities check it with `changed` to skip writing unchanged state.
+    """
+
+    def __init__(self, hass: HomeAssistant, device: Device, poller: FleetPoller | None = None) -> None:
         """Initialize the data update coordinator."""
         DataUpdateCoordinator.__init__(
             self,
             hass,
             _LOGGER,
             name=f"{DOMAIN}-{device.device_info.name}",
-            update_interval=timedelta(seconds=60),
+            update_interval=None if poller else timedelta(seconds=POLL_INTERVAL),
         )
         self.device = device
         self._error_count = 0
+        self._poller = poller
+        self._interval = None if poller else AdaptiveInterval(POLL_INTERVAL_MIN, POLL_INTERVAL_MAX, FAST_POLL_WINDOW)
+        self._changed = 0
+        device.subscribe(self._state_changed)
+
+    def _state_changed(self, change: StateChange) -> None:
+        self._changed |= change.mask
+
+    def changed(self, mask: int) -> bool:
+        """Return True if any property of the mask changed since listeners were last updated."""
+        return bool(self._changed & mask)
+
+    @callback
+    def async_update_listeners(self) -> None:
+        """Update all registered listeners, then start collecting changes anew."""
+        super().async_update_listeners()
+        self._changed = 0
+
+    def _update_failure(self, error: Exception) -> UpdateFailed | None:
+        """Return the failure to report for a poll error, None if it is tolerated."""
+        if isinstance(error, DeviceNotBoundError):
+            return UpdateFailed(f"Device {self.name} is unavailable")
+
+        self._error_count += 1
+
+        # Under normal conditions GREE units timeout every once in a while
+        if self.last_update_success and self._error_count >= MAX_ERRORS:
+            _LOGGER.warning(
+                "Device is unavailable: %s (%s)",
+                self.name,
+                self.device.device_info,
+            )
+            return UpdateFailed(f"Device {self.name} is unavailable")
+        return None
 
     async def _async_update_data(self):
         """Update the state of the device."""
         try:
-            await self.device.update_state()
-        except DeviceNotBoundError as error:
-            raise UpdateFailed(f"Device {self.name} is unavailable") from error
-        except DeviceTimeoutError as error:
-            self._error_count += 1
-
-            # Under normal conditions GREE units timeout every once in a while
-            if self.last_update_success and self._error_count >= MAX_ERRORS:
-                _LOGGER.warning(
-                    "Device is unavailable: %s (%s)",
-                    self.name,
-                    self.device.device_info,
-                )
-                raise UpdateFailed(f"Device {self.name} is unavailable") from error
+            changed = await self.device.update_state()
+        except (DeviceNotBoundError, DeviceTimeoutError) as error:
+            failure = self._update_failure(error)
+            if failure is not None:
+                raise failure from error
+            return
+
+        if self._interval is not None:
+            seconds = self._interval.observe(changed, time.monotonic())
+            self.update_interval = timedelta(seconds=seconds)
+
+    def poll_finished(self, device: Device, error: Exception | None) -> None:
+        """Handle the result of a poll made by the fleet poller."""
+        if error is None:
+            self.async_set_updated_data(None)
+        elif isinstance(error, (DeviceNotBoundError, DeviceTimeoutError)):
+            failure = self._update_failure(error)
+            if failure is not None:
+                self.async_set_update_error(failure)
+            else:
+                self.async_set_updated_data(None)
+        else:
+            _LOGGER.error("Unexpected error fetching %s data: %s", self.name, error)
+            self.async_set_update_error(error)
 
     async def push_state_update(self):
         """Send state updates to the physical device."""
+        if self._poller is not None:
+            self._poller.activity(self.device)
+        elif self._interval is not None:
+            self._interval.activity(time.monotonic())
+            self.update_interval = timedelta(seconds=self._interval.current)
+
         try:
-            return await self.device.push_state_update()
+            await self.device.push_state_update()
         except DeviceTimeoutError:
             _LOGGER.warning(
                 "Timeout send state update to: %s (%s)",
                 self.name,
                 self.device.device_info,
             )
+            return
+
+        # Other entities of the device pick up the acknowledged values right away
+        self.async_update_listeners()
 
 
 class DiscoveryService(Listener):
     """Discovery event handler for gree devices."""
 
-    def __init__(self, hass: HomeAssistant) -> None:
-        """Initialize discovery service."""
+    def __init__(self, hass: HomeAssistant, shared_endpoint: bool = True) -> None:
+        """Initialize discovery service.
+
+        With `shared_endpoint` every device talks over a single UDP socket,
+        otherwise each device keeps a socket of its own.
+        """
         super().__init__()
         self.hass = hass
+        self.endpoint = SharedEndpoint() if shared_endpoint else None
+        self.poller = FleetPoller(
+            POLL_INTERVAL,
+            MAX_POLLS_IN_FLIGHT,
+            min_interval=POLL_INTERVAL_MIN,
+            max_interval=POLL_INTERVAL_MAX,
+            fast_window=FAST_POLL_WINDOW,
+        )
 
         self.discovery = Discovery(DISCOVERY_TIMEOUT)
         self.discovery.add_listener(self)
 
+        self.store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self.snapshot = DeviceSnapshot()
+        self._restoring = {}
+
         hass.data[DOMAIN].setdefault(COORDINATORS, [])
 
+    async def async_restore(self) -> int:
+        """Bring up the devices of the stored snapshot without scanning or binding.
+
+        Every restored device is polled right away with its cached key, each
+        in its own task so an unreachable one doesn't hold the others back.
+        The scans that follow only reconcile address and key changes.
+
+        Returns:
+            int: Number of devices restored
+        """
+        self.snapshot = DeviceSnapshot(await self.store.async_load())
+
+        for mac in self.snapshot:
+            device = self.snapshot.restore(mac, endpoint=self.endpoint)
+            if device is None:
+                continue
+            _LOGGER.info(
+                "Restoring Gree device %s at %s:%i",
+                device.device_info.name,
+                device.device_info.ip,
+                device.device_info.port,
+            )
+            coordo = self._add_coordinator(device)
+            self._restoring[mac] = self.hass.async_create_task(self._async_start_restored(coordo))
+        return len(self._restoring)
+
+    async def _async_start_restored(self, coordo: DeviceDataUpdateCoordinator) -> None:
+        try:
+            await coordo.async_refresh()
+            self._start(coordo)
+        finally:
+            self._restoring.pop(coordo.device.device_info.mac, None)
+
     async def device_found(self, device_info: DeviceInfo) -> None:
         """Handle new device found on the network."""
 
-        device = Device(device_info)
-        try:
-            await device.bind()
-        except DeviceNotBoundError:
-            _LOGGER.error("Unable to bind to gree device: %s", device_info)
-        except DeviceTimeoutError:
-            _LOGGER.error("Timeout trying to bind to gree device: %s", device_info)
+        coordo = self.discovery.registry.attached(device_info.mac)
+        if coordo is not None:
+            # Restored from the snapshot, only check it still matches
+            await self._reconcile(coordo, device_info)
+            return
+
+        device = Device(device_info, endpoint=self.endpoint)
+        await self._bind(device)
 
         _LOGGER.info(
             "Adding Gree device %s at %s:%i",
@@ -93,15 +213,70 @@ class DiscoveryService(Listener):
             device.device_info.ip,
             device.device_info.port,
         )
-        coordo = DeviceDataUpdateCoordinator(self.hass, device)
-        self.hass.data[DOMAIN][COORDINATORS].append(coordo)
+        coordo = self._add_coordinator(device)
         await coordo.async_refresh()
+        self._save_snapshot(device)
+        self._start(coordo)
 
+    async def _bind(self, device: Device) -> None:
+        try:
+            await device.bind()
+        except DeviceNotBoundError:
+            _LOGGER.error("Unable to bind to gree device: %s", device.device_info)
+        except DeviceTimeoutError:
+            _LOGGER.error("Timeout trying to bind to gree device: %s", device.device_info)
+
+    def _add_coordinator(self, device: Device) -> DeviceDataUpdateCoordinator:
+        coordo = DeviceDataUpdateCoordinator(self.hass, device, self.poller)
+        self.hass.data[DOMAIN][COORDINATORS].append(coordo)
+        self.discovery.registry.attach(device.device_info.mac, coordo)
+        return coordo
+
+    def _start(self, coordo: DeviceDataUpdateCoordinator) -> None:
+        self.poller.add(coordo.device, coordo)
         async_dispatcher_send(self.hass, DISPATCH_DEVICE_DISCOVERED, coordo)
 
+    async def _reconcile(self, coordo: DeviceDataUpdateCoordinator, device_info: DeviceInfo) -> None:
+        """Bring a restored device in line with what the scan found."""
+        restoring = self._restoring.pop(device_info.mac, None)
+        if restoring is not None:
+            await restoring
+
+        device = coordo.device
+        moved = device.device_info.ip != device_info.ip or device.device_info.port != device_info.port
+        if moved:
+            device.device_info.ip = device_info.ip
+            device.device_info.port = device_info.port
+
+        if device.last_confirmed is None:
+            # Never answered with the cached key, the device may have been reset
+            _LOGGER.info("Binding again to restored gree device: %s", device.device_info)
+            await self._bind(device)
+        elif not moved:
+            return
+
+        await coordo.async_refresh()
+        self._save_snapshot(device)
+
+    def _save_snapshot(self, device: Device) -> None:
+        if self.snapshot.record(device):
+            self.store.async_delay_save(self.snapshot.as_dict, SNAPSHOT_SAVE_DELAY)
+
+    def close(self) -> None:
+        """Stop polling and release the shared UDP socket."""
+        for task in self._restoring.values():
+            task.cancel()
+        self._restoring.clear()
+        self.poller.stop()
+        self.discovery.close()
+        if self.endpoint is not None:
+            self.endpoint.close()
+
     async def device_update(self, device_info: DeviceInfo) -> None:
         """Handle updates in device information, update if ip has changed."""
-        for coordinator in self.hass.data[DOMAIN][COORDINATORS]:
-            if coordinator.device.device_info.mac == device_info.mac:
-                coordinator.device.device_info.ip = device_info.ip
-                await coordinator.async_refresh()
+        coordinator = self.discovery.registry.attached(device_info.mac)
+        if coordinator is not None:
+            coordinator.device.device_info.ip = device_info.ip
+            coordinator.device.device_info.port = device_info.port
+            await coordinator.async_refresh()
+            self._save_snapshot(coordinator.device)
@@ -1,43 +1,89 @@
 """Config flow for Gree."""
+from collections.abc import Awaitable
+from ipaddress import IPv4Network
 from typing import Any
 
+import voluptuous as vol
+
 from homeassistant.components.network import async_get_ipv4_broadcast_addresses
-from homeassistant.config_entries import ConfigFlow
-from homeassistant.core import HomeAssistant
+from homeassistant.config_entries import ConfigEntry, OptionsFlow
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.helpers import config_entry_flow
 
-from .constant import DISCOVERY_TIMEOUT, DOMAIN
+from .constant import CONF_SCAN_NETWORKS, DISCOVERY_TIMEOUT, DOMAIN
 from .lib.discovery import Discovery
 
+# Largest network a sweep is allowed to cover
+MIN_SWEEP_PREFIX = 16
+
+
+def parse_networks(value: str) -> list[IPv4Network]:
+    """Parse a comma separated list of CIDR ranges.
+
+    Raises:
+        ValueError: If a range is invalid or larger than a /16
+    """
+    networks = [IPv4Network(part.strip(), strict=False) for part in value.split(",") if part.strip()]
+    for network in networks:
+        if network.prefixlen < MIN_SWEEP_PREFIX:
+            raise ValueError(f"{network} is larger than a /{MIN_SWEEP_PREFIX}")
+    return networks
+
 
 async def _async_has_devices(hass: HomeAssistant) -> bool:
     """Return if there are devices that can be discovered."""
     gree_discovery = Discovery(DISCOVERY_TIMEOUT)
     bcast_addr = list(await async_get_ipv4_broadcast_addresses(hass))
-    devices = await gree_discovery.scan(
-        wait_for=DISCOVERY_TIMEOUT, bcast_ifaces=bcast_addr
-    )
+    try:
+        devices = await gree_discovery.scan(
+            wait_for=DISCOVERY_TIMEOUT, bcast_ifaces=bcast_addr
+        )
+    finally:
+        # Release the socket and the dispatch workers of the probe
+        gree_discovery.close()
     return len(devices) > 0
 
 
-class GreeLanFlowHandler(ConfigFlow, domain=DOMAIN):
-    """Handle a AdGuard Home config flow."""
+class GreeLanFlowHandler(config_entry_flow.DiscoveryFlowHandler[Awaitable[bool]], domain=DOMAIN):
+    """Handle a Gree config flow."""
 
-    async def _show_setup_form(
-            self, errors: dict[str, str] | None = None
-    ) -> FlowResult:
-        """Show the setup form to the user."""
-        return self.async_show_form(
-            step_id="user",
-            errors=errors or {},
-        )
+    def __init__(self) -> None:
+        """Initialize the discovery config flow."""
+        super().__init__(DOMAIN, "Gree Fan", _async_has_devices)
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry: ConfigEntry) -> OptionsFlow:
+        """Get the options flow for this handler."""
+        return GreeLanOptionsFlowHandler(config_entry)
+
+
+class GreeLanOptionsFlowHandler(OptionsFlow):
+    """Handle Gree options, the networks swept with unicast scans."""
 
-    async def async_step_user(
+    def __init__(self, config_entry: ConfigEntry) -> None:
+        """Initialize the options flow."""
+        self.config_entry = config_entry
+
+    async def async_step_init(
             self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
-        """Handle a flow initiated by the user."""
-        return await self._show_setup_form(user_input)
-
+        """Manage the options."""
+        errors = {}
+        if user_input is not None:
+            try:
+                networks = parse_networks(user_input.get(CONF_SCAN_NETWORKS, ""))
+            except ValueError:
+                errors[CONF_SCAN_NETWORKS] = "invalid_networks"
+            else:
+                return self.async_create_entry(
+                    title="", data={CONF_SCAN_NETWORKS: ", ".join(str(n) for n in networks)}
+                )
 
-config_entry_flow.register_discovery_flow(DOMAIN, "Gree Fan", _async_has_devices)
+        current = self.config_entry.options.get(CONF_SCAN_NETWORKS, "")
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema({vol.Optional(CONF_SCAN_NETWORKS, default=current): str}),
+            errors=errors,
+        )
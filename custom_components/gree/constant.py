@@ -7,3 +7,19 @@ DISCOVERY_TIMEOUT = 8
 DISPATCH_DEVICE_DISCOVERED = "gree_device_discovered"
 DISPATCHERS = "dispatchers"
 MAX_ERRORS = 2
+POLL_INTERVAL = 60
+POLL_INTERVAL_MIN = 10
+POLL_INTERVAL_MAX = 600
+FAST_POLL_WINDOW = 120
+MAX_POLLS_IN_FLIGHT = 8
+SERVICE_SET_PACKET_TRACE = "set_packet_trace"
+SERVICE_EXPORT_PACKET_TRACE = "export_packet_trace"
+SERVICE_EXPORT_METRICS = "export_metrics"
+ATTR_MAC = "mac"
+ATTR_SIZE = "size"
+CONF_SCAN_NETWORKS = "scan_networks"
+
+# Warm start snapshot of known devices
+STORAGE_KEY = f"{DOMAIN}.devices"
+STORAGE_VERSION = 1
+SNAPSHOT_SAVE_DELAY = 10
@@ -0,0 +1,46 @@
+"""Diagnostics support for Gree."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .constant import DATA_DISCOVERY_SERVICE, DOMAIN, COORDINATORS
+from .lib.metrics import METRICS
+
+TO_REDACT = {"device_key", "key"}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Return the devices and their network metrics."""
+    devices = []
+    for coordinator in hass.data.get(DOMAIN, {}).get(COORDINATORS, []):
+        device = coordinator.device
+        info = device.device_info
+        devices.append(
+            {
+                "mac": info.mac,
+                "name": info.name,
+                "ip": info.ip,
+                "port": info.port,
+                "mid": info.mid,
+                "type_name": info.d_type,
+                "hid": device.hid,
+                "version": device.version,
+                "device_key": device.device_key,
+                "bound": bool(device.device_key),
+                "last_update_success": coordinator.last_update_success,
+                "properties": device.properties,
+                **device.session_info,
+            }
+        )
+
+    discovery_service = hass.data.get(DATA_DISCOVERY_SERVICE)
+    return {
+        "options": dict(entry.options),
+        "known_devices": len(discovery_service.discovery.registry) if discovery_service else 0,
+        "devices": async_redact_data(devices, TO_REDACT),
+        "metrics": METRICS.snapshot(),
+    }
@@ -0,0 +1,33 @@
+"""Base entity for Gree devices."""
+from __future__ import annotations
+
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .bridge import DeviceDataUpdateCoordinator
+from .lib.enums import Props, prop_mask
+
+
+class GreeEntity(CoordinatorEntity[DeviceDataUpdateCoordinator]):
+    """Entity of a device that only writes its state when it changed.
+
+    Subclasses list the device properties their state is made of in `_props`.
+    Coordinator updates where none of them changed, and availability stayed
+    the same, don't reach the state machine.
+    """
+
+    _props: tuple[Props, ...] = ()
+
+    def __init__(self, coordinator: DeviceDataUpdateCoordinator) -> None:
+        """Initialize the entity."""
+        super().__init__(coordinator)
+        self._props_mask = prop_mask(self._props)
+        self._written_available = None
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write the state if one of the entity's properties or the availability changed."""
+        available = self.available
+        if available != self._written_available or self.coordinator.changed(self._props_mask):
+            self._written_available = available
+            self.async_write_ha_state()
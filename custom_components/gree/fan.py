@@ -10,12 +10,13 @@ from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.util.percentage import ranged_value_to_percentage, int_states_in_range, percentage_to_ranged_value
 
 from .bridge import DeviceDataUpdateCoordinator
 from .constant import DOMAIN, COORDINATORS, DISPATCHERS, DISPATCH_DEVICE_DISCOVERED
-from .lib.enums import Rotate, LRRotateAngle
+from .entity import GreeEntity
+from .lib.enums import Props, Rotate, LRRotateAngle
+from .lib.features import Capability
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -40,8 +41,9 @@ async def async_setup_entry(
     )
 
 
-class GreeFanEntity(FanEntity, CoordinatorEntity[DeviceDataUpdateCoordinator]):
+class GreeFanEntity(FanEntity, GreeEntity):
     _attr_supported_features = FanEntityFeature.SET_SPEED
+    _props = (Props.POWER, Props.FAN_SPEED, Props.ROTATE)
 
     def __init__(self, coordinator: DeviceDataUpdateCoordinator, max_step=12) -> None:
         """Initialize the Gree device."""
@@ -50,8 +52,7 @@ class GreeFanEntity(FanEntity, CoordinatorEntity[DeviceDataUpdateCoordinator]):
         self._mac = coordinator.device.device_info.mac
         self._step_range: tuple[int, int] | None = (1, max_step) if max_step else None
         self._attr_speed_count = max_step
-        features = coordinator.device.device_info.support_features()
-        if any([f.rotate() for f in features]):
+        if coordinator.device.device_info.capabilities & Capability.ROTATE:
             self._attr_supported_features = FanEntityFeature.SET_SPEED | FanEntityFeature.OSCILLATE
 
     @property
@@ -72,9 +73,10 @@ class GreeFanEntity(FanEntity, CoordinatorEntity[DeviceDataUpdateCoordinator]):
         _LOGGER.debug("Turning on fan for device %s", self._name)
 
         self.coordinator.device.power = True
+        if percentage is not None:
+            self.coordinator.device.fan_speed = self._percentage_to_speed(percentage)
         await self.coordinator.push_state_update()
         self.async_write_ha_state()
-        await self.async_set_percentage(percentage)
 
     async def async_turn_off(self) -> None:
         """Turn off the device."""
@@ -108,13 +110,15 @@ class GreeFanEntity(FanEntity, CoordinatorEntity[DeviceDataUpdateCoordinator]):
             return super().speed_count
         return int_states_in_range(self._step_range)
 
+    def _percentage_to_speed(self, percentage: int) -> int:
+        if self._step_range:
+            return math.ceil(percentage_to_ranged_value(self._step_range, percentage))
+        return percentage
+
     async def async_set_percentage(self, percentage: int) -> None:
         if percentage is None:
             return
-        speed = percentage
-        if self._step_range:
-            speed = math.ceil(percentage_to_ranged_value(self._step_range, percentage))
-        self.coordinator.device.fan_speed = speed
+        self.coordinator.device.fan_speed = self._percentage_to_speed(percentage)
         await self.coordinator.push_state_update()
         self.async_write_ha_state()
 
@@ -0,0 +1,127 @@
+"""Packet codec shared by the discovery, bind, status and cmd paths.
+
+AES cipher objects are cached per key, ECB mode keeps no state between calls so
+one object can serve every packet for a device.
+"""
+import base64
+import binascii
+import json
+
+from Crypto.Cipher import AES
+
+GENERIC_KEY = "a3K8Bx%2r8Y7#xDh"
+
+_BLOCK_SIZE = 16
+_CLOSE_BRACE = ord("}")
+
+_CIPHERS = {}
+
+
+def get_cipher(key: str = GENERIC_KEY):
+    """Return the cached AES cipher for the key, creating it on first use."""
+    cipher = _CIPHERS.get(key)
+    if cipher is None:
+        cipher = _CIPHERS[key] = AES.new(key.encode(), AES.MODE_ECB)
+    return cipher
+
+
+def forget_key(key: str) -> None:
+    """Drop the cached cipher of a key that is no longer in use."""
+    if key and key != GENERIC_KEY:
+        _CIPHERS.pop(key, None)
+
+
+def packet_key(obj, key: str = GENERIC_KEY) -> str:
+    """Return the key a packet is encrypted with, `i: 1` marks the generic key."""
+    return GENERIC_KEY if obj.get("i") == 1 else key
+
+
+def _unpadded_length(buf) -> int:
+    """Return the length of the JSON document in a decrypted buffer.
+
+    Devices pad with PKCS7, the padding length is read from the last byte and
+    trusted if the byte before the padding closes the JSON object. Anything
+    else falls back to searching for the last closing brace.
+    """
+    size = len(buf)
+    pad = buf[-1] if size else 0
+    if 0 < pad <= _BLOCK_SIZE and pad < size and buf[size - pad - 1] == _CLOSE_BRACE:
+        return size - pad
+    return buf.rindex(b"}") + 1
+
+
+def decrypt_payload(payload, key: str = GENERIC_KEY):
+    """Decrypt a base64 encoded `pack` into a JSON object.
+
+    The pipeline stays in bytes: the ciphertext is decrypted into a single
+    buffer, the padding is cut off in place and the JSON is parsed from it.
+    """
+    decoded = binascii.a2b_base64(payload)
+    buf = bytearray(len(decoded))
+    get_cipher(key).decrypt(decoded, output=buf)
+    del buf[_unpadded_length(buf):]
+    return json.loads(buf)
+
+
+def decrypt_payloads(payloads, key: str = GENERIC_KEY) -> list:
+    """Decrypt several `pack`s encrypted with the same key in a single cipher call.
+
+    ECB encrypts every block on its own, so the ciphertexts can be joined,
+    decrypted at once and split again at their original lengths.
+
+    Returns:
+        list: The JSON object of each payload in order, None for payloads
+              that can't be decoded
+    """
+    decoded = []
+    for payload in payloads:
+        try:
+            data = binascii.a2b_base64(payload)
+        except (binascii.Error, TypeError):
+            data = None
+        decoded.append(data if data and len(data) % _BLOCK_SIZE == 0 else None)
+
+    joined = b"".join(data for data in decoded if data is not None)
+    buf = bytearray(len(joined))
+    if joined:
+        get_cipher(key).decrypt(joined, output=buf)
+
+    results = []
+    offset = 0
+    for data in decoded:
+        if data is None:
+            results.append(None)
+            continue
+        chunk = buf[offset:offset + len(data)]
+        offset += len(data)
+        try:
+            del chunk[_unpadded_length(chunk):]
+            results.append(json.loads(chunk))
+        except ValueError:
+            results.append(None)
+    return results
+
+
+def encrypt_payload(payload, key: str = GENERIC_KEY) -> str:
+    """Encrypt a JSON object into a base64 encoded `pack`."""
+    def pad(s):
+        bs = 16
+        return s + (bs - len(s) % bs) * chr(bs - len(s) % bs)
+
+    encrypted = get_cipher(key).encrypt(pad(json.dumps(payload)).encode())
+    return base64.b64encode(encrypted).decode()
+
+
+def encode_packet(obj, key: str = GENERIC_KEY) -> bytes:
+    """Serialize a packet envelope, encrypting its `pack` if there is one."""
+    if obj.get("pack"):
+        obj = dict(obj, pack=encrypt_payload(obj["pack"], packet_key(obj, key)))
+    return json.dumps(obj).encode()
+
+
+def decode_packet(data, key: str = GENERIC_KEY):
+    """Parse a packet envelope, decrypting its `pack` if there is one."""
+    obj = json.loads(data)
+    if obj.get("pack"):
+        obj["pack"] = decrypt_payload(obj["pack"], packet_key(obj, key))
+    return obj
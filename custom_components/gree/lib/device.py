@@ -1,11 +1,13 @@
 import asyncio
 import logging
 import re
+from typing import AsyncIterator, Callable, NamedTuple
 
-from custom_components.gree.lib import network
-from custom_components.gree.lib.enums import Props
+from custom_components.gree.lib import codec, network
+from custom_components.gree.lib.enums import PROP_COUNT, PROP_INDEX, PROP_NAMES, WIRE_INDEX, Props
 from custom_components.gree.lib.exceptions import DeviceNotBoundError, DeviceTimeoutError
 from custom_components.gree.lib.gree_device import GreeDeviceInfo
+from custom_components.gree.lib.trace import DEFAULT_TRACE_SIZE, PacketTrace
 
 """
 COPY FROM https://github.com/cmroche/greeclimate/blob/master/greeclimate/device.py
@@ -13,20 +15,88 @@ COPY FROM https://github.com/cmroche/greeclimate/blob/master/greeclimate/device.
 UPDATE BY jieen1
 """
 
+# Seconds property changes are held back so changes made together go out in one cmd packet
+COALESCE_WINDOW = 0.005
+
+_POWER = PROP_INDEX[Props.POWER]
+_MODE = PROP_INDEX[Props.MODE]
+_FAN_SPEED = PROP_INDEX[Props.FAN_SPEED]
+_ROTATE = PROP_INDEX[Props.ROTATE]
+_LR_ANGLE = PROP_INDEX[Props.LR_ANGLE]
+
+
+class StateChange(NamedTuple):
+    """Properties of a device that changed at once."""
+    mask: int  # bit PROP_INDEX[prop] is set for each changed property
+    values: dict  # protocol name -> (old value, new value)
+
+    def __contains__(self, prop: Props) -> bool:
+        return bool(self.mask >> PROP_INDEX[prop] & 1)
+
 
 class Device:
+    """A physical device and its last known state.
+
+    The state is a fixed slot array indexed by the `Props` ordinal, changes
+    waiting to be pushed are a bitmask over the same ordinals.
+
+    Subscribers get a `StateChange` whenever a status reply, a cmd ack or a
+    local property set changes the state, never for values that stayed the same.
+    """
+
+    __slots__ = (
+        "_logger",
+        "device_info",
+        "device_key",
+        "_session",
+        "hid",
+        "version",
+        "hid_probed",
+        "_state",
+        "_static_ip",
+        "_dirty",
+        "last_confirmed",
+        "last_acked",
+        "_coalesce_window",
+        "_flush",
+        "_subscribers",
+    )
+
+    def __init__(self, device_info: GreeDeviceInfo, endpoint: network.SharedEndpoint = None,
+                 coalesce_window: float = COALESCE_WINDOW, hedge: bool = False):
+        """Initialize the device.
 
-    def __init__(self, device_info: GreeDeviceInfo):
+        Args:
+            device_info (GreeDeviceInfo): Information about the physical device
+            endpoint (SharedEndpoint): Optional UDP socket shared by the whole fleet,
+                                       a socket per device is used when omitted
+            coalesce_window (float): Seconds to wait for more property changes
+                                     before a cmd packet is sent
+            hedge (bool): Send a duplicate request when a reply is later than
+                          the device's p95 latency
+        """
         self._logger = logging.getLogger(__name__)
 
         self.device_info = device_info
         self.device_key = None
+        self._session = network.DeviceSession(device_info, endpoint=endpoint, hedge=hedge)
 
         """ Device properties """
         self.hid = None
         self.version = None
-        self._properties = None
-        self._dirty = []
+        # Whether the hid was asked for already, devices without one simply omit it
+        self.hid_probed = False
+        self._state = [None] * PROP_COUNT
+        # Address the static properties were fetched from
+        self._static_ip = None
+        self._dirty = 0
+        # Event loop time of the last status reply or cmd acknowledgement
+        self.last_confirmed = None
+        # Event loop time of the last cmd acknowledgement alone, the poll it makes redundant is skipped
+        self.last_acked = None
+        self._coalesce_window = coalesce_window
+        self._flush = None
+        self._subscribers = []
 
     async def bind(self, key=None):
         """Run the binding procedure.
@@ -52,56 +122,150 @@ class Device:
 
         self._logger.info("Starting device binding to %s", str(self.device_info))
 
+        old_key = self.device_key
         try:
             if key:
                 self.device_key = key
             else:
-                self.device_key = await network.bind_device(
-                    self.device_info, announce=False
-                )
+                self.device_key = await self._session.bind(announce=False)
         except asyncio.TimeoutError:
             raise DeviceTimeoutError
 
+        if old_key != self.device_key:
+            codec.forget_key(old_key)
+
         if not self.device_key:
             raise DeviceNotBoundError
         else:
             self._logger.info("Bound to device using key %s", self.device_key)
 
-    async def request_version(self) -> None:
-        """Request the firmware version from the device."""
-        ret = await network.request_state(["hid"], self.device_info, self.device_key)
-        self.hid = ret.get("hid")
+    def restore(self, key: str, hid: str = None, hid_probed: bool = False) -> None:
+        """Restore the key and firmware learned in a previous session, no packet is sent.
+
+        Args:
+            key (str): The device key negotiated by an earlier bind
+            hid (str): The firmware id reported earlier, if any
+            hid_probed (bool): Whether the hid was asked for, so a missing one is not asked again
+        """
+        if key != self.device_key:
+            codec.forget_key(self.device_key)
+        self.device_key = key
+        if hid or hid_probed:
+            self._set_hid(hid)
+
+    def _set_hid(self, hid: str) -> None:
+        self.hid = hid
+        self.hid_probed = True
 
         # Ex: hid = 362001000762+U-CS532AE(LT)V3.31.bin
         if self.hid:
             match = re.search(r"(?<=V)([\d.]+)\.bin$", self.hid)
             self.version = match and match.group(1)
 
-    async def update_state(self):
-        """Update the internal state of the device structure of the physical device"""
+    async def update_state(self) -> bool:
+        """Update the internal state of the device structure of the physical device
+
+        Returns:
+            bool: True if the reported properties differ from the previous poll
+        """
         if not self.device_key:
             await self.bind()
 
         self._logger.debug("Updating device properties for (%s)", str(self.device_info))
 
-        props = self.device_info.d_pros
+        props = self.device_info.d_poll_pros
+        # Static properties are only asked for again once the device moved
+        fetch_static = self._static_ip != self.device_info.ip
+        if fetch_static:
+            props = [*props, *self.device_info.d_static_pros]
+        # The firmware version rides along with the first status request,
+        # whatever it returns, a missing hid included, is never asked again
+        probe = not self.hid_probed
+        if probe:
+            props = [*props, "hid"]
 
         try:
-            self._properties = await network.request_state(
-                props, self.device_info, self.device_key
-            )
-
-            # This check should prevent need to do version & device overrides
-            # to correctly compute the temperature. Though will need to confirm
-            # that it resolves all possible cases.
-            if not self.hid:
-                await self.request_version()
-
+            properties = await self._session.request_state(props, self.device_key)
+            self.last_confirmed = asyncio.get_running_loop().time()
         except asyncio.TimeoutError:
             raise DeviceTimeoutError
 
+        if probe:
+            self._set_hid(properties.pop("hid", None))
+        if fetch_static:
+            self._static_ip = self.device_info.ip
+
+        return self._apply(properties) != 0
+
+    def _apply(self, values: dict) -> int:
+        """Store reported values in their slots, returns the mask of the slots that changed."""
+        state = self._state
+        mask = 0
+        changes = {} if self._subscribers else None
+        for name, value in values.items():
+            i = WIRE_INDEX.get(name)
+            if i is not None and state[i] != value:
+                if changes is not None:
+                    changes[name] = (state[i], value)
+                state[i] = value
+                mask |= 1 << i
+        if mask and changes is not None:
+            self._notify(StateChange(mask, changes))
+        return mask
+
+    def subscribe(self, callback: Callable[[StateChange], None]) -> Callable[[], None]:
+        """Call `callback` with every state change, returns a function that unsubscribes."""
+        self._subscribers.append(callback)
+
+        def unsubscribe() -> None:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    async def changes(self) -> AsyncIterator[StateChange]:
+        """Yield the state changes from now on, until the caller stops iterating."""
+        queue = asyncio.Queue()
+        unsubscribe = self.subscribe(queue.put_nowait)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            unsubscribe()
+
+    def _notify(self, change: StateChange) -> None:
+        for callback in list(self._subscribers):
+            try:
+                callback(change)
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception("State change subscriber failed")
+
+    @property
+    def properties(self) -> dict:
+        """Return the known properties keyed by their protocol name."""
+        return {PROP_NAMES[i]: value for i, value in enumerate(self._state) if value is not None}
+
     async def push_state_update(self):
-        """Push any pending state updates to the unit"""
+        """Push any pending state updates to the unit
+
+        Updates pushed within the coalescing window, from any entity, share a
+        single cmd packet and all callers wait for that packet.
+        """
+        if not self._dirty:
+            return
+
+        if self._flush is None:
+            self._flush = asyncio.get_running_loop().create_task(self._flush_state_update())
+        # Shielded so one cancelled caller doesn't cancel the packet for the others
+        await asyncio.shield(self._flush)
+
+    async def _flush_state_update(self):
+        """Send every property changed so far in one cmd packet"""
+        try:
+            await asyncio.sleep(self._coalesce_window)
+        finally:
+            self._flush = None
+
         if not self._dirty:
             return
 
@@ -111,72 +275,108 @@ class Device:
         self._logger.debug("Pushing state updates to (%s)", str(self.device_info))
 
         props = {}
-        for name in self._dirty:
-            value = self._properties.get(name)
-            self._logger.debug("Sending remote state update %s -> %s", name, value)
-            props[name] = value
+        dirty = self._dirty
+        for i in range(PROP_COUNT):
+            if dirty >> i & 1:
+                value = self._state[i]
+                self._logger.debug("Sending remote state update %s -> %s", PROP_NAMES[i], value)
+                props[PROP_NAMES[i]] = value
 
-        self._dirty.clear()
+        self._dirty = 0
 
         try:
-            await network.send_state(props, self.device_info, key=self.device_key)
+            ack = await self._session.send_state(props, key=self.device_key)
         except asyncio.TimeoutError:
             raise DeviceTimeoutError
 
+        # The ack carries the values the unit applied, no confirming poll is needed
+        self._apply(ack)
+        self.last_confirmed = self.last_acked = asyncio.get_running_loop().time()
+
+    def close(self) -> None:
+        """Release the network session held for the device"""
+        self._session.close()
+        codec.forget_key(self.device_key)
+
+    @property
+    def session_info(self) -> dict:
+        """Return the latency estimate and the requests in flight of the network session"""
+        session = self._session
+        return {
+            "srtt": session.rtt.srtt,
+            "rto": session.rtt.rto,
+            "p95": session.rtt.p95,
+            "in_flight": session.in_flight,
+        }
+
+    @property
+    def trace(self) -> PacketTrace | None:
+        """Return the packet trace of the device, None if tracing is disabled"""
+        return self._session.trace
+
+    def enable_trace(self, size: int = DEFAULT_TRACE_SIZE) -> PacketTrace:
+        """Start recording request/reply pairs into a ring buffer of `size` entries"""
+        trace = self._session.trace
+        if trace is None or trace.size != size:
+            trace = self._session.trace = PacketTrace(size)
+        return trace
+
+    def disable_trace(self) -> None:
+        """Stop recording and drop the packet trace"""
+        self._session.trace = None
+
     def get_property(self, name):
         """Generic lookup of properties tracked from the physical device"""
-        if self._properties:
-            return self._properties.get(name.value)
-        return None
+        return self._state[PROP_INDEX[name]]
 
     def set_property(self, name, value):
         """Generic setting of properties for the physical device"""
-        if not self._properties:
-            self._properties = {}
+        self._set_slot(PROP_INDEX[name], value)
 
-        if self._properties.get(name.value) == value:
-            return
-        else:
-            self._properties[name.value] = value
-            if name.value not in self._dirty:
-                self._dirty.append(name.value)
+    def _set_slot(self, i: int, value) -> None:
+        old = self._state[i]
+        if old != value:
+            self._state[i] = value
+            self._dirty |= 1 << i
+            if self._subscribers:
+                self._notify(StateChange(1 << i, {PROP_NAMES[i]: (old, value)}))
 
     @property
     def power(self) -> bool:
-        return bool(self.get_property(Props.POWER))
+        return bool(self._state[_POWER])
 
     @power.setter
     def power(self, value: int):
-        self.set_property(Props.POWER, int(value))
+        self._set_slot(_POWER, int(value))
 
     @property
     def mode(self) -> int:
-        return self.get_property(Props.MODE)
+        return self._state[_MODE]
 
     @mode.setter
     def mode(self, value: int):
-        self.set_property(Props.MODE, int(value))
+        self._set_slot(_MODE, int(value))
 
     @property
     def fan_speed(self) -> int:
-        return self.get_property(Props.FAN_SPEED)
+        return self._state[_FAN_SPEED]
 
     @fan_speed.setter
     def fan_speed(self, value: int):
-        self.set_property(Props.FAN_SPEED, int(value))
+        self._set_slot(_FAN_SPEED, int(value))
 
     @property
     def rotate(self) -> int:
-        return self.get_property(Props.ROTATE)
+        return self._state[_ROTATE]
 
     @rotate.setter
     def rotate(self, value: int):
-        self.set_property(Props.ROTATE, int(value))
+        self._set_slot(_ROTATE, int(value))
 
     @property
     def lr_angle(self) -> int:
-        return self.get_property(Props.LR_ANGLE)
+        return self._state[_LR_ANGLE]
 
     @lr_angle.setter
     def lr_angle(self, value: int):
-        self.set_property(Props.LR_ANGLE, int(value))
+        self._set_slot(_LR_ANGLE, int(value))
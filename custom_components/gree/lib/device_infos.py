@@ -1,61 +1,86 @@
-from .features import BaseFeature, ModeFeature, FanRotateFeature, FanRotateWithAngleFeature
+from typing import NamedTuple, Tuple, Type
+
+from .enums import PROP_INDEX
+from .features import BaseFeature, Capability, Feature, FanRotateFeature, FanRotateWithAngleFeature, ModeFeature
 from .gree_device import GreeDeviceInfo
 
+# Supported models, one row per device type id: (mid, type name, capabilities).
+# New models only need a row here.
+MODEL_TABLE = (
+    ('828211', "FLZ-09X67Bg", Capability.MODE | Capability.ROTATE | Capability.LR_ANGLE),
+    ('828200', "_828200", Capability.MODE),
+    ('828202', "FL-09T65Bh", Capability.MODE),  # Wet  MidType NOT SUPPORT
+    ('828203', "KS-0705D", Capability.MODE),
+    ('828204', "FSZ-3013Bg7", Capability.MODE | Capability.ROTATE),  # Cycle NOT SUPPORT
+    ('828205', "KS-1501RD", Capability.MODE),  # HotWind NOT SUPPORT
+    ('828208', "FWZ-1201Bg", Capability.MODE | Capability.ROTATE | Capability.LR_ANGLE),  # SwUpDn  PM25 NOT SUPPORT
+    ('828209', "FSZ-20X60Bag3", Capability.MODE | Capability.ROTATE | Capability.LR_ANGLE),  # Cycle  SwUpDn UpDnAngle NOT SUPPORT
+    ('828210', "_828210", Capability.MODE | Capability.ROTATE | Capability.LR_ANGLE),  # HotWind  HotwindOnOff NOT SUPPORT
+    ('828212', "_828212", Capability.MODE | Capability.ROTATE),
+)
+
+# Shared, stateless feature instances, most specific first
+_FEATURES = (
+    BaseFeature(),
+    ModeFeature(),
+    FanRotateWithAngleFeature(),
+    FanRotateFeature(),
+)
+
+
+class DeviceModel(NamedTuple):
+    """Capabilities of one model, compiled once from `MODEL_TABLE`."""
+    mid: str
+    type_name: str
+    device_class: Type[GreeDeviceInfo]
+    capabilities: Capability
+    features: Tuple[Feature, ...]
+    props: Tuple[str, ...]  # every supported property, in Props order
+    poll_props: Tuple[str, ...]  # the columns of a regular status poll
+    static_props: Tuple[str, ...]  # fetched once and on address changes
+
+
+def compile_model(mid: str, type_name: str, capabilities: Capability,
+                  device_class: Type[GreeDeviceInfo] = GreeDeviceInfo) -> DeviceModel:
+    """Build the capability record of a model from its table row."""
+    capabilities |= Capability.BASE
+
+    features = []
+    covered = Capability(0)
+    for feature in _FEATURES:
+        if feature.capability & capabilities == feature.capability and not feature.capability & covered:
+            features.append(feature)
+            covered |= feature.capability
+
+    props = sorted({prop for feature in features for prop in feature.support_pros}, key=PROP_INDEX.__getitem__)
+    return DeviceModel(
+        mid=mid,
+        type_name=type_name,
+        device_class=device_class,
+        capabilities=capabilities,
+        features=tuple(features),
+        props=tuple(prop.value for prop in props),
+        poll_props=tuple(prop.value for prop in props if not prop.static),
+        static_props=tuple(prop.value for prop in props if prop.static),
+    )
+
+
+MODELS = {row[0]: compile_model(*row) for row in MODEL_TABLE}
+
+# Dict view of MODELS kept for existing callers
 DEVICE_MAP = {
-    '828211': {
-        "class": GreeDeviceInfo,
-        "type_name": "FLZ-09X67Bg",
-        "support_features": [BaseFeature(), ModeFeature(), FanRotateWithAngleFeature()]
-    },
-    '828200': {
-        "class": GreeDeviceInfo,
-        "type_name": "_828200",
-        "support_features": [BaseFeature(), ModeFeature()]
-    },
-    '828202': {
-        "class": GreeDeviceInfo,
-        "type_name": "FL-09T65Bh",
-        "support_features": [BaseFeature(), ModeFeature()]
-        # Wet  MidType NOT SUPPORT
-    },
-    '828203': {
-        "class": GreeDeviceInfo,
-        "type_name": "KS-0705D",
-        "support_features": [BaseFeature(), ModeFeature()]
-    },
-    '828204': {
-        "class": GreeDeviceInfo,
-        "type_name": "FSZ-3013Bg7",
-        "support_features": [BaseFeature(), ModeFeature(), FanRotateFeature()]
-        # Cycle NOT SUPPORT
-    },
-    '828205': {
-        "class": GreeDeviceInfo,
-        "type_name": "KS-1501RD",
-        "support_features": [BaseFeature(), ModeFeature()]
-        # HotWind NOT SUPPORT
-    },
-    '828208': {
-        "class": GreeDeviceInfo,
-        "type_name": "FWZ-1201Bg",
-        "support_features": [BaseFeature(), ModeFeature(), FanRotateWithAngleFeature()]
-        # SwUpDn  PM25 NOT SUPPORT
-    },
-    '828209': {
-        "class": GreeDeviceInfo,
-        "type_name": "FSZ-20X60Bag3",
-        "support_features": [BaseFeature(), ModeFeature(), FanRotateWithAngleFeature()]
-        # Cycle  SwUpDn UpDnAngle NOT SUPPORT
-    },
-    '828210': {
-        "class": GreeDeviceInfo,
-        "type_name": "_828210",
-        "support_features": [BaseFeature(), ModeFeature(), FanRotateWithAngleFeature()]
-        # HotWind  HotwindOnOff NOT SUPPORT
-    },
-    '828212': {
-        "class": GreeDeviceInfo,
-        "type_name": "_828212",
-        "support_features": [BaseFeature(), ModeFeature(), FanRotateFeature()]
+    mid: {
+        "class": model.device_class,
+        "type_name": model.type_name,
+        "support_features": list(model.features),
     }
+    for mid, model in MODELS.items()
 }
+
+
+def create_device_info(mid, name, ip, port, mac, brand=None, model=None, version=None) -> GreeDeviceInfo | None:
+    """Create the device info of a supported model, None if the type id is unknown."""
+    spec = MODELS.get(mid)
+    if spec is None:
+        return None
+    return spec.device_class(spec.type_name, name, mid, ip, port, mac, brand, model, version, spec=spec)
@@ -1,19 +1,30 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
+import json
 import logging
+import time
 from asyncio import Task
 from asyncio.events import AbstractEventLoop
-from ipaddress import IPv4Address
-from typing import Coroutine, List
+from ipaddress import IPv4Address, IPv4Network
+from typing import Coroutine, Dict, Iterable, List, Set
 
-from custom_components.gree.lib.device_infos import DEVICE_MAP
-from custom_components.gree.lib.exceptions import DeviceNotBoundError
+from custom_components.gree.lib.device_infos import create_device_info
+from . import codec
 from .gree_device import GreeDeviceInfo
-from .network import BroadcastListenerProtocol, IPAddr
+from .metrics import METRICS, MetricsRegistry
+from .network import BroadcastListenerProtocol, DecryptBatch, IPAddr
+from .registry import DeviceRegistry, RegistryChange
 
 _LOGGER = logging.getLogger(__name__)
 
+DEVICE_PORT = 7000
+SWEEP_RATE = 500  # scan packets per second
+SWEEP_CONCURRENCY = 16
+DISPATCH_QUEUE_SIZE = 1024  # found devices waiting for the listeners
+DISPATCH_WORKERS = 16  # listeners bind and poll new devices, which may take seconds
+
 """
 COPY FROM https://github.com/cmroche/greeclimate/blob/master/greeclimate/discovery.py
 """
@@ -41,6 +52,8 @@ class Discovery(BroadcastListenerProtocol, Listener):
             timeout: int = 2,
             allow_loopback: bool = False,
             loop: AbstractEventLoop = None,
+            registry: DeviceRegistry = None,
+            metrics: MetricsRegistry = None,
     ):
         """Intialized the discovery manager.
 
@@ -48,41 +61,62 @@ class Discovery(BroadcastListenerProtocol, Listener):
             timeout (int): Wait this long for responses to the scan request
             allow_loopback (bool): Allow scanning the loopback interface, default `False`
             loop (AbstractEventLoop): Async event loop
+            registry (DeviceRegistry): Registry to record found devices in, a new one by default
+            metrics (MetricsRegistry): Registry scans and replies are counted in, `METRICS` by default
         """
         super(BroadcastListenerProtocol, self).__init__()
         self._timeout = timeout
         self._allow_loopback = allow_loopback
 
-        self._device_infos = []
+        self.registry = registry if registry is not None else DeviceRegistry()
+        self.metrics = metrics if metrics is not None else METRICS
         self._listeners = []
-        self._tasks = []
+        self._tasks = set()
+
+        # Address each mac replied from in the current scan round, repeated
+        # replies (several interfaces, sweep plus broadcast) are dropped
+        self._round: Dict[str, IPAddr] = {}
+        self._queue = asyncio.Queue(DISPATCH_QUEUE_SIZE)
+        self._workers = []
+        # Scan replies come in bursts under the generic key
+        self._batch = DecryptBatch()
 
         self._loop = loop or asyncio.get_event_loop()
         self._transport = None
 
     # Task management
     @property
-    def tasks(self) -> List[Coroutine]:
+    def tasks(self) -> Set[Task]:
         """Returns the outstanding tasks waiting completion."""
         return self._tasks
 
     @property
     def devices(self) -> List[GreeDeviceInfo]:
         """Return the current known list of devices."""
-        return self._device_infos
+        return self.registry.devices
 
     def _task_done_callback(self, task):
         if task.exception():
             _LOGGER.exception("Uncaught exception", exc_info=task.exception())
-        self._tasks.remove(task)
+        self._tasks.discard(task)
 
     def _create_task(self, coro) -> Task:
         """Create and track tasks that are being created for events."""
         task = self._loop.create_task(coro)
-        self._tasks.append(task)
+        self._tasks.add(task)
         task.add_done_callback(self._task_done_callback)
         return task
 
+    def close(self) -> None:
+        """Close the discovery socket and stop the dispatch workers."""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers.clear()
+        self._batch.cancel()
+        if self._transport is not None:
+            super().close()
+            self._transport = None
+
     # Listener management
     def add_listener(self, listener: Listener) -> List[Coroutine]:
         """Add a listener that will receive discovery events.
@@ -125,72 +159,142 @@ class Discovery(BroadcastListenerProtocol, Listener):
             device
         """
 
-        for index, last_info in enumerate(self._device_infos):
-            if device_info == last_info:
-                if device_info.ip != last_info.ip:
-                    # ip address info may have been updated, so store the new info
-                    # and trigger a `device_update` event.
-                    self._device_infos[index] = device_info
-                    tasks = [l.device_update(device_info) for l in self._listeners]
-                    await asyncio.gather(*tasks, return_exceptions=True)
-                return
-
-        self._device_infos.append(device_info)
+        change = self.registry.upsert(device_info)
+        if change is RegistryChange.MOVED:
+            # ip address info has been updated, trigger a `device_update` event.
+            tasks = [l.device_update(device_info) for l in self._listeners]
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if change is not RegistryChange.ADDED:
+            return
 
         _LOGGER.info("Found gree device %s", str(device_info))
 
         tasks = [l.device_found(device_info) for l in self._listeners]
         await asyncio.gather(*tasks, return_exceptions=True)
 
+    def datagram_received(self, data: bytes, addr: IPAddr) -> None:
+        """Handle an incoming datagram, undecodable ones are counted and dropped.
+
+        Encrypted packs are decrypted in batches, replies repeated within the
+        scan round are dropped before that when the envelope names the device.
+        """
+        if len(data) == 0:
+            return
+        try:
+            obj = json.loads(data)
+        except ValueError:
+            obj = None
+        if not isinstance(obj, dict):
+            self.metrics.discovery.replies += 1
+            self.metrics.discovery.malformed += 1
+            _LOGGER.debug("Dropping undecodable discovery reply from %s", addr[0])
+            return
+
+        cid = obj.get("cid")
+        if cid and self._round.get(cid) == addr:
+            self.metrics.discovery.replies += 1
+            self.metrics.discovery.duplicates += 1
+            return
+
+        if isinstance(obj.get("pack"), str):
+            self._batch.add(obj, codec.packet_key(obj, self._key), lambda decoded: self._decoded(decoded, addr))
+        else:
+            self._decoded(obj, addr)
+
+    def _decoded(self, obj, addr: IPAddr) -> None:
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Received packet from %s:\n%s", addr[0], json.dumps(obj))
+        self.packet_received(obj, addr)
+
     def packet_received(self, obj, addr: IPAddr) -> None:
         """Event called when a packet is received and decoded."""
-        pack = obj.get("pack")
-        if not pack:
-            _LOGGER.error("Received an unexpected response during discovery")
+        self.metrics.discovery.replies += 1
+        pack = obj.get("pack") if isinstance(obj, dict) else None
+        mac = (pack.get("mac") or pack.get("cid")) if isinstance(pack, dict) else None
+        if not mac:
+            self.metrics.discovery.malformed += 1
+            _LOGGER.debug("Dropping unexpected discovery reply from %s", addr[0])
             return
 
+        if self._round.get(mac) == addr:
+            self.metrics.discovery.duplicates += 1
+            return
+        self._round[mac] = addr
+
         mid = pack.get("mid")
-        info = DEVICE_MAP.get(mid)
-        if info is None:
-            raise DeviceNotBoundError(f"type id:{mid} NOT FOUND!")
-        device_info_class = info.get('class')
-        type_name = info.get('type_name')
-        features = info.get("support_features")
-
-        device = (
-            type_name,
-            pack.get("name"),
+        device_info = create_device_info(
             mid,
+            pack.get("name"),
             addr[0],
             addr[1],
-            pack.get("mac") or pack.get("cid"),
+            mac,
             pack.get("brand"),
             pack.get("model"),
             pack.get("ver"),
-            features
         )
-        self._create_task(self.device_found(device_info_class(*device)))
+        if device_info is None:
+            self.metrics.discovery.unknown_models += 1
+            _LOGGER.warning("Ignoring device %s at %s, type id %s is not supported", mac, addr[0], mid)
+            return
+        self.metrics.device(mac).last_seen = time.time()
+        self._dispatch(device_info)
+
+    def _dispatch(self, device_info: GreeDeviceInfo) -> None:
+        """Queue a found device for the listeners, dropping it if the queue is full."""
+        if not self._workers:
+            self._workers = [self._loop.create_task(self._dispatch_worker()) for _ in range(DISPATCH_WORKERS)]
+        try:
+            self._queue.put_nowait(device_info)
+        except asyncio.QueueFull:
+            # Let a later reply of this round or the next round bring it in again
+            self._round.pop(device_info.mac, None)
+            self.metrics.discovery.dropped += 1
+            _LOGGER.warning("Discovery queue is full, dropping %s", device_info.mac)
+
+    async def _dispatch_worker(self) -> None:
+        while True:
+            device_info = await self._queue.get()
+            try:
+                await self.device_found(device_info)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to handle discovered device %s", device_info.mac)
+            finally:
+                self._queue.task_done()
 
     # Discovery
-    async def scan(self, wait_for: int = 0, bcast_ifaces: List[IPv4Address] | None = None) -> List[GreeDeviceInfo]:
+    async def scan(
+            self,
+            wait_for: int = 0,
+            bcast_ifaces: List[IPv4Address] | None = None,
+            networks: List[IPv4Network] | None = None,
+    ) -> List[GreeDeviceInfo]:
         """Sends a discovery broadcast packet on each network interface to
             locate Gree units on the network
 
         Args:
             wait_for (int): Optionally wait this many seconds for discovery
                             and return the devices found.
+            bcast_ifaces (List[IPv4Address]): Broadcast addresses to scan,
+                                              all interfaces by default
+            networks (List[IPv4Network]): Networks to sweep with unicast scan
+                                          packets, for networks that block broadcast
 
         Returns:
             List[DeviceInfo]: List of devices found during this scan
         """
         _LOGGER.info("Scanning for Gree devices ...")
 
+        # A new round, every device gets through once more
+        self._round.clear()
         await self.search_devices(bcast_ifaces)
+        if networks:
+            await self.sweep(networks)
         if wait_for:
             await asyncio.sleep(wait_for)
+            await self._queue.join()
             await asyncio.gather(*self.tasks, return_exceptions=True)
 
-        return self._device_infos
+        return self.registry.devices
 
     def _get_broadcast_addresses(self) -> List[IPv4Address]:
         """Return a list of broadcast addresses for each discovered interface"""
@@ -220,12 +324,60 @@ class Discovery(BroadcastListenerProtocol, Listener):
             bcast_iface,
         )
 
+        await self._open()
+        await self.send({"t": "scan"}, (str(bcast_iface), DEVICE_PORT))
+        self.metrics.discovery.scans += 1
+
+    async def _open(self) -> None:
+        """Open the discovery socket shared by broadcast scans and sweeps."""
         if self._transport is None:
             self._transport, _ = await self._loop.create_datagram_endpoint(
                 lambda: self, local_addr=("0.0.0.0", 0), allow_broadcast=True
             )
 
-        await self.send({"t": "scan"}, (str(bcast_iface), 7000))
+    async def sweep(
+            self,
+            networks: Iterable[IPv4Network],
+            rate: float = SWEEP_RATE,
+            concurrency: int = SWEEP_CONCURRENCY,
+    ) -> int:
+        """Send a unicast scan packet to every host of the given networks.
+
+        Replies arrive on the discovery socket and go through `packet_received`
+        like broadcast scan replies.
+
+        Args:
+            networks (Iterable[IPv4Network]): Networks to sweep
+            rate (float): Maximum scan packets sent per second
+            concurrency (int): Maximum number of sends waiting on the socket
+
+        Returns:
+            int: Number of hosts a scan packet was sent to
+        """
+        await self._open()
+
+        networks = [IPv4Network(n, strict=False) for n in networks]
+        hosts = itertools.chain.from_iterable(n.hosts() for n in networks)
+        spacing = 1 / rate
+        next_send = self._loop.time()
+        sent = 0
+
+        async def worker():
+            nonlocal next_send, sent
+            for host in hosts:
+                # Reserve the next send slot, then wait for it
+                now = self._loop.time()
+                slot = max(now, next_send)
+                next_send = slot + spacing
+                if slot > now:
+                    await asyncio.sleep(slot - now)
+                await self.send({"t": "scan"}, (str(host), DEVICE_PORT))
+                self.metrics.discovery.scans += 1
+                sent += 1
+
+        _LOGGER.debug("Sweeping %s for devices", ", ".join(str(n) for n in networks))
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return sent
 
     async def search_devices(self, broadcastAddrs: list[IPv4Address] | None = None) -> None:
         """Search for devices with specific broadcast addresses."""
@@ -18,6 +18,29 @@ class Props(enum.Enum):
     ESTATE = "estate"  # 喜好执行状态
     J_FERR = "JFerr"
 
+    @property
+    def static(self) -> bool:
+        """Whether the property is device metadata that doesn't change between polls."""
+        return self in STATIC_PROPS
+
+
+# Fetched once after binding and again when the device changes address
+STATIC_PROPS = frozenset({Props.NAME, Props.HOST})
+
+# Fixed ordinal of each property, the slot it takes in a device's state vector
+PROP_COUNT = len(Props)
+PROP_INDEX = {prop: i for i, prop in enumerate(Props)}
+PROP_NAMES = tuple(prop.value for prop in Props)
+WIRE_INDEX = {prop.value: i for i, prop in enumerate(Props)}
+
+
+def prop_mask(props) -> int:
+    """Return the bitmask over the slots of the given properties."""
+    mask = 0
+    for prop in props:
+        mask |= 1 << PROP_INDEX[prop]
+    return mask
+
 
 @enum.unique
 class FanMode(enum.IntEnum):
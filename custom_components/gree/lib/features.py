@@ -1,14 +1,29 @@
+import enum
 from abc import ABC
-from typing import List
+from typing import Tuple
 
 from .enums import Props
 
 
+@enum.unique
+class Capability(enum.IntFlag):
+    """What a model supports beyond power and fan speed, one bit per feature."""
+    BASE = 1
+    MODE = 2
+    ROTATE = 4
+    LR_ANGLE = 8
+
+
 class Feature(ABC):
-    support_pros: List[Props] = []
+    CAPABILITY = Capability(0)
+    support_pros: Tuple[Props, ...] = ()
 
     def __init__(self, support_pros) -> None:
-        self.support_pros = support_pros
+        self.support_pros = tuple(support_pros)
+
+    @property
+    def capability(self) -> Capability:
+        return self.CAPABILITY
 
     def rotate(self) -> bool:
         return False
@@ -21,14 +36,16 @@ class Feature(ABC):
 
 
 class BaseFeature(Feature):
-    SUPPORT_PROPS = [Props.POWER, Props.FAN_SPEED, Props.NAME, Props.HOST]
+    CAPABILITY = Capability.BASE
+    SUPPORT_PROPS = (Props.POWER, Props.FAN_SPEED, Props.NAME, Props.HOST)
 
     def __init__(self) -> None:
         super().__init__(self.SUPPORT_PROPS)
 
 
 class ModeFeature(Feature):
-    SUPPORT_PROPS = [Props.MODE]
+    CAPABILITY = Capability.MODE
+    SUPPORT_PROPS = (Props.MODE,)
 
     def __init__(self) -> None:
         super().__init__(self.SUPPORT_PROPS)
@@ -38,7 +55,8 @@ class ModeFeature(Feature):
 
 
 class FanRotateFeature(Feature):
-    SUPPORT_PROPS = [Props.ROTATE]
+    CAPABILITY = Capability.ROTATE
+    SUPPORT_PROPS = (Props.ROTATE,)
 
     def __init__(self) -> None:
         super().__init__(self.SUPPORT_PROPS)
@@ -48,7 +66,8 @@ class FanRotateFeature(Feature):
 
 
 class FanRotateWithAngleFeature(Feature):
-    SUPPORT_PROPS = [Props.ROTATE, Props.LR_ANGLE]
+    CAPABILITY = Capability.ROTATE | Capability.LR_ANGLE
+    SUPPORT_PROPS = (Props.ROTATE, Props.LR_ANGLE)
 
     def __init__(self) -> None:
         super().__init__(self.SUPPORT_PROPS)
@@ -58,5 +77,3 @@ class FanRotateWithAngleFeature(Feature):
 
     def lr_angle(self) -> bool:
         return True
-
-
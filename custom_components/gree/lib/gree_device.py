@@ -1,6 +1,6 @@
 from typing import List, final
 
-from .features import Feature
+from .features import Capability, Feature
 
 
 class GreeDevice:
@@ -65,15 +65,35 @@ class DeviceInfo:
 
 
 class GreeDeviceInfo(GreeDevice, DeviceInfo):
-    d_pros: list = []
+    d_pros: tuple = ()
+    # d_pros split into what every poll asks for and what is fetched once
+    d_poll_pros: tuple = ()
+    d_static_pros: tuple = ()
+    capabilities: Capability = Capability(0)
 
     def __init__(self, type_name, name, type_id, ip, port, mac, brand=None, model=None, version=None,
-                 feature=None) -> None:
+                 feature=None, spec=None) -> None:
+        """Initialize the device info.
+
+        `spec` is the compiled `DeviceModel` of the type id, its features,
+        capabilities and property lists are shared instead of being rebuilt
+        from `feature` for every device.
+        """
+        if spec is not None:
+            feature = spec.features
         GreeDevice.__init__(self, type_name, name, type_id, feature)
         DeviceInfo.__init__(self, ip, port, mac, name, type_id, brand, model, version)
-        if feature:
+        if spec is not None:
+            self.capabilities = spec.capabilities
+            self.d_pros = spec.props
+            self.d_poll_pros = spec.poll_props
+            self.d_static_pros = spec.static_props
+        elif feature:
             props_set = set()
             for feature in self.support_features():
+                self.capabilities |= feature.capability
                 for prop in feature.support_pros:
-                    props_set.add(prop.value)
-            self.d_pros = list(props_set)
+                    props_set.add(prop)
+            self.d_pros = tuple(prop.value for prop in props_set)
+            self.d_poll_pros = tuple(prop.value for prop in props_set if not prop.static)
+            self.d_static_pros = tuple(prop.value for prop in props_set if prop.static)
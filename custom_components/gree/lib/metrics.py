@@ -0,0 +1,231 @@
+"""Per-device network metrics.
+
+Device sessions and discovery count what they send and receive into a
+`MetricsRegistry`, by default the module wide `METRICS`. The registry can
+be read as a plain dict or exported in the Prometheus text format.
+"""
+from __future__ import annotations
+
+import bisect
+import time
+from typing import Dict, Tuple
+
+# Upper bounds in seconds of the RTT histogram buckets, a LAN round trip
+# is a few milliseconds, a struggling unit takes seconds
+RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value) -> str:
+    """Escape a label value as the Prometheus text format requires."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Fixed bucket histogram, the last bucket counts values above every bound."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = RTT_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Return the upper bound of the bucket holding the q-quantile, None without samples.
+
+        Values above the last bound report infinity.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def as_dict(self) -> dict:
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {"count": self.count, "sum": round(self.sum, 6), "buckets": buckets}
+
+
+class DeviceMetrics:
+    """Counters of the traffic with one device."""
+
+    __slots__ = (
+        "requests",
+        "timeouts",
+        "retransmissions",
+        "packets_sent",
+        "bytes_sent",
+        "packets_received",
+        "bytes_received",
+        "decrypt_failures",
+        "last_seen",
+        "rtt",
+    )
+
+    def __init__(self) -> None:
+        # Keyed by request type: scan, bind, status or cmd
+        self.requests: Dict[str, int] = {}
+        self.timeouts: Dict[str, int] = {}
+        self.retransmissions = 0
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.packets_received = 0
+        self.bytes_received = 0
+        self.decrypt_failures = 0
+        # Wall clock time of the last packet that came from the device
+        self.last_seen = None
+        # Round trips of requests answered without a retransmission
+        self.rtt = Histogram()
+
+    def request(self, kind: str) -> None:
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def timeout(self, kind: str) -> None:
+        self.timeouts[kind] = self.timeouts.get(kind, 0) + 1
+
+    def sent(self, size: int) -> None:
+        self.packets_sent += 1
+        self.bytes_sent += size
+
+    def received(self, size: int) -> None:
+        self.packets_received += 1
+        self.bytes_received += size
+        self.last_seen = time.time()
+
+    def as_dict(self) -> dict:
+        rtt = self.rtt.as_dict()
+        rtt["p50"] = self.rtt.quantile(0.5)
+        rtt["p95"] = self.rtt.quantile(0.95)
+        return {
+            "requests": dict(self.requests),
+            "timeouts": dict(self.timeouts),
+            "retransmissions": self.retransmissions,
+            "packets_sent": self.packets_sent,
+            "bytes_sent": self.bytes_sent,
+            "packets_received": self.packets_received,
+            "bytes_received": self.bytes_received,
+            "decrypt_failures": self.decrypt_failures,
+            "last_seen": self.last_seen,
+            "rtt": rtt,
+        }
+
+
+class DiscoveryMetrics:
+    """Counters of the scans sent and the replies they brought in."""
+
+    __slots__ = ("scans", "replies", "malformed", "unknown_models", "duplicates", "dropped")
+
+    def __init__(self) -> None:
+        self.scans = 0
+        self.replies = 0
+        self.malformed = 0
+        self.unknown_models = 0
+        self.duplicates = 0  # repeated replies within a scan round
+        self.dropped = 0  # found devices that didn't fit the dispatch queue
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class MetricsRegistry:
+    """Device metrics keyed by mac, plus the discovery counters."""
+
+    def __init__(self) -> None:
+        self._devices: Dict[str, DeviceMetrics] = {}
+        self.discovery = DiscoveryMetrics()
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def device(self, mac: str) -> DeviceMetrics:
+        """Return the metrics of a device, created on first use."""
+        metrics = self._devices.get(mac)
+        if metrics is None:
+            metrics = self._devices[mac] = DeviceMetrics()
+        return metrics
+
+    def remove(self, mac: str) -> None:
+        """Forget the metrics of a device."""
+        self._devices.pop(mac, None)
+
+    def clear(self) -> None:
+        """Reset every counter."""
+        self._devices.clear()
+        self.discovery = DiscoveryMetrics()
+
+    def snapshot(self) -> dict:
+        """Return every counter as a JSON compatible dict."""
+        return {
+            "discovery": self.discovery.as_dict(),
+            "devices": {mac: metrics.as_dict() for mac, metrics in self._devices.items()},
+        }
+
+    def prometheus(self, prefix: str = "gree") -> str:
+        """Return every counter in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, doc, samples):
+            lines.append(f"# HELP {prefix}_{name} {doc}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+                lines.append(f"{prefix}_{name}{suffix}{{{label_text}}} {value}" if labels
+                             else f"{prefix}_{name}{suffix} {value}")
+
+        devices = sorted(self._devices.items())
+        family("requests_total", "counter", "Requests sent to the device, retransmissions excluded.",
+               [("", (("mac", mac), ("type", kind)), count)
+                for mac, m in devices for kind, count in sorted(m.requests.items())])
+        family("timeouts_total", "counter", "Requests that got no reply before the deadline.",
+               [("", (("mac", mac), ("type", kind)), count)
+                for mac, m in devices for kind, count in sorted(m.timeouts.items())])
+        for name, attr, doc in (
+                ("retransmissions_total", "retransmissions", "Requests sent again while waiting for a reply."),
+                ("packets_sent_total", "packets_sent", "Packets sent to the device."),
+                ("bytes_sent_total", "bytes_sent", "Bytes sent to the device."),
+                ("packets_received_total", "packets_received", "Packets received from the device."),
+                ("bytes_received_total", "bytes_received", "Bytes received from the device."),
+                ("decrypt_failures_total", "decrypt_failures", "Replies that could not be decrypted."),
+        ):
+            family(name, "counter", doc, [("", (("mac", mac),), getattr(m, attr)) for mac, m in devices])
+        family("last_seen_timestamp_seconds", "gauge", "Time the last packet from the device arrived.",
+               [("", (("mac", mac),), m.last_seen) for mac, m in devices if m.last_seen is not None])
+
+        samples = []
+        for mac, m in devices:
+            cumulative = 0
+            for bound, count in zip(m.rtt.bounds, m.rtt.counts):
+                cumulative += count
+                samples.append(("_bucket", (("mac", mac), ("le", str(bound))), cumulative))
+            samples.append(("_bucket", (("mac", mac), ("le", "+Inf")), m.rtt.count))
+            samples.append(("_sum", (("mac", mac),), round(m.rtt.sum, 6)))
+            samples.append(("_count", (("mac", mac),), m.rtt.count))
+        family("rtt_seconds", "histogram", "Round trip time of requests answered without a retransmission.",
+               samples)
+
+        for name, doc in (
+                ("scans", "Scan packets sent by discovery."),
+                ("replies", "Scan replies received by discovery."),
+                ("malformed", "Scan replies that could not be parsed."),
+                ("unknown_models", "Scan replies from unsupported models."),
+                ("duplicates", "Scan replies repeated within a scan round."),
+                ("dropped", "Found devices dropped because the dispatch queue was full."),
+        ):
+            family(f"discovery_{name}_total", "counter", doc, [("", (), getattr(self.discovery, name))])
+
+        return "\n".join(lines) + "\n"
+
+
+# Registry fed by every session and discovery unless they are given their own
+METRICS = MetricsRegistry()
@@ -1,19 +1,26 @@
+from __future__ import annotations
+
 import asyncio
-import base64
 import json
 import logging
 import socket
+import time
+from collections import deque
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Any, Callable, Tuple
 
-from Crypto.Cipher import AES
+from . import codec
+from .codec import GENERIC_KEY
+from .metrics import METRICS, MetricsRegistry
+from .rtt import RttEstimator
 
 """
 COPY FROM https://github.com/cmroche/greeclimate/blob/master/greeclimate/network.py
 """
 
 NETWORK_TIMEOUT = 10
-GENERIC_KEY = "a3K8Bx%2r8Y7#xDh"
+DECRYPT_BATCH_WINDOW = 0.001  # seconds replies wait to be decrypted together
+DECRYPT_BATCH_LIMIT = 64  # replies that make a batch decrypt at once
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -60,6 +67,8 @@ class DeviceProtocol2(asyncio.DatagramProtocol):
     @device_key.setter
     def device_key(self, value: str):
         """Gets the encryption key used for device data."""
+        if value != self._key:
+            codec.forget_key(self._key)
         self._key = value
 
     def close(self) -> None:
@@ -103,48 +112,26 @@ class DeviceProtocol2(asyncio.DatagramProtocol):
         if len(data) == 0:
             return
 
-        obj = json.loads(data)
-        key = GENERIC_KEY if obj.get("i") == 1 else self._key
-
-        if obj.get("pack"):
-            obj["pack"] = DeviceProtocol2.decrypt_payload(obj["pack"], key)
+        obj = codec.decode_packet(data, self._key)
 
-        _LOGGER.debug("Received packet from %s:\n%s", addr[0], json.dumps(obj))
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Received packet from %s:\n%s", addr[0], json.dumps(obj))
 
         self.packet_received(obj, addr)
 
     async def send(self, obj, addr: IPAddr = None) -> None:
         """Send encode and send JSON command to the device."""
-        _LOGGER.debug("Sending packet:\n%s", json.dumps(obj))
-
-        if obj.get("pack"):
-            key = GENERIC_KEY if obj.get("i") == 1 else self._key
-            obj["pack"] = DeviceProtocol2.encrypt_payload(obj["pack"], key)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Sending packet:\n%s", json.dumps(obj))
 
-        data_bytes = json.dumps(obj).encode()
+        data_bytes = codec.encode_packet(obj, self._key)
         self._transport.sendto(data_bytes, addr)
 
         task = asyncio.create_task(self._drained.wait())
         await asyncio.wait_for(task, self._timeout)
 
-    @staticmethod
-    def decrypt_payload(payload, key=GENERIC_KEY):
-        cipher = AES.new(key.encode(), AES.MODE_ECB)
-        decoded = base64.b64decode(payload)
-        decrypted = cipher.decrypt(decoded).decode()
-        t = decrypted.replace(decrypted[decrypted.rindex("}") + 1:], "")
-        return json.loads(t)
-
-    @staticmethod
-    def encrypt_payload(payload, key=GENERIC_KEY):
-        def pad(s):
-            bs = 16
-            return s + (bs - len(s) % bs) * chr(bs - len(s) % bs)
-
-        cipher = AES.new(key.encode(), AES.MODE_ECB)
-        encrypted = cipher.encrypt(pad(json.dumps(payload)).encode())
-        encoded = base64.b64encode(encrypted).decode()
-        return encoded
+    decrypt_payload = staticmethod(codec.decrypt_payload)
+    encrypt_payload = staticmethod(codec.encrypt_payload)
 
 
 class BroadcastListenerProtocol(DeviceProtocol2):
@@ -159,154 +146,629 @@ class BroadcastListenerProtocol(DeviceProtocol2):
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
 
-class DeviceProtocol(asyncio.DatagramProtocol):
-    def __init__(
-            self, recvq: asyncio.Queue, excq: asyncio.Queue, drained: asyncio.Event
-    ) -> None:
-        self._loop = asyncio.get_event_loop()
+def _decrypt_or_none(payload, key: str):
+    try:
+        return codec.decrypt_payload(payload, key)
+    except (ValueError, TypeError):
+        return None
 
-        self._recvq = recvq
-        self._excq = excq
-        self._drained = drained
 
-        self._drained.set()
+class DecryptBatch:
+    """Collects encrypted replies for a short window and decrypts them per key.
 
-        # Transports are connected at the time a connection is made.
-        self._transport = None
+    Each cipher call has a fixed cost, replies arriving together under the
+    same key, like scan and bind replies under the generic key, share one
+    call through `codec.decrypt_payloads`. Status and cmd replies are
+    encrypted with the key of their device and rarely share a batch.
+    """
 
-    def connection_made(self, transport: asyncio.transports.DatagramTransport) -> None:
+    def __init__(self, window: float = DECRYPT_BATCH_WINDOW, limit: int = DECRYPT_BATCH_LIMIT) -> None:
+        """Initialize the batch.
 
-        self._transport = transport
+        Args:
+            window (float): Seconds the first reply of a batch waits for others
+            limit (int): Number of replies that flush the batch right away
+        """
+        self.window = window
+        self.limit = limit
+        self._entries = []
+        self._timer = None
 
-    def datagram_received(self, data, addr: IPAddr) -> None:
-        self._recvq.put_nowait((data, addr))
+    def __len__(self) -> int:
+        return len(self._entries)
 
-    def connection_lost(self, exc) -> None:
-        if exc is not None:
-            self._excq.put_nowait(exc)
+    def add(self, obj, key: str, deliver: Callable[[Any], None]) -> None:
+        """Queue an envelope whose `pack` is still encrypted.
 
+        `deliver` is called with the envelope once it is decrypted, with
+        `pack` set to None if it couldn't be.
+        """
+        self._entries.append((obj, key, deliver))
+        if len(self._entries) >= self.limit:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def cancel(self) -> None:
+        """Drop the queued replies."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._entries.clear()
+
+    def flush(self) -> None:
+        """Decrypt and deliver every queued reply."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        entries, self._entries = self._entries, []
+
+        by_key = {}
+        for entry in entries:
+            by_key.setdefault(entry[1], []).append(entry)
+        for key, group in by_key.items():
+            if len(group) == 1:
+                # Nothing to share the cipher call with
+                packs = [_decrypt_or_none(group[0][0]["pack"], key)]
+            else:
+                packs = codec.decrypt_payloads([obj["pack"] for obj, _, _ in group], key)
+            for (obj, _, deliver), pack in zip(group, packs):
+                obj["pack"] = pack
+                try:
+                    deliver(obj)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception("Failed to handle a decrypted reply")
+
+
+class SharedEndpoint(asyncio.DatagramProtocol):
+    """One UDP socket multiplexed across every device session.
+
+    Requests from all registered sessions go out on the same unconnected
+    socket. Replies are routed back to their session by source address, or
+    by the `cid`/`mac` in the reply when the address is not known yet.
+    """
+
+    def __init__(self, batch_window: float = 0.0) -> None:
+        """Initialize the shared endpoint, the socket is opened on first use.
+
+        Args:
+            batch_window (float): Seconds replies are held to be decrypted
+                                  together per key, see `DecryptBatch`, 0 decrypts
+                                  every reply on arrival
+        """
+        self._transport = None
+        self._opening = None
+        self._by_addr = {}
+        self._by_mac = {}
+        self._batch = DecryptBatch(batch_window) if batch_window > 0 else None
+
+    @property
+    def sessions(self) -> int:
+        """Return the number of registered sessions."""
+        return len(self._by_mac)
+
+    async def open(self) -> None:
+        """Open the shared socket if it is not open yet."""
+        if self._transport is not None:
+            return
+
+        if self._opening is None:
+            loop = asyncio.get_running_loop()
+            self._opening = loop.create_task(
+                loop.create_datagram_endpoint(lambda: self, local_addr=("0.0.0.0", 0))
+            )
+        try:
+            await asyncio.shield(self._opening)
+        finally:
+            self._opening = None
+
+    def close(self) -> None:
+        """Close the shared socket."""
+        if self._batch is not None:
+            self._batch.cancel()
         if self._transport is not None:
             self._transport.close()
             self._transport = None
 
-    def error_received(self, exc) -> None:
-        self._excq.put_nowait(exc)
+    def register(self, session, addr: IPAddr) -> None:
+        """Route replies from `addr` and the session's mac to the session."""
+        self._by_addr[addr] = session
+        self._by_mac[session.device_info.mac] = session
+
+    def unregister(self, session) -> None:
+        """Stop routing replies to the session."""
+        if self._by_addr.get(session.remote_addr) is session:
+            del self._by_addr[session.remote_addr]
+        if self._by_mac.get(session.device_info.mac) is session:
+            del self._by_mac[session.device_info.mac]
+
+    def sendto(self, data: bytes, addr: IPAddr) -> None:
+        """Send raw data to a device."""
+        if self._transport is None:
+            raise ConnectionError("Shared endpoint is not open")
+        self._transport.sendto(data, addr)
 
-    def pause_writing(self) -> None:
-        self._drained.clear()
-        super().pause_writing()
+    def connection_made(self, transport: asyncio.transports.DatagramTransport) -> None:
+        """Called when the shared socket is opened."""
+        self._transport = transport
 
-    def resume_writing(self) -> None:
-        self._drained.set()
-        super().resume_writing()
+    def connection_lost(self, exc: Exception) -> None:
+        """Handle a closed socket, pending requests of every session fail."""
+        self._transport = None
+        sessions = list(self._by_mac.values())
+        self._by_addr.clear()
+        self._by_mac.clear()
+        for session in sessions:
+            session.connection_lost(exc)
 
+    def error_received(self, exc: Exception) -> None:
+        """Errors on an unconnected socket can't be tied to a device."""
+        _LOGGER.debug("Shared endpoint error: %s", exc)
 
-# Concepts and code here were taken from https://github.com/jsbronder/asyncio-dgram
-class DatagramStream:
-    def __init__(self, transport, recvq, excq, drained, timeout: int = 120):
-        self._transport = transport
-        self._recvq = recvq
-        self._excq = excq
-        self._drained = drained
-        self._timeout = timeout
+    def datagram_received(self, data: bytes, addr: IPAddr) -> None:
+        """Route an incoming reply to the session waiting for it."""
+        if len(data) == 0:
+            return
 
-    def __del__(self):
-        self.close()
+        try:
+            obj = json.loads(data)
+        except ValueError:
+            obj = None
+        if not isinstance(obj, dict):
+            _LOGGER.debug("Dropping malformed reply from %s", addr[0])
+            return
+
+        session = self._by_addr.get(addr)
+        cid = obj.get("cid") or obj.get("mac")
+        if session is None or (cid and cid != session.device_info.mac):
+            # Prefer the device the reply names, e.g. after an address change
+            session = self._by_mac.get(cid, session)
+        if session is None:
+            _LOGGER.debug("Dropping reply from unknown device %s", addr[0])
+            return
+
+        pack = obj.get("pack")
+        if self._batch is not None and isinstance(pack, str) and session.in_flight:
+            size = len(data)
+            self._batch.add(
+                obj,
+                codec.packet_key(obj, session.key),
+                lambda decrypted: session.reply_received(decrypted, addr, size, decrypted=True),
+            )
+            return
+        session.reply_received(obj, addr, len(data))
+
+
+# Reply `t` expected for each request `t`, a scan request carries no pack
+_REPLY_TYPES = {None: "dev", "bind": "bindok", "status": "dat", "cmd": "res"}
+
+
+class _PendingRequest:
+    """A request waiting for its reply, see `DeviceSession.reply_received`."""
+
+    __slots__ = ("pack", "reply_type", "future", "sent", "owed", "owed_until")
+
+    def __init__(self, pack, future: asyncio.Future) -> None:
+        self.pack = pack
+        self.reply_type = _REPLY_TYPES.get(pack and pack.get("t"))
+        self.future = future
+        self.sent = 0
+        # Replies the copies of a finished request may still bring, and until when
+        self.owed = 0
+        self.owed_until = 0.0
 
     @property
-    def exception(self):
-        try:
-            exc = self._excq.get_nowait()
-            raise exc
-        except asyncio.queues.QueueEmpty:
-            pass
+    def answered(self) -> bool:
+        future = self.future
+        return future.done() and not future.cancelled() and future.exception() is None
+
+    def matches(self, reply) -> bool:
+        """Return True if the decoded reply pack answers this request."""
+        if reply is None or reply.get("t") != self.reply_type:
+            return False
+        if self.reply_type == "dat":
+            # Devices may leave out columns they don't support
+            return set(reply.get("cols", ())) <= set(self.pack["cols"])
+        if self.reply_type == "res":
+            return reply.get("opt") == self.pack["opt"]
+        return True
+
+    def exact(self, reply) -> bool:
+        """Return True if a cmd ack carries exactly the values this request sent."""
+        return (reply.get("val") or reply.get("p")) == self.pack["p"]
+
+
+def _fingerprint(reply):
+    return json.dumps(reply, sort_keys=True)
+
+
+class _SessionSocket(asyncio.DatagramProtocol):
+    """Protocol of one socket opened by a `DeviceSession`.
+
+    Every socket gets its own protocol, events of a socket the session has
+    already replaced, e.g. after the device moved, are ignored.
+    """
+
+    __slots__ = ("session", "transport")
+
+    def __init__(self, session: DeviceSession) -> None:
+        self.session = session
+        self.transport = None
 
     @property
-    def socket(self):
-        return self._transport.get_extra_info("socket")
+    def current(self) -> bool:
+        return self.transport is not None and self.transport is self.session._transport
 
-    def close(self):
-        try:
-            self._transport.close()
-        except RuntimeError:
-            pass
+    def connection_made(self, transport: asyncio.transports.DatagramTransport) -> None:
+        self.transport = transport
 
-    async def send(self, data, addr=None) -> None:
-        _ = self.exception
-        self._transport.sendto(data, addr)
+    def connection_lost(self, exc: Exception) -> None:
+        if self.current:
+            self.session.connection_lost(exc)
 
-        task = asyncio.create_task(self._drained.wait())
-        await asyncio.wait_for(task, self._timeout)
+    def error_received(self, exc: Exception) -> None:
+        if self.current:
+            self.session.error_received(exc)
 
-    async def send_device_data(self, data, key=GENERIC_KEY) -> None:
-        """Send a formatted request to the device."""
-        _LOGGER.debug("Sending packet:\n%s", json.dumps(data))
+    def datagram_received(self, data: bytes, addr: IPAddr) -> None:
+        if self.current:
+            self.session.datagram_received(data, addr)
 
-        if "pack" in data:
-            data["pack"] = DatagramStream.encrypt_payload(data["pack"], key)
 
-        data_bytes = json.dumps(data).encode()
-        await self.send(data_bytes)
+class DeviceSession(asyncio.DatagramProtocol):
+    """Long-lived UDP session with a single device.
 
-    def recv_ready(self):
-        _ = self.exception
-        return not self._recvq.empty()
+    One datagram endpoint is kept open for the lifetime of the session and
+    reused for every bind, status and cmd exchange. The endpoint is reopened
+    lazily after a socket error or when the device address changes. When a
+    `SharedEndpoint` is given, the session rides on it instead of owning a
+    socket.
 
-    async def recv(self):
-        _ = self.exception
+    Requests are pipelined: a status poll and a command can be in flight at
+    the same time. Replies are correlated to requests by reply type, then by
+    the requested columns or options. Replies that answer no pending request,
+    such as duplicates caused by retransmissions, are dropped. So are late
+    replies to the extra copies of a finished request, they would otherwise
+    answer the next request of the same kind with stale values.
+    """
 
-        task = asyncio.create_task(self._recvq.get())
-        await asyncio.wait_for(task, self._timeout)
-        return task.result()
+    def __init__(self, device_info, timeout: int = NETWORK_TIMEOUT, endpoint: SharedEndpoint = None,
+                 hedge: bool = False, metrics: MetricsRegistry = None) -> None:
+        """Initialize the device session.
 
-    async def recv_device_data(self, key=GENERIC_KEY):
-        """Receive a formatted request from the device."""
-        (data_bytes, addr) = await self.recv()
-        if len(data_bytes) == 0:
+        Args:
+            device_info (DeviceInfo): Device the session talks to
+            timeout (int): Overall deadline in seconds for a reply, retransmissions included
+            endpoint (SharedEndpoint): Optional socket shared with other sessions
+            hedge (bool): Send a duplicate request once the p95 latency has passed
+            metrics (MetricsRegistry): Registry the traffic is counted in, `METRICS` by default
+        """
+        self.device_info = device_info
+        self.rtt = RttEstimator()
+        self.metrics = (metrics if metrics is not None else METRICS).device(device_info.mac)
+        self.hedge = hedge
+        self._timeout = timeout
+        self._endpoint = endpoint
+        self._transport = None
+        self._remote_addr = None
+        self._key = GENERIC_KEY
+        self._pending = []
+        self._answered = deque(maxlen=8)
+        self._finished = deque(maxlen=8)
+        self._connect_lock = asyncio.Lock()
+
+        # Packet trace, only set while tracing is enabled for the device
+        self.trace = None
+
+    @property
+    def connected(self) -> bool:
+        """Return True if the endpoint is open."""
+        return self._remote_addr is not None
+
+    @property
+    def remote_addr(self) -> IPAddr | None:
+        """Return the address the session is currently talking to."""
+        return self._remote_addr
+
+    @property
+    def in_flight(self) -> int:
+        """Return the number of requests waiting for a reply."""
+        return len(self._pending)
+
+    @property
+    def key(self) -> str:
+        """Return the device key replies are decrypted with."""
+        return self._key
+
+    def close(self) -> None:
+        """Close the UDP endpoint, it will be reopened on the next request."""
+        if self._endpoint is not None:
+            self._endpoint.unregister(self)
+        elif self._transport is not None:
+            self._transport.close()
+        self._transport = None
+        self._remote_addr = None
+
+    def connection_lost(self, exc: Exception) -> None:
+        """Handle a closed socket, the next request reconnects."""
+        self._transport = None
+        self._remote_addr = None
+        self._fail_pending(exc or ConnectionError("Device session closed"))
+
+    def error_received(self, exc: Exception) -> None:
+        """Handle an error while sending/receiving datagrams."""
+        _LOGGER.debug("Session error for %s: %s", self.device_info, exc)
+        self._fail_pending(exc)
+        self.close()
+
+    def datagram_received(self, data: bytes, addr: IPAddr) -> None:
+        """Handle an incoming datagram on the session's own socket."""
+        if len(data) == 0:
+            return
+        try:
+            obj = json.loads(data)
+        except ValueError:
+            obj = None
+        if not isinstance(obj, dict):
+            _LOGGER.debug("Dropping malformed reply from %s", addr[0])
             return
+        self.reply_received(obj, addr, len(data))
 
-        data = json.loads(data_bytes)
+    def reply_received(self, obj, addr: IPAddr, size: int = 0, decrypted: bool = False) -> None:
+        """Decode a reply and hand it over to the request it answers.
 
-        if "pack" in data:
-            data["pack"] = DatagramStream.decrypt_payload(data["pack"], key)
+        Replies that answer no pending request are dropped, and so are cmd
+        acks already consumed by an earlier request with the same values.
+        `decrypted` tells that `pack` was already decrypted, None if that failed.
+        """
+        self.metrics.received(size)
+        if not self._pending:
+            return
+
+        pack = obj.get("pack")
+        if decrypted:
+            if pack is None:
+                _LOGGER.debug("Dropping undecodable reply from %s", addr[0])
+                self.metrics.decrypt_failures += 1
+                return
+        elif pack:
+            try:
+                pack = obj["pack"] = codec.decrypt_payload(pack, codec.packet_key(obj, self._key))
+            except (ValueError, TypeError):
+                _LOGGER.debug("Dropping undecodable reply from %s", addr[0])
+                self.metrics.decrypt_failures += 1
+                return
+
+        if not isinstance(pack, dict):
+            _LOGGER.debug("Dropping reply without a pack object from %s", addr[0])
+            return
 
-        _LOGGER.debug("Received packet:\n%s", json.dumps(data))
-        return (data, addr)
+        request = self._match(pack)
+        if request is None:
+            _LOGGER.debug("Dropping stale reply from %s", addr[0])
+            return
 
-    @staticmethod
-    def decrypt_payload(payload, key=GENERIC_KEY):
-        cipher = AES.new(key.encode(), AES.MODE_ECB)
-        decoded = base64.b64decode(payload)
-        decrypted = cipher.decrypt(decoded).decode()
-        t = decrypted.replace(decrypted[decrypted.rindex("}") + 1:], "")
-        return json.loads(t)
+        if request.reply_type == "res":
+            self._answered.append(_fingerprint(pack))
+        request.future.set_result(obj)
+
+    def _match(self, pack) -> _PendingRequest | None:
+        candidates = [r for r in self._pending if not r.future.done() and r.matches(pack)]
+        if not candidates:
+            return None
+        if candidates[0].reply_type != "res":
+            if self._late_reply(pack):
+                return None
+            return candidates[0]
+
+        for request in candidates:
+            if request.exact(pack):
+                return request
+        if _fingerprint(pack) in self._answered:
+            # Duplicate ack of a command that has already been answered
+            return None
+        # The unit may have applied a value other than the one requested
+        return candidates[0]
+
+    def _late_reply(self, pack) -> bool:
+        """Return True if the reply is owed to a finished request rather than a pending one.
+
+        Cmd acks carry the values they confirm and are told apart by
+        `_answered` instead.
+        """
+        now = asyncio.get_running_loop().time()
+        for request in self._finished:
+            if request.owed and now < request.owed_until and request.matches(pack):
+                request.owed -= 1
+                return True
+        return False
+
+    def _finish(self, request: _PendingRequest) -> None:
+        """Remember the replies still owed to the extra copies of a request that is done."""
+        request.owed = request.sent - (1 if request.answered else 0)
+        if request.owed > 0 and request.reply_type != "res":
+            # Copies are answered within a round trip of the last one sent
+            request.owed_until = asyncio.get_running_loop().time() + self.rtt.rto
+            self._finished.append(request)
+
+    def _fail_pending(self, exc: Exception) -> None:
+        for request in self._pending:
+            if not request.future.done():
+                request.future.set_exception(exc)
+
+    async def _connect(self) -> None:
+        remote_addr = (self.device_info.ip, self.device_info.port)
+        if self._remote_addr is not None and remote_addr == self._remote_addr:
+            return
 
-    @staticmethod
-    def encrypt_payload(payload, key=GENERIC_KEY):
-        def pad(s):
-            bs = 16
-            return s + (bs - len(s) % bs) * chr(bs - len(s) % bs)
+        async with self._connect_lock:
+            if self._remote_addr is not None and remote_addr == self._remote_addr:
+                return
+
+            # The device moved to another address since the endpoint was opened
+            self.close()
+
+            if self._endpoint is not None:
+                await self._endpoint.open()
+                self._endpoint.register(self, remote_addr)
+            else:
+                loop = asyncio.get_running_loop()
+                self._transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _SessionSocket(self), remote_addr=remote_addr
+                )
+            self._remote_addr = remote_addr
+
+    def _send(self, data: bytes) -> None:
+        if self._endpoint is not None:
+            self._endpoint.sendto(data, self._remote_addr)
+        else:
+            self._transport.sendto(data)
+        self.metrics.sent(len(data))
+
+    async def _await_reply(self, request: _PendingRequest, packet: bytes):
+        """Send a packet, retransmitting it until a reply arrives or the deadline passes.
+
+        Retransmissions back off exponentially from the estimated RTO. With
+        hedging enabled a duplicate is sent once the p95 latency has passed.
+        Only replies to requests that went out once feed the RTT estimator.
+
+        Returns:
+            dict: The reply envelope
+        """
+        loop = asyncio.get_running_loop()
+        waiter = request.future
+        start = loop.time()
+        deadline = start + self._timeout
+
+        rto = self.rtt.rto
+        hedge_at = None
+        if self.hedge:
+            p95 = self.rtt.p95
+            if p95 is not None and p95 < rto:
+                hedge_at = start + p95
+
+        request.sent = 1
+        self._send(packet)
+        next_send = start + rto
+        while True:
+            now = loop.time()
+            if now >= deadline:
+                raise asyncio.TimeoutError
+            wake = min(next_send, deadline) if hedge_at is None else min(hedge_at, deadline)
+            await asyncio.wait((waiter,), timeout=wake - now)
+            if waiter.done():
+                break
+
+            now = loop.time()
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+            elif now >= next_send:
+                rto = self.rtt.backoff(rto)
+                next_send = now + rto
+            else:
+                continue
+            request.sent += 1
+            self._send(packet)
+
+        if request.sent == 1:
+            rtt = loop.time() - start
+            self.rtt.sample(rtt)
+            self.metrics.rtt.observe(rtt)
+        return waiter.result()
+
+    async def _exchange(self, data, key=GENERIC_KEY):
+        """Send a request to the device and wait for the decoded reply."""
+        trace = self.trace
+        await self._connect()
+        connection = (self._transport, self._remote_addr)
+
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Sending packet:\n%s", json.dumps(data))
+
+        if trace is not None:
+            sent_at = time.time()
+            start = time.monotonic()
+
+        if data.get("i") != 1:
+            self._key = key
+
+        request = _PendingRequest(data.get("pack"), asyncio.get_running_loop().create_future())
+        kind = request.pack.get("t") if request.pack else data.get("t")
+        self.metrics.request(kind)
+        self._pending.append(request)
+        try:
+            r = await self._await_reply(request, codec.encode_packet(data, key))
+        except asyncio.TimeoutError:
+            self.metrics.timeout(kind)
+            if trace is not None:
+                trace.record(data, None, sent_at, None, "timeout", sent=request.sent)
+            raise
+        except OSError as e:
+            # Only drop the socket the request went out on, the device may have moved meanwhile
+            if (self._transport, self._remote_addr) == connection:
+                self.close()
+            if trace is not None:
+                trace.record(data, None, sent_at, None, repr(e), sent=request.sent)
+            raise
+        finally:
+            self._pending.remove(request)
+            self._finish(request)
+            if request.sent > 1:
+                self.metrics.retransmissions += request.sent - 1
+
+        if trace is not None:
+            trace.record(data, r, sent_at, time.monotonic() - start, sent=request.sent)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Received packet:\n%s", json.dumps(r))
+        return r
+
+    async def bind(self, announce=False):
+        """Negotiate the device key, binding uses the generic key only."""
+        try:
+            if announce:
+                await self._exchange({"t": "scan"})
+            r = await self._exchange(bind_payload(self.device_info))
+        except asyncio.TimeoutError as e:
+            raise e
+        except Exception as e:
+            _LOGGER.exception("Encountered an error trying to bind device")
+            raise e
+
+        return r["pack"].get("key")
+
+    async def send_state(self, property_values, key=GENERIC_KEY):
+        """Send a cmd packet and return the acknowledged values."""
+        try:
+            r = await self._exchange(cmd_payload(property_values, self.device_info), key)
+        except asyncio.TimeoutError as e:
+            raise e
+        except Exception as e:
+            _LOGGER.exception("Encountered an error sending state to device")
+            raise e
 
-        cipher = AES.new(key.encode(), AES.MODE_ECB)
-        encrypted = cipher.encrypt(pad(json.dumps(payload)).encode())
-        encoded = base64.b64encode(encrypted).decode()
-        return encoded
+        cols = r["pack"]["opt"]
 
+        # Some devices only return only "p" and not both "p" and "val"
+        dat = r["pack"].get("val") or r["pack"].get("p")
+        return dict(zip(cols, dat))
 
-async def create_datagram_stream(target: IPAddr) -> DatagramStream:
-    loop = asyncio.get_event_loop()
-    recvq = asyncio.Queue()
-    excq = asyncio.Queue()
-    drained = asyncio.Event()
+    async def request_state(self, properties, key=GENERIC_KEY):
+        """Send a status packet and return the reported values."""
+        try:
+            r = await self._exchange(status_payload(properties, self.device_info), key)
+        except asyncio.TimeoutError as e:
+            raise e
+        except Exception as e:
+            _LOGGER.exception("Encountered an error requesting update from device")
+            raise e
 
-    transport, _ = await loop.create_datagram_endpoint(
-        lambda: DeviceProtocol(recvq, excq, drained), remote_addr=target
-    )
-    return DatagramStream(transport, recvq, excq, drained, timeout=NETWORK_TIMEOUT)
+        cols = r["pack"]["cols"]
+        dat = r["pack"]["dat"]
+        return dict(zip(cols, dat))
 
 
-async def bind_device(device_info, announce=False):
-    payload = {
+def bind_payload(device_info):
+    return {
         "cid": "app",
         "i": 1,
         "t": "pack",
@@ -315,28 +777,9 @@ async def bind_device(device_info, announce=False):
         "pack": {"mac": device_info.mac, "t": "bind", "uid": 0},
     }
 
-    remote_addr = (device_info.ip, device_info.port)
-    stream = await create_datagram_stream(remote_addr)
-    try:
-        # Binding uses the generic key only
-        if announce:
-            await stream.send_device_data({"t": "scan"})
-            await stream.recv_device_data()
-        await stream.send_device_data(payload)
-        (r, _) = await stream.recv_device_data()
-    except asyncio.TimeoutError as e:
-        raise e
-    except Exception as e:
-        _LOGGER.exception("Encountered an error trying to bind device")
-        raise e
-    finally:
-        stream.close()
-
-    return r["pack"].get("key")
-
-
-async def send_state(property_values, device_info, key=GENERIC_KEY):
-    payload = {
+
+def cmd_payload(property_values, device_info):
+    return {
         "cid": "app",
         "i": 0,
         "t": "pack",
@@ -349,28 +792,9 @@ async def send_state(property_values, device_info, key=GENERIC_KEY):
         },
     }
 
-    remote_addr = (device_info.ip, device_info.port)
-    stream = await create_datagram_stream(remote_addr)
-    try:
-        await stream.send_device_data(payload, key)
-        (r, _) = await stream.recv_device_data(key)
-    except asyncio.TimeoutError as e:
-        raise e
-    except Exception as e:
-        _LOGGER.exception("Encountered an error sending state to device")
-        raise e
-    finally:
-        stream.close()
-
-    cols = r["pack"]["opt"]
 
-    # Some devices only return only "p" and not both "p" and "val"
-    dat = r["pack"].get("val") or r["pack"].get("p")
-    return dict(zip(cols, dat))
-
-
-async def request_state(properties, device_info, key=GENERIC_KEY):
-    payload = {
+def status_payload(properties, device_info):
+    return {
         "cid": "app",
         "i": 0,
         "t": "pack",
@@ -378,20 +802,3 @@ async def request_state(properties, device_info, key=GENERIC_KEY):
         "tcid": device_info.mac,
         "pack": {"mac": device_info.mac, "t": "status", "cols": list(properties)},
     }
-
-    remote_addr = (device_info.ip, device_info.port)
-    stream = await create_datagram_stream(remote_addr)
-    try:
-        await stream.send_device_data(payload, key)
-        (r, _) = await stream.recv_device_data(key)
-    except asyncio.TimeoutError as e:
-        raise e
-    except Exception as e:
-        _LOGGER.exception("Encountered an error requesting update from device")
-        raise e
-    finally:
-        stream.close()
-
-    cols = r["pack"]["cols"]
-    dat = r["pack"]["dat"]
-    return dict(zip(cols, dat))
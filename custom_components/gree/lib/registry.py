@@ -0,0 +1,75 @@
+"""Registry of the devices found on the network, indexed by mac."""
+from __future__ import annotations
+
+import enum
+from typing import Any, Iterator
+
+from .gree_device import DeviceInfo
+
+
+@enum.unique
+class RegistryChange(enum.Enum):
+    ADDED = "added"  # First time the mac is seen
+    MOVED = "moved"  # Known mac answering from another address
+    UPDATED = "updated"  # Known mac with different name/brand/model/version/mid
+    UNCHANGED = "unchanged"
+
+
+class DeviceRegistry:
+    """Device infos keyed by mac, with an optional object attached to each.
+
+    Discovery stores the latest `DeviceInfo` of every device here, the bridge
+    attaches the coordinator it created for it. Insert, address change
+    detection and lookup are all O(1).
+    """
+
+    def __init__(self) -> None:
+        self._infos = {}
+        self._attached = {}
+
+    def __len__(self) -> int:
+        return len(self._infos)
+
+    def __contains__(self, mac: str) -> bool:
+        return mac in self._infos
+
+    def __iter__(self) -> Iterator[DeviceInfo]:
+        return iter(self._infos.values())
+
+    @property
+    def devices(self) -> list[DeviceInfo]:
+        """Return the known device infos."""
+        return list(self._infos.values())
+
+    def get(self, mac: str) -> DeviceInfo | None:
+        """Return the device info of a mac, None if it is unknown."""
+        return self._infos.get(mac)
+
+    def upsert(self, device_info: DeviceInfo) -> RegistryChange:
+        """Store the latest info of a device and return how it changed."""
+        known = self._infos.get(device_info.mac)
+        if known is None:
+            change = RegistryChange.ADDED
+        elif known.ip != device_info.ip or known.port != device_info.port:
+            change = RegistryChange.MOVED
+        elif known != device_info:
+            change = RegistryChange.UPDATED
+        else:
+            # Keep the stored object, others may hold a reference to it
+            return RegistryChange.UNCHANGED
+
+        self._infos[device_info.mac] = device_info
+        return change
+
+    def remove(self, mac: str) -> None:
+        """Forget a device and whatever is attached to it."""
+        self._infos.pop(mac, None)
+        self._attached.pop(mac, None)
+
+    def attach(self, mac: str, obj: Any) -> None:
+        """Attach an object, e.g. a coordinator, to a device."""
+        self._attached[mac] = obj
+
+    def attached(self, mac: str) -> Any:
+        """Return the object attached to a device, None if there is none."""
+        return self._attached.get(mac)
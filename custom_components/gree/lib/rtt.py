@@ -0,0 +1,74 @@
+"""Round trip time estimation for device requests.
+
+The smoothed RTT and variance follow RFC 6298, the resulting retransmission
+timeout is clamped to bounds that suit a local network rather than the
+internet.
+"""
+from __future__ import annotations
+
+from collections import deque
+
+INITIAL_RTO = 0.5
+MIN_RTO = 0.05
+MAX_RTO = 3.0
+
+# Minimum number of samples before a p95 latency is reported
+MIN_P95_SAMPLES = 10
+
+
+class RttEstimator:
+    """Smoothed round trip time and variance of one device."""
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(
+            self,
+            initial_rto: float = INITIAL_RTO,
+            min_rto: float = MIN_RTO,
+            max_rto: float = MAX_RTO,
+            window: int = 64,
+    ) -> None:
+        """Initialize the estimator.
+
+        Args:
+            initial_rto (float): Retransmission timeout until the first sample
+            min_rto (float): Lower bound of the retransmission timeout
+            max_rto (float): Upper bound of the retransmission timeout
+            window (int): Number of recent samples kept for the p95 latency
+        """
+        self.srtt = None
+        self.rttvar = None
+        self._rto = initial_rto
+        self._min_rto = min_rto
+        self._max_rto = max_rto
+        self._samples = deque(maxlen=window)
+
+    @property
+    def rto(self) -> float:
+        """Return the current retransmission timeout in seconds."""
+        return self._rto
+
+    @property
+    def p95(self) -> float | None:
+        """Return the 95th percentile of recent round trips, None without enough samples."""
+        if len(self._samples) < MIN_P95_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def sample(self, rtt: float) -> None:
+        """Feed the round trip time of a request that was sent only once."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self._samples.append(rtt)
+        self._rto = min(max(self.srtt + self.K * self.rttvar, self._min_rto), self._max_rto)
+
+    def backoff(self, rto: float) -> float:
+        """Return the timeout to use after a retransmission."""
+        return min(rto * 2, self._max_rto)
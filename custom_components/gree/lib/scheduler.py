@@ -0,0 +1,282 @@
+"""Fleet wide poll scheduling.
+
+One `FleetPoller` owns the status polls of every device. Devices are spread
+evenly over the poll interval and the number of requests in flight is capped,
+so a large fleet produces a flat load instead of a burst every interval.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from asyncio.events import AbstractEventLoop
+
+from .device import Device
+
+_LOGGER = logging.getLogger(__name__)
+
+# Fractional part of the golden ratio, consecutive multiples of it spread
+# evenly over [0, 1) whatever the fleet size ends up being.
+_GOLDEN = 0.6180339887498949
+
+
+def _slot_after(slot: float, when: float, interval: float) -> float:
+    """Return the first slot after `when` on the grid of `slot`."""
+    return slot + ((when - slot) // interval + 1) * interval
+
+
+class AdaptiveInterval:
+    """Poll interval that speeds up on activity and backs off while idle.
+
+    After activity, or a poll that saw a change, the device is polled at the
+    minimum interval for `fast_window` seconds. Past the window, every poll
+    that reports identical readings multiplies the interval by `backoff`, up
+    to the maximum.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, fast_window: float, backoff: float = 2.0) -> None:
+        """Initialize the interval at its minimum."""
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._fast_window = fast_window
+        self._backoff = backoff
+        self._current = min_interval
+        self._fast_until = 0.0
+
+    @property
+    def current(self) -> float:
+        """Return the current interval in seconds."""
+        return self._current
+
+    def activity(self, now: float) -> None:
+        """Drop to the minimum interval for the fast poll window."""
+        self._current = self.min_interval
+        self._fast_until = now + self._fast_window
+
+    def observe(self, changed: bool, now: float) -> float:
+        """Record the outcome of a poll and return the interval until the next one."""
+        if changed:
+            self.activity(now)
+        elif now >= self._fast_until:
+            self._current = min(self._current * self._backoff, self.max_interval)
+        return self._current
+
+
+class PollListener:
+    """Base class for receivers of poll results."""
+
+    def poll_finished(self, device: Device, error: Exception | None) -> None:
+        """Called after every poll of the device, `error` is None on success."""
+
+
+class _PollEntry:
+    __slots__ = ("device", "listener", "slot", "due", "removed", "interval")
+
+    def __init__(self, device: Device, listener: PollListener, slot: float, interval: AdaptiveInterval = None) -> None:
+        self.device = device
+        self.listener = listener
+        self.slot = slot
+        self.due = slot
+        self.removed = False
+        self.interval = interval
+
+
+class FleetPoller:
+    """Poll a fleet of devices on a shared, evenly spread schedule.
+
+    With `min_interval` and `max_interval` every device gets an
+    `AdaptiveInterval`, otherwise all devices are polled every `interval`.
+    """
+
+    def __init__(
+            self,
+            interval: float = 60,
+            max_in_flight: int = 8,
+            jitter: float = 1.0,
+            min_interval: float = None,
+            max_interval: float = None,
+            fast_window: float = 120,
+            loop: AbstractEventLoop = None,
+    ):
+        """Initialize the poller.
+
+        Args:
+            interval (float): Seconds between two polls of the same device
+            max_in_flight (int): Maximum number of status requests in flight
+            jitter (float): Maximum random delay in seconds added to each poll
+            min_interval (float): Fastest adaptive poll interval
+            max_interval (float): Slowest adaptive poll interval
+            fast_window (float): Seconds of fast polling after activity or a change
+            loop (AbstractEventLoop): Async event loop
+        """
+        self._interval = interval
+        self._jitter = jitter
+        self._adaptive = (min_interval, max_interval, fast_window) if min_interval and max_interval else None
+        self._loop = loop or asyncio.get_event_loop()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+        self._entries = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._slots = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._polls = set()
+        self._epoch = self._loop.time()
+
+    @property
+    def interval(self) -> float:
+        """Return the poll interval in seconds."""
+        return self._interval
+
+    @property
+    def devices(self) -> list[Device]:
+        """Return the devices being polled."""
+        return [entry.device for entry in self._entries.values()]
+
+    def add(self, device: Device, listener: PollListener) -> None:
+        """Start polling a device, results are handed to the listener.
+
+        The first poll is placed at the next free phase of the interval, the
+        caller is expected to have fetched the initial state already.
+        """
+        if device in self._entries:
+            return
+
+        slot = self._epoch + (next(self._slots) * _GOLDEN) % 1.0 * self._interval
+        now = self._loop.time()
+        if slot < now:
+            slot = _slot_after(slot, now, self._interval)
+        entry = _PollEntry(device, listener, slot, AdaptiveInterval(*self._adaptive) if self._adaptive else None)
+        self._entries[device] = entry
+        self._push(entry)
+
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    def remove(self, device: Device) -> None:
+        """Stop polling a device."""
+        entry = self._entries.pop(device, None)
+        if entry is not None:
+            entry.removed = True
+
+    def activity(self, device: Device) -> None:
+        """Poll a device at the fast rate, e.g. after a command was sent to it."""
+        entry = self._entries.get(device)
+        if entry is None or entry.interval is None:
+            return
+
+        now = self._loop.time()
+        entry.interval.activity(now)
+        due = now + entry.interval.current
+        if due < entry.due:
+            entry.due = due
+            self._push(entry)
+
+    def stop(self) -> None:
+        """Stop polling every device."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._polls:
+            task.cancel()
+        for entry in self._entries.values():
+            entry.removed = True
+        self._entries.clear()
+        self._heap.clear()
+
+    def _push(self, entry: _PollEntry) -> None:
+        heapq.heappush(self._heap, (entry.due, next(self._counter), entry))
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due, _, entry = self._heap[0]
+            if entry.removed or due != entry.due:
+                # Stale heap item for a removed or rescheduled device
+                heapq.heappop(self._heap)
+                continue
+
+            delay = due - self._loop.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+
+            confirmed_until = self._confirmed_until(entry)
+            if confirmed_until is not None:
+                # A recent cmd ack already confirmed the state, skip this poll.
+                # The slot stays on its phase, `_poll` advances it from there.
+                next_slot = _slot_after(entry.slot, confirmed_until, self._current_interval(entry))
+                entry.due = next_slot + random.uniform(0, self._jitter)
+                self._push(entry)
+                continue
+
+            await self._semaphore.acquire()
+            task = self._loop.create_task(self._poll(entry))
+            self._polls.add(task)
+            task.add_done_callback(self._polls.discard)
+
+    def _current_interval(self, entry: _PollEntry) -> float:
+        return entry.interval.current if entry.interval is not None else self._interval
+
+    def _confirmed_until(self, entry: _PollEntry) -> float | None:
+        """Return until when a recent cmd ack vouches for the state, None if there was none.
+
+        Status replies don't count, every poll would otherwise find its
+        predecessor still fresh and postpone itself.
+        """
+        acked = entry.device.last_acked
+        if acked is None:
+            return None
+
+        until = acked + self._current_interval(entry)
+        return until if until > self._loop.time() else None
+
+    async def _poll(self, entry: _PollEntry) -> None:
+        error = None
+        changed = False
+        try:
+            if entry.removed:
+                return
+            changed = await entry.device.update_state()
+        except Exception as e:
+            error = e
+        finally:
+            self._semaphore.release()
+
+        if entry.removed:
+            return
+
+        now = self._loop.time()
+        if entry.interval is not None:
+            if error is None:
+                delay = entry.interval.observe(changed, now)
+            else:
+                # Don't back off an unreachable device past the base interval
+                delay = min(entry.interval.current, self._interval)
+        else:
+            delay = self._interval
+        # Advance from the previous slot, not from now, so the phases spread by
+        # `add` survive. A poll that overran its slot skips the missed rounds,
+        # an early poll after activity continues at the next slot after now.
+        entry.slot = _slot_after(entry.slot, now, delay)
+        entry.due = entry.slot + random.uniform(0, self._jitter)
+        self._push(entry)
+
+        try:
+            entry.listener.poll_finished(entry.device, error)
+        except Exception:
+            _LOGGER.exception("Uncaught exception in poll listener")
@@ -0,0 +1,365 @@
+"""Simulated Gree devices on the loopback network.
+
+Every virtual device owns a UDP socket on its own loopback address and port
+7000, like a real unit on a LAN, and answers scan, bind, status and cmd
+packets with the codec used by `network`. A responder on the broadcast
+address of the simulated network stands in for broadcast delivery, so
+`Discovery`, `Device` and the bridge can be driven against a whole fleet
+on one Linux box:
+
+    async with DeviceSimulator(500, latency=0.005, loss=0.01) as sim:
+        discovery = Discovery(allow_loopback=True)
+        await discovery.scan(2, bcast_ifaces=[sim.broadcast_address])
+
+Linux routes all of 127.0.0.0/8 to the loopback interface, other systems may
+need the addresses configured first. Each device takes one file descriptor.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import random
+import resource
+from asyncio.events import AbstractEventLoop
+from ipaddress import IPv4Address, IPv4Network
+from typing import Dict, List
+
+from . import codec
+from .codec import GENERIC_KEY
+from .device_infos import MODELS
+from .network import IPAddr
+
+_LOGGER = logging.getLogger(__name__)
+
+DEVICE_PORT = 7000
+SIMULATOR_NETWORK = "127.77.0.0/16"
+
+# Initial values of the properties a virtual device reports
+_INITIAL_STATE = {
+    "Pow": 0,
+    "WdSpd": 1,
+    "Mod": 0,
+    "Rotate": 0,
+    "LRAngle": 0,
+}
+
+
+class SimulatorStats:
+    """Packet counters of one virtual device."""
+
+    __slots__ = ("received", "sent", "dropped", "rejected")
+
+    def __init__(self) -> None:
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0  # lost on purpose, see `DeviceSimulator.loss`
+        self.rejected = 0  # malformed or encrypted with the wrong key
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class VirtualDevice(asyncio.DatagramProtocol):
+    """One simulated unit answering on its own address."""
+
+    def __init__(self, simulator: DeviceSimulator, mac: str, mid: str, ip: str, port: int = DEVICE_PORT) -> None:
+        self.simulator = simulator
+        self.mac = mac
+        self.mid = mid
+        self.ip = ip
+        self.port = port
+        self.name = f"sim-{mac[-6:]}"
+        self.key = None
+        self.hid = f"362001000762+U-{MODELS[mid].type_name}V1.0.bin" if simulator.with_hid else None
+        self.stats = SimulatorStats()
+
+        self.state = {prop: _INITIAL_STATE.get(prop) for prop in MODELS[mid].poll_props}
+        self.state["name"] = self.name
+        self.state["host"] = ip
+        if self.hid:
+            self.state["hid"] = self.hid
+
+        self._transport = None
+
+    @property
+    def address(self) -> IPAddr:
+        return self.ip, self.port
+
+    def connection_made(self, transport: asyncio.transports.DatagramTransport) -> None:
+        self._transport = transport
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def datagram_received(self, data: bytes, addr: IPAddr) -> None:
+        self.stats.received += 1
+        try:
+            obj = codec.decode_packet(data, self.key or GENERIC_KEY)
+        except ValueError:
+            # Wrong key or garbage, a real unit doesn't answer either
+            self.stats.rejected += 1
+            return
+        self.simulator.schedule(self, obj, addr)
+
+    def send(self, data: bytes, addr: IPAddr) -> None:
+        """Send raw bytes from the device's address, e.g. a forged or malformed reply."""
+        if self._transport is not None:
+            self._transport.sendto(data, addr)
+            self.stats.sent += 1
+
+    def reply(self, obj: dict, addr: IPAddr) -> None:
+        """Answer a decoded request."""
+        if self._transport is None:
+            return
+
+        if obj.get("t") == "scan":
+            response = self._scan_reply()
+        else:
+            pack = obj.get("pack")
+            if not isinstance(pack, dict):
+                self.stats.rejected += 1
+                return
+            response = self._pack_reply(pack, obj.get("i") == 1)
+            if response is None:
+                self.stats.rejected += 1
+                return
+
+        key = GENERIC_KEY if response["i"] == 1 else self.key
+        self._transport.sendto(codec.encode_packet(response, key), addr)
+        self.stats.sent += 1
+
+    def _envelope(self, pack: dict, generic: bool, tcid: str = "app") -> dict:
+        return {"t": "pack", "i": 1 if generic else 0, "uid": 0, "cid": self.mac, "tcid": tcid, "pack": pack}
+
+    def _scan_reply(self) -> dict:
+        return self._envelope(
+            {
+                "t": "dev",
+                "cid": self.mac,
+                "mac": self.mac,
+                "mid": self.mid,
+                "name": self.name,
+                "brand": "gree",
+                "model": "gree",
+                "ver": "V1.0.0",
+                "lock": 0,
+            },
+            True,
+            tcid="",
+        )
+
+    def _pack_reply(self, pack: dict, generic: bool) -> dict | None:
+        kind = pack.get("t")
+        if kind == "bind" and generic:
+            if self.key is None:
+                self.key = self.simulator.new_key()
+            return self._envelope({"t": "bindok", "mac": self.mac, "key": self.key, "r": 200}, True)
+
+        if generic or self.key is None:
+            # Status and cmd need the device key
+            return None
+
+        if kind == "status":
+            cols = [col for col in pack.get("cols", ()) if col in self.state]
+            return self._envelope(
+                {"t": "dat", "mac": self.mac, "r": 200, "cols": cols, "dat": [self.state[col] for col in cols]},
+                False,
+            )
+
+        if kind == "cmd":
+            opt = pack.get("opt", [])
+            values = pack.get("p", [])
+            for col, value in zip(opt, values):
+                if col in self.state:
+                    self.state[col] = value
+            return self._envelope(
+                {"t": "res", "mac": self.mac, "r": 200, "opt": opt, "p": values, "val": values},
+                False,
+            )
+
+        return None
+
+
+class _BroadcastResponder(asyncio.DatagramProtocol):
+    """Hands scan packets sent to the broadcast address to every device."""
+
+    def __init__(self, simulator: DeviceSimulator) -> None:
+        self._simulator = simulator
+
+    def datagram_received(self, data: bytes, addr: IPAddr) -> None:
+        try:
+            obj = codec.decode_packet(data)
+        except ValueError:
+            return
+        if obj.get("t") == "scan":
+            simulator = self._simulator
+            for device in simulator.devices:
+                device.stats.received += 1
+                simulator.schedule(device, obj, addr, simulator.random.uniform(0, simulator.scan_window))
+
+
+class DeviceSimulator:
+    """A fleet of virtual devices with configurable latency, loss and model mix."""
+
+    def __init__(
+            self,
+            count: int = 1,
+            models: Dict[str, float] | None = None,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            loss: float = 0.0,
+            scan_window: float = 1.0,
+            network: str = SIMULATOR_NETWORK,
+            with_hid: bool = True,
+            seed: int | None = None,
+            loop: AbstractEventLoop = None,
+    ) -> None:
+        """Initialize the simulator, `start` opens the sockets.
+
+        Args:
+            count (int): Number of virtual devices
+            models (Dict[str, float]): Relative weight of each mid, every model
+                                       of `DEVICE_MAP` equally by default
+            latency (float): Seconds before a device answers
+            jitter (float): Maximum random seconds added to the latency
+            loss (float): Probability that a request is silently dropped
+            scan_window (float): Seconds the replies to a broadcast scan are spread
+                                 over, a whole fleet answering at once overflows
+                                 the receive buffer of the scanning socket
+            network (str): Loopback network the device addresses are taken from
+            with_hid (bool): Whether devices report a firmware `hid`
+            seed (int): Seed of the random model mix, latency and loss
+            loop (AbstractEventLoop): Async event loop
+        """
+        self.network = IPv4Network(network)
+        if count > self.network.num_addresses - 3:
+            raise ValueError(f"{network} can't hold {count} devices")
+
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.scan_window = scan_window
+        self.with_hid = with_hid
+        self.random = random.Random(seed)
+        self._loop = loop or asyncio.get_event_loop()
+
+        models = models or {mid: 1.0 for mid in MODELS}
+        unknown = set(models) - set(MODELS)
+        if unknown:
+            raise ValueError(f"Unknown type ids: {', '.join(sorted(unknown))}")
+        mids = self.random.choices(list(models), weights=list(models.values()), k=count)
+
+        # The first host is left out, it is the network's gateway by convention
+        hosts = self.network.hosts()
+        next(hosts)
+        self.devices: List[VirtualDevice] = [
+            VirtualDevice(self, f"c0ffee{i:06x}", mid, str(next(hosts)))
+            for i, mid in enumerate(mids)
+        ]
+        self._by_mac = {device.mac: device for device in self.devices}
+        self._responder = None
+
+    @property
+    def broadcast_address(self) -> IPv4Address:
+        """Return the address scans should be sent to."""
+        return self.network.broadcast_address
+
+    def device(self, mac: str) -> VirtualDevice | None:
+        """Return the virtual device with a mac, None if there is none."""
+        return self._by_mac.get(mac)
+
+    def stats(self) -> dict:
+        """Return the packet counters summed over the fleet."""
+        total = SimulatorStats()
+        for device in self.devices:
+            for name in SimulatorStats.__slots__:
+                setattr(total, name, getattr(total, name) + getattr(device.stats, name))
+        return total.as_dict()
+
+    def new_key(self) -> str:
+        """Return a random 16 character device key."""
+        return "".join(self.random.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=16))
+
+    def schedule(self, device: VirtualDevice, obj: dict, addr: IPAddr, delay: float = 0.0) -> None:
+        """Have a device answer a request after the simulated latency, unless it is lost."""
+        if self.loss and self.random.random() < self.loss:
+            device.stats.dropped += 1
+            return
+
+        delay += self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            self._loop.call_later(delay, device.reply, obj, addr)
+        else:
+            device.reply(obj, addr)
+
+    async def start(self) -> None:
+        """Open a socket for every device and the broadcast responder."""
+        _raise_file_limit(len(self.devices) + 64)
+        try:
+            for device in self.devices:
+                await self._loop.create_datagram_endpoint(lambda d=device: d, local_addr=device.address)
+            self._responder, _ = await self._loop.create_datagram_endpoint(
+                lambda: _BroadcastResponder(self), local_addr=(str(self.broadcast_address), DEVICE_PORT)
+            )
+        except OSError:
+            self.close()
+            raise
+        _LOGGER.info("Simulating %i devices on %s", len(self.devices), self.network)
+
+    def close(self) -> None:
+        """Close every socket."""
+        for device in self.devices:
+            device.close()
+        if self._responder is not None:
+            self._responder.close()
+            self._responder = None
+
+    async def __aenter__(self) -> DeviceSimulator:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+
+def _raise_file_limit(needed: int) -> None:
+    """Raise the soft open file limit towards the hard one if the fleet needs it."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    models = None
+    if args.models:
+        models = {mid: 1.0 for mid in args.models.split(",")}
+    async with DeviceSimulator(args.count, models, args.latency, args.jitter, args.loss, args.scan_window,
+                               args.network, seed=args.seed) as simulator:
+        print(f"{len(simulator.devices)} devices on {simulator.network}, scan {simulator.broadcast_address}")
+        while True:
+            await asyncio.sleep(60)
+            print(simulator.stats())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve simulated Gree devices on the loopback network")
+    parser.add_argument("--count", type=int, default=100, help="Number of devices")
+    parser.add_argument("--models", help="Comma separated type ids, every known model by default")
+    parser.add_argument("--latency", type=float, default=0.0, help="Reply latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random latency added in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability a request is dropped")
+    parser.add_argument("--scan-window", type=float, default=1.0, help="Seconds scan replies are spread over")
+    parser.add_argument("--network", default=SIMULATOR_NETWORK, help="Loopback network of the device addresses")
+    parser.add_argument("--seed", type=int, help="Random seed")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Snapshot of known devices, used to warm start without scanning and binding.
+
+A snapshot maps each mac to where the device was last seen and what was
+learned from it: address, model, device key and firmware. It is a plain
+JSON compatible dict, so it can go to a Home Assistant `Store` or a file.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from typing import Iterator
+
+from .device import Device
+from .device_infos import create_device_info
+from .gree_device import GreeDeviceInfo
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DeviceSnapshot:
+    """Last known address, key and firmware of each device, keyed by mac."""
+
+    def __init__(self, entries: dict | None = None) -> None:
+        """Initialize the snapshot.
+
+        Args:
+            entries (dict): Entries of a previous snapshot, as returned by `as_dict`
+        """
+        self._entries = dict(entries or {})
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, mac: str) -> bool:
+        return mac in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def as_dict(self) -> dict:
+        """Return the snapshot as a JSON compatible dict."""
+        return dict(self._entries)
+
+    def record(self, device: Device) -> bool:
+        """Store the current state of a bound device.
+
+        Returns:
+            bool: True if the entry changed and the snapshot should be saved
+        """
+        if not device.device_key:
+            return False
+
+        info = device.device_info
+        entry = {
+            "ip": info.ip,
+            "port": info.port,
+            "mid": info.mid,
+            "name": info.name,
+            "brand": info.brand,
+            "model": info.model,
+            "ver": info.version,
+            "device_key": device.device_key,
+            "hid": device.hid,
+            "hid_probed": device.hid_probed,
+        }
+        if self._entries.get(info.mac) == entry:
+            return False
+        self._entries[info.mac] = entry
+        return True
+
+    def remove(self, mac: str) -> bool:
+        """Forget a device, returns True if it was known."""
+        return self._entries.pop(mac, None) is not None
+
+    def device_info(self, mac: str) -> GreeDeviceInfo | None:
+        """Rebuild the device info of a known device, None if it can't be restored."""
+        entry = self._entries.get(mac)
+        if entry is None:
+            return None
+
+        device_info = create_device_info(
+            entry.get("mid"),
+            entry.get("name"),
+            entry["ip"],
+            entry["port"],
+            mac,
+            entry.get("brand"),
+            entry.get("model"),
+            entry.get("ver"),
+        )
+        if device_info is None:
+            _LOGGER.warning("Ignoring snapshot of %s, type id %s is not supported", mac, entry.get("mid"))
+        return device_info
+
+    def restore(self, mac: str, **kwargs) -> Device | None:
+        """Create a bound device from its snapshot, None if it can't be restored.
+
+        Keyword arguments are passed on to `Device`.
+        """
+        device_info = self.device_info(mac)
+        if device_info is None:
+            return None
+
+        entry = self._entries[mac]
+        device = Device(device_info, **kwargs)
+        device.restore(entry["device_key"], entry.get("hid"), entry.get("hid_probed", False))
+        return device
+
+
+def load_snapshot(path: str) -> DeviceSnapshot:
+    """Read a snapshot file, an empty snapshot if there is none."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return DeviceSnapshot(json.load(file))
+    except FileNotFoundError:
+        return DeviceSnapshot()
+    except ValueError:
+        _LOGGER.warning("Ignoring unreadable device snapshot %s", path)
+        return DeviceSnapshot()
+
+
+def save_snapshot(path: str, snapshot: DeviceSnapshot) -> None:
+    """Write a snapshot file."""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(snapshot.as_dict(), file, indent=2)
@@ -0,0 +1,79 @@
+"""Per-device packet tracing.
+
+A `PacketTrace` is attached to a device session only while tracing is wanted,
+sessions without one pay a single `is None` check per exchange.
+"""
+from __future__ import annotations
+
+import json
+from collections import deque
+from typing import Iterator
+
+DEFAULT_TRACE_SIZE = 256
+
+# Pack fields never kept in a trace, traces end up attached to bug reports
+REDACTED_FIELDS = frozenset({"key"})
+REDACTED = "**REDACTED**"
+
+
+def _redact(envelope):
+    """Return the envelope with the secret fields of its pack masked."""
+    pack = envelope.get("pack") if isinstance(envelope, dict) else None
+    if not isinstance(pack, dict) or REDACTED_FIELDS.isdisjoint(pack):
+        return envelope
+    pack = {name: REDACTED if name in REDACTED_FIELDS else value for name, value in pack.items()}
+    return dict(envelope, pack=pack)
+
+
+class PacketTrace:
+    """Fixed size ring buffer of decoded request/reply pairs for one device."""
+
+    def __init__(self, size: int = DEFAULT_TRACE_SIZE) -> None:
+        """Initialize the trace.
+
+        Args:
+            size (int): Number of exchanges kept, older ones are dropped
+        """
+        self._records = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self._records)
+
+    @property
+    def size(self) -> int:
+        """Return the capacity of the ring buffer."""
+        return self._records.maxlen
+
+    def clear(self) -> None:
+        """Drop every recorded exchange."""
+        self._records.clear()
+
+    def record(self, request, reply, sent_at: float, rtt: float | None, error: str | None = None,
+               sent: int = 1) -> None:
+        """Record one exchange, device keys handed out by bind replies are masked.
+
+        Args:
+            request (dict): Decoded request envelope
+            reply (dict): Decoded reply envelope, None if there was none
+            sent_at (float): Wall clock time the request was sent
+            rtt (float): Round trip time in seconds, None if there was no reply
+            error (str): Description of the failure, if any
+            sent (int): Number of times the request went out, retransmissions included
+        """
+        self._records.append(
+            {
+                "ts": sent_at,
+                "rtt_ms": None if rtt is None else round(rtt * 1000, 3),
+                "sent": sent,
+                "request": _redact(request),
+                "reply": _redact(reply),
+                "error": error,
+            }
+        )
+
+    def export(self) -> str:
+        """Return the recorded exchanges as JSON lines, oldest first."""
+        return "".join(json.dumps(r) + "\n" for r in self._records)
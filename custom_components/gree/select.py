@@ -7,11 +7,11 @@ from homeassistant.helpers.device_registry import CONNECTION_NETWORK_MAC
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity import DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
-from .bridge import DeviceDataUpdateCoordinator
 from .constant import COORDINATORS, DISPATCH_DEVICE_DISCOVERED, DISPATCHERS, DOMAIN
-from .lib.enums import LRRotateAngle
+from .entity import GreeEntity
+from .lib.enums import LRRotateAngle, Props
+from .lib.features import Capability
 
 LRAngleDescMap = {
     LRRotateAngle.Normal: "已关闭",
@@ -34,8 +34,7 @@ async def async_setup_entry(
     def init_device(coordinator):
         """Register the device."""
 
-        features = coordinator.device.device_info.support_features()
-        if any([f.lr_angle() for f in features]):
+        if coordinator.device.device_info.capabilities & Capability.LR_ANGLE:
             async_add_entities([GreeTowerFanRotateAngleEntity(coordinator)])
 
     for coordinator in hass.data[DOMAIN][COORDINATORS]:
@@ -46,9 +45,11 @@ async def async_setup_entry(
     )
 
 
-class GreeTowerFanRotateAngleEntity(CoordinatorEntity[DeviceDataUpdateCoordinator], SelectEntity):
+class GreeTowerFanRotateAngleEntity(GreeEntity, SelectEntity):
     """Representation of the front panel light on the device."""
 
+    _props = (Props.LR_ANGLE,)
+
     def __init__(self, coordinator):
         """Initialize the Gree device."""
         super().__init__(coordinator)
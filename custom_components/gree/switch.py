@@ -9,11 +9,11 @@ from homeassistant.helpers.device_registry import CONNECTION_NETWORK_MAC
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity import DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
-from .bridge import DeviceDataUpdateCoordinator
 from .constant import COORDINATORS, DISPATCH_DEVICE_DISCOVERED, DISPATCHERS, DOMAIN
-from .lib.enums import FanMode
+from .entity import GreeEntity
+from .lib.enums import FanMode, Props
+from .lib.features import Capability
 
 
 async def async_setup_entry(
@@ -26,8 +26,7 @@ async def async_setup_entry(
     @callback
     def init_device(coordinator):
         """Register the device."""
-        features = coordinator.device.device_info.support_features()
-        if any([f.mode() for f in features]):
+        if coordinator.device.device_info.capabilities & Capability.MODE:
             async_add_entities(
                 [
                     GreeTowerFanModeEntity(coordinator),
@@ -42,9 +41,11 @@ async def async_setup_entry(
     )
 
 
-class GreeTowerFanModeEntity(CoordinatorEntity[DeviceDataUpdateCoordinator], SwitchEntity):
+class GreeTowerFanModeEntity(GreeEntity, SwitchEntity):
     """Representation of the front panel light on the device."""
 
+    _props = (Props.MODE,)
+
     def __init__(self, coordinator):
         """Initialize the Gree device."""
         super().__init__(coordinator)
@@ -1,52 +1,299 @@
+"""Gree command line utility.
+
+Runs discover, bind, status and set against every unit on the network at
+once, or the ones picked with --mac, without Home Assistant:
+
+    python gree_test.py discover
+    python gree_test.py status --concurrency 64
+    python gree_test.py set Pow=1 WdSpd=4 --mac c8f742aabbcc
+
+Each result is printed as a JSON line on stdout as soon as it is known, with
+the milliseconds the device took (ms) and the time since the start of the run
+(at_ms). A summary goes to stderr. Keys learned by
+binding are kept in a snapshot file (--cache), later runs reuse them and skip
+the bind exchange, --cached skips the discovery scan as well.
+"""
 import argparse
 import asyncio
+import json
 import logging
+import sys
+import time
+from ipaddress import IPv4Address, IPv4Network
+from typing import Awaitable, Callable, Dict
 
 from custom_components.gree.lib.device import Device
 from custom_components.gree.lib.discovery import Listener, Discovery
+from custom_components.gree.lib.enums import Props
+from custom_components.gree.lib.exceptions import DeviceNotBoundError, DeviceTimeoutError
 from custom_components.gree.lib.gree_device import GreeDeviceInfo
+from custom_components.gree.lib.network import SharedEndpoint
+from custom_components.gree.lib.snapshot import DeviceSnapshot, load_snapshot, save_snapshot
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(name)s - %(levelname)s - %(message)s"
-)
 _LOGGER = logging.getLogger(__name__)
 
+DEFAULT_CACHE = "gree_devices.json"
+DEFAULT_CONCURRENCY = 32
+DEFAULT_WAIT = 2
+
+
+def emit(record: dict, file=sys.stdout) -> None:
+    """Print a result as one JSON line."""
+    print(json.dumps(record), file=file, flush=True)
 
-class DiscoveryListener(Listener):
-    def __init__(self, bind):
-        """Initialize the event handler."""
-        super().__init__()
-        self.bind = bind
 
-    """Class to handle incoming device discovery events."""
+class FleetRunner(Listener):
+    """Runs an operation on every device as soon as it is found."""
+
+    def __init__(
+            self,
+            operation: Callable[["FleetRunner", Device], Awaitable[dict]],
+            snapshot: DeviceSnapshot,
+            endpoint: SharedEndpoint,
+            concurrency: int = DEFAULT_CONCURRENCY,
+            macs: set = None,
+    ) -> None:
+        """Initialize the runner.
+
+        Args:
+            operation: Coroutine function run for each device, returns the fields it reports
+            snapshot (DeviceSnapshot): Known keys, updated with every bind
+            endpoint (SharedEndpoint): Socket shared by every device
+            concurrency (int): Maximum number of devices worked on at once
+            macs (set): Only these devices, every device when empty
+        """
+        super().__init__()
+        self.operation = operation
+        self.snapshot = snapshot
+        self.endpoint = endpoint
+        self.macs = macs
+        self.results: Dict[str, bool] = {}
+        self.timings = []
+        self.started = time.perf_counter()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = set()
 
     async def device_found(self, device_info: GreeDeviceInfo) -> None:
-        """A new device was found on the network."""
-        if self.bind:
-            device = Device(device_info)
-            await device.bind()
-            await device.request_version()
-            _LOGGER.info(f"Device firmware: {device.hid}")
+        """Start working on a found device, discovery isn't held up meanwhile."""
+        self.start(device_info)
 
+    def start(self, device_info: GreeDeviceInfo) -> None:
+        """Start working on a device, unless it was already or isn't selected."""
+        mac = device_info.mac
+        if mac in self.results or self.macs and mac not in self.macs:
+            return
+        self.results[mac] = False
 
-async def run_discovery(bind=False):
-    """Run the device discovery process."""
-    _LOGGER.debug("Scanning network for Gree devices")
+        if mac in self.snapshot:
+            device = self.snapshot.restore(mac, endpoint=self.endpoint, coalesce_window=0)
+        else:
+            device = None
+        if device is None:
+            device = Device(device_info, endpoint=self.endpoint, coalesce_window=0)
+        else:
+            # The cached address may be out of date
+            device.device_info.ip = device_info.ip
+            device.device_info.port = device_info.port
 
-    discovery = Discovery()
-    listener = DiscoveryListener(bind)
-    discovery.add_listener(listener)
+        task = asyncio.get_running_loop().create_task(self._run(device))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
-    await discovery.scan(wait_for=10)
+    def add_cached(self) -> None:
+        """Work on every device of the snapshot at its cached address."""
+        for mac in self.snapshot:
+            device_info = self.snapshot.device_info(mac)
+            if device_info is not None:
+                self.start(device_info)
 
-    _LOGGER.info("Done discovering devices")
+    async def wait(self) -> None:
+        """Wait until every started device is done."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
 
+    async def bind(self, device: Device) -> None:
+        """Bind a device and remember its key."""
+        await device.bind()
+        self.snapshot.record(device)
+
+    async def ensure_bound(self, device: Device, request: Callable[[], Awaitable]):
+        """Run a request with the cached key, binding first or again when that fails.
+
+        A unit that was reset ignores requests encrypted with its old key.
+        """
+        if not device.device_key:
+            await self.bind(device)
+            return await request()
+        try:
+            return await request()
+        except DeviceTimeoutError:
+            _LOGGER.info("No reply from %s with the cached key, binding again", device.device_info.mac)
+            await self.bind(device)
+            return await request()
+
+    async def _run(self, device: Device) -> None:
+        info = device.device_info
+        record = {"mac": info.mac, "ip": info.ip, "name": info.name, "mid": info.mid, "model": info.d_type}
+        async with self._semaphore:
+            # Timed from here, waiting for a free slot isn't the device's doing
+            start = time.perf_counter()
+            try:
+                record.update(await self.operation(self, device))
+                record["ok"] = self.results[info.mac] = True
+            except (DeviceNotBoundError, DeviceTimeoutError, asyncio.TimeoutError, OSError, ValueError) as error:
+                record["ok"] = False
+                record["error"] = type(error).__name__ + (f": {error}" if str(error) else "")
+            finally:
+                device.close()
+            done = time.perf_counter()
+        self.timings.append(done - start)
+        record["ms"] = round((done - start) * 1000, 1)
+        record["at_ms"] = round((done - self.started) * 1000, 1)
+        emit(record)
+
+    def summary(self) -> dict:
+        """Return the counts and timing of the whole run."""
+        timings = sorted(self.timings)
+
+        def percentile(q):
+            return round(timings[min(len(timings) - 1, int(q * len(timings)))] * 1000, 1) if timings else None
+
+        return {
+            "devices": len(self.results),
+            "ok": sum(self.results.values()),
+            "failed": len(self.results) - sum(self.results.values()),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": percentile(1.0),
+            "seconds": round(time.perf_counter() - self.started, 3),
+        }
+
+
+async def op_discover(runner: FleetRunner, device: Device) -> dict:
+    info = device.device_info
+    return {"port": info.port, "brand": info.brand, "ver": info.version, "cached": bool(device.device_key)}
+
+
+async def op_bind(runner: FleetRunner, device: Device) -> dict:
+    await runner.bind(device)
+    return {"key": device.device_key}
+
+
+async def op_status(runner: FleetRunner, device: Device) -> dict:
+    await runner.ensure_bound(device, device.update_state)
+    runner.snapshot.record(device)
+    return {"hid": device.hid, "version": device.version, "properties": device.properties}
+
+
+def op_set(values: Dict[Props, object]):
+    """Return the operation setting the given properties."""
+
+    async def operation(runner: FleetRunner, device: Device) -> dict:
+        supported = device.device_info.d_pros
+        unsupported = [prop.value for prop in values if prop.value not in supported]
+        if unsupported:
+            raise ValueError(f"{', '.join(unsupported)} not supported by {device.device_info.d_type}")
+
+        async def push():
+            for prop, value in values.items():
+                device.set_property(prop, value)
+            await device.push_state_update()
+
+        await runner.ensure_bound(device, push)
+        return {"properties": {prop.value: device.get_property(prop) for prop in values}}
+
+    return operation
+
+
+def parse_assignment(text: str):
+    """Parse a `Prop=value` argument, values are JSON, bare words are strings."""
+    name, sep, raw = text.partition("=")
+    try:
+        prop = Props(name)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"unknown property {name}, one of {', '.join(p.value for p in Props)}"
+        ) from None
+    if not sep:
+        raise argparse.ArgumentTypeError(f"{text} is not Prop=value")
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        value = raw
+    return prop, value
+
+
+async def run(args: argparse.Namespace) -> int:
+    if args.command == "discover":
+        operation = op_discover
+    elif args.command == "bind":
+        operation = op_bind
+    elif args.command == "status":
+        operation = op_status
+    else:
+        operation = op_set(dict(args.values))
+
+    snapshot = load_snapshot(args.cache) if args.cache else DeviceSnapshot()
+    before = snapshot.as_dict()
+    endpoint = SharedEndpoint()
+    runner = FleetRunner(operation, snapshot, endpoint, args.concurrency, set(args.mac or ()))
+
+    discovery = None
+    try:
+        if args.cached:
+            runner.add_cached()
+        else:
+            discovery = Discovery(allow_loopback=args.loopback)
+            discovery.add_listener(runner)
+            await discovery.scan(args.wait, bcast_ifaces=args.bcast, networks=args.network)
+        await runner.wait()
+    finally:
+        if discovery is not None:
+            discovery.close()
+        endpoint.close()
+
+    if args.cache and snapshot.as_dict() != before:
+        save_snapshot(args.cache, snapshot)
+
+    summary = runner.summary()
+    emit({"summary": args.command, **summary}, file=sys.stderr)
+    return 0 if summary["failed"] == 0 else 1
+
+
+def main() -> None:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--mac", action="append", help="Only this device, may be repeated")
+    common.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Devices worked on at once")
+    common.add_argument("--wait", type=float, default=DEFAULT_WAIT, help="Seconds to listen for scan replies")
+    common.add_argument("--bcast", action="append", type=IPv4Address,
+                        help="Broadcast address to scan, every interface by default, may be repeated")
+    common.add_argument("--network", action="append", type=IPv4Network,
+                        help="Network to sweep with unicast scans, may be repeated")
+    common.add_argument("--loopback", action="store_true", help="Allow scanning the loopback interface")
+    common.add_argument("--cache", default=DEFAULT_CACHE,
+                        help="Snapshot file of known device keys, empty to disable")
+    common.add_argument("--cached", action="store_true",
+                        help="Skip the scan and use the devices of the snapshot file")
+    common.add_argument("-v", "--verbose", action="store_true", help="Log every packet")
 
-if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Gree command line utility.")
-    parser.add_argument("--discovery", default=True, action="store_true")
-    parser.add_argument("--bind", default=True, action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("discover", parents=[common], help="List the devices on the network")
+    commands.add_parser("bind", parents=[common], help="Bind every device and store its key")
+    commands.add_parser("status", parents=[common], help="Print the state of every device")
+    set_parser = commands.add_parser("set", parents=[common], help="Set properties, e.g. Pow=1 WdSpd=4")
+    set_parser.add_argument("values", nargs="+", type=parse_assignment, metavar="Prop=value")
     args = parser.parse_args()
 
-    if args.discovery:
-        asyncio.run(run_discovery(args.bind))
+    if args.cached and not args.cache:
+        parser.error("--cached needs a --cache file")
+
+    # The lib logs every packet at debug level
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Shared fixtures.
+
+Coroutine tests run on an event loop with a virtual clock: whenever the loop
+has nothing left to do but wait for a timer, the clock jumps to it. Poll
+intervals, retransmission timeouts and scan windows pass at once, while the
+traffic with the simulator still goes over real loopback sockets.
+"""
+import asyncio
+import inspect
+import selectors
+
+import pytest
+
+from custom_components.gree.lib.device_infos import create_device_info
+from custom_components.gree.lib.metrics import MetricsRegistry
+
+# Real seconds the loop waits for packets before the clock jumps to the next timer
+IO_WAIT = 0.01
+
+
+class VirtualClockSelector(selectors.DefaultSelector):
+    """Selector that moves a virtual clock forward instead of sleeping."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        events = super().select(IO_WAIT if timeout is None else min(timeout, IO_WAIT))
+        if not events and timeout:
+            self.now += timeout
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time is the virtual clock of its selector."""
+
+    def __init__(self) -> None:
+        self._clock = VirtualClockSelector()
+        super().__init__(self._clock)
+
+    def time(self) -> float:
+        return self._clock.now
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Run coroutine tests to completion on a fresh virtual clock loop.
+
+    Exceptions the loop would only log, e.g. raised by a protocol callback,
+    fail the test.
+    """
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    kwargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    errors = []
+    with asyncio.Runner(loop_factory=VirtualClockLoop) as runner:
+        runner.get_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        runner.run(pyfuncitem.obj(**kwargs))
+    if errors:
+        pytest.fail(f"Unhandled error in the event loop: {errors[0].get('exception') or errors[0]['message']}")
+    return True
+
+
+@pytest.fixture
+def device_info():
+    """Return a function building the device info of a virtual device."""
+
+    def build(virtual):
+        return create_device_info(virtual.mid, virtual.name, virtual.ip, virtual.port, virtual.mac)
+
+    return build
+
+
+@pytest.fixture
+def metrics():
+    """Return a registry of its own, so counters don't leak between tests."""
+    return MetricsRegistry()
@@ -0,0 +1,67 @@
+"""Packet encryption and decoding."""
+import base64
+
+import pytest
+
+from custom_components.gree.lib import codec
+
+KEY = "0123456789abcdef"
+
+
+@pytest.mark.parametrize("pack", [{}, {"t": "dev"}, {"t": "dat", "cols": ["Pow"] * 20, "dat": [1] * 20}])
+def test_round_trip(pack):
+    # Sizes below, at and above a block boundary
+    assert codec.decrypt_payload(codec.encrypt_payload(pack, KEY), KEY) == pack
+
+
+def test_packet_round_trip():
+    obj = {"t": "pack", "i": 0, "cid": "app", "pack": {"t": "status", "cols": ["Pow"]}}
+    data = codec.encode_packet(obj, KEY)
+    assert codec.decode_packet(data, KEY) == obj
+
+    # `i: 1` packets are always encrypted with the generic key
+    generic = dict(obj, i=1)
+    assert codec.decode_packet(codec.encode_packet(generic, KEY)) == generic
+
+
+def test_ciphers_are_cached_per_key():
+    assert codec.get_cipher(KEY) is codec.get_cipher(KEY)
+    assert codec.get_cipher(KEY) is not codec.get_cipher(codec.GENERIC_KEY)
+
+    cipher = codec.get_cipher(KEY)
+    codec.forget_key(KEY)
+    assert codec.get_cipher(KEY) is not cipher
+    # The generic key is never forgotten
+    generic = codec.get_cipher(codec.GENERIC_KEY)
+    codec.forget_key(codec.GENERIC_KEY)
+    assert codec.get_cipher(codec.GENERIC_KEY) is generic
+
+
+def test_decrypt_payload_accepts_bytes():
+    payload = codec.encrypt_payload({"t": "dat"}, KEY)
+    assert codec.decrypt_payload(payload.encode(), KEY) == {"t": "dat"}
+
+
+@pytest.mark.parametrize("padding", [b" ", b"\x00"])
+def test_decrypt_payload_without_pkcs7_padding(padding):
+    # Some firmwares pad with other bytes, the JSON ends at the last brace
+    text = b'{"t": "res"}'.ljust(32, padding)
+    payload = base64.b64encode(codec.get_cipher(KEY).encrypt(text))
+    assert codec.decrypt_payload(payload, KEY) == {"t": "res"}
+
+
+def test_decrypt_payload_rejects_garbage():
+    payload = base64.b64encode(codec.get_cipher(KEY).encrypt(b"x" * 16))
+    with pytest.raises(ValueError):
+        codec.decrypt_payload(payload, KEY)
+
+
+def test_decrypt_payloads_in_one_batch():
+    packs = [{"t": "dev", "mac": f"{n:012x}", "name": "x" * n} for n in range(20)]
+    payloads = [codec.encrypt_payload(pack, KEY) for pack in packs]
+    garbage = base64.b64encode(codec.get_cipher(KEY).encrypt(b"x" * 16)).decode()
+    payloads[3:3] = ["not base64!", "c2hvcnQ=", garbage]
+
+    # Bad entries don't shift the ones behind them
+    assert codec.decrypt_payloads(payloads, KEY) == packs[:3] + [None, None, None] + packs[3:]
+    assert codec.decrypt_payloads([], KEY) == []
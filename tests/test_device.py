@@ -0,0 +1,198 @@
+"""Device state against a simulated unit."""
+import asyncio
+
+import pytest
+
+from custom_components.gree.lib.device import Device
+from custom_components.gree.lib.enums import Props
+from custom_components.gree.lib.simulator import DeviceSimulator
+
+NETWORK = "127.80.0.0/24"
+
+
+async def test_changes_made_together_share_one_cmd(device_info):
+    async with DeviceSimulator(1, models={"828211": 1}, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual))
+        try:
+            await device.bind()
+            received = virtual.stats.received
+
+            # Two entities pushing their own change right after each other
+            device.fan_speed = 5
+            first = asyncio.create_task(device.push_state_update())
+            device.rotate = 1
+            second = asyncio.create_task(device.push_state_update())
+            await asyncio.gather(first, second)
+
+            assert virtual.stats.received == received + 1
+            assert (virtual.state["WdSpd"], virtual.state["Rotate"]) == (5, 1)
+
+            # Nothing left to push
+            await device.push_state_update()
+            assert virtual.stats.received == received + 1
+        finally:
+            device.close()
+
+
+async def test_only_cmd_acks_count_as_acknowledged(device_info):
+    async with DeviceSimulator(1, models={"828211": 1}, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        loop = asyncio.get_running_loop()
+        try:
+            await device.bind()
+            await device.update_state()
+            assert device.last_confirmed == loop.time()
+            assert device.last_acked is None
+
+            await asyncio.sleep(1)
+            device.mode = 2
+            await device.push_state_update()
+            assert device.last_acked == device.last_confirmed == loop.time()
+            # The ack carries the applied values, the local state is already current
+            assert not await device.update_state()
+        finally:
+            device.close()
+
+
+def polled_cols(trace):
+    return [record["request"]["pack"]["cols"] for record in trace if record["request"]["pack"]["t"] == "status"]
+
+
+@pytest.mark.parametrize("with_hid", [True, False])
+async def test_hid_is_probed_once(device_info, with_hid):
+    async with DeviceSimulator(1, network=NETWORK, with_hid=with_hid) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        trace = device.enable_trace()
+        try:
+            await device.bind()
+            await device.update_state()
+            await device.update_state()
+        finally:
+            device.close()
+
+        first, second = polled_cols(trace)
+        assert "hid" in first
+        # A device without a hid isn't asked again either
+        assert "hid" not in second
+        assert device.hid_probed
+        assert device.hid == virtual.hid
+        assert "hid" not in device.properties
+
+
+async def test_static_properties_are_fetched_once_per_address(device_info):
+    async with DeviceSimulator(2, models={"828211": 1}, network=NETWORK) as simulator:
+        virtual, other = simulator.devices
+        info = device_info(virtual)
+        device = Device(info, coalesce_window=0)
+        trace = device.enable_trace()
+        try:
+            await device.bind()
+            await device.update_state()
+            await device.update_state()
+            assert device.properties["name"] == virtual.name
+            assert device.properties["host"] == virtual.ip
+
+            # The unit moved, its address comes back with the next poll
+            info.ip = other.ip
+            await device.bind()
+            await device.update_state()
+            assert device.properties["host"] == other.ip
+        finally:
+            device.close()
+
+        static = [{"name", "host"} <= set(cols) for cols in polled_cols(trace)]
+        assert static == [True, False, True]
+
+
+async def test_only_changed_slots_are_pushed(device_info):
+    async with DeviceSimulator(1, models={"828211": 1}, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        trace = device.enable_trace()
+        try:
+            await device.bind()
+            await device.update_state()
+
+            # Setting the current value leaves nothing to push
+            device.fan_speed = device.fan_speed
+            await device.push_state_update()
+
+            device.set_property(Props.LR_ANGLE, 20)
+            device.power = True
+            await device.push_state_update()
+            assert device.get_property(Props.LR_ANGLE) == 20
+        finally:
+            device.close()
+
+        cmds = [record["request"]["pack"] for record in trace if record["request"]["pack"]["t"] == "cmd"]
+        # Sent in slot order, whatever order they were set in
+        assert [(cmd["opt"], cmd["p"]) for cmd in cmds] == [(["Pow", "LRAngle"], [1, 20])]
+
+
+async def test_subscribers_only_hear_of_changes(device_info):
+    async with DeviceSimulator(1, models={"828211": 1}, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        changes = []
+        unsubscribe = device.subscribe(changes.append)
+        try:
+            await device.bind()
+            await device.update_state()
+            assert len(changes) == 1
+            assert Props.POWER in changes[0] and Props.NAME in changes[0]
+
+            # A poll that brings the same values is silent
+            await device.update_state()
+            assert len(changes) == 1
+
+            speed = virtual.state["WdSpd"]
+            virtual.state["Pow"] = 1
+            virtual.state["WdSpd"] = speed + 1
+            await device.update_state()
+            change = changes[-1]
+            assert change.values == {"Pow": (0, 1), "WdSpd": (speed, speed + 1)}
+            assert Props.POWER in change and Props.MODE not in change
+
+            # Local sets are reported once, setting the same value again is not
+            device.fan_speed = speed
+            device.fan_speed = speed
+            assert [c.values for c in changes[2:]] == [{"WdSpd": (speed + 1, speed)}]
+
+            unsubscribe()
+            device.fan_speed = speed + 2
+            assert len(changes) == 3
+        finally:
+            device.close()
+
+
+async def test_changes_iterator(device_info):
+    async with DeviceSimulator(1, models={"828211": 1}, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        received = []
+
+        async def consume():
+            async for change in device.changes():
+                received.append(change.values)
+                if len(received) == 2:
+                    break
+
+        # The iterator subscribes once it starts running
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0)
+        try:
+            await device.bind()
+            await device.update_state()
+            virtual.state["Pow"] = 1
+            await device.update_state()
+            await asyncio.wait_for(consumer, 1)
+        finally:
+            device.close()
+
+        assert received[1] == {"Pow": (0, 1)}
+        # Leaving the loop unsubscribed the iterator
+        device.power = False
+        assert len(received) == 2
@@ -0,0 +1,30 @@
+"""Model records compiled from the capability table."""
+import pytest
+
+from custom_components.gree.lib.device_infos import DEVICE_MAP, MODELS, create_device_info
+from custom_components.gree.lib.features import BaseFeature, FanRotateFeature, FanRotateWithAngleFeature, ModeFeature
+
+
+@pytest.mark.parametrize("mid, features", [
+    ("828200", [BaseFeature, ModeFeature]),
+    ("828204", [BaseFeature, ModeFeature, FanRotateFeature]),
+    ("828211", [BaseFeature, ModeFeature, FanRotateWithAngleFeature]),
+    ("828212", [BaseFeature, ModeFeature, FanRotateFeature]),
+])
+def test_features_follow_capabilities(mid, features):
+    assert [type(feature) for feature in MODELS[mid].features] == features
+    assert [type(feature) for feature in DEVICE_MAP[mid]["support_features"]] == features
+
+
+def test_poll_and_static_props_split_the_model_props():
+    model = MODELS["828211"]
+    assert set(model.poll_props) | set(model.static_props) == set(model.props)
+    assert not set(model.poll_props) & set(model.static_props)
+    assert "name" in model.static_props
+    assert "Pow" in model.poll_props
+
+
+def test_unknown_models_have_no_info():
+    assert create_device_info("999999", "fan", "127.0.0.1", 7000, "aabbccddeeff") is None
+    info = create_device_info("828204", "fan", "127.0.0.1", 7000, "aabbccddeeff")
+    assert info.d_static_pros == MODELS["828204"].static_props
@@ -0,0 +1,174 @@
+"""Discovery against simulated devices on the loopback network."""
+import asyncio
+
+import pytest
+
+from custom_components.gree.lib import codec
+from custom_components.gree.lib.discovery import Discovery, Listener
+from custom_components.gree.lib.simulator import DeviceSimulator
+
+NETWORK = "127.79.0.0/24"
+
+
+class RecordingListener(Listener):
+    def __init__(self):
+        self.found = []
+        self.updated = []
+
+    async def device_found(self, device_info):
+        self.found.append(device_info)
+
+    async def device_update(self, device_info):
+        self.updated.append(device_info)
+
+
+def answer_scans(simulator, answer):
+    """Make the devices answer scans with `answer(device)`, raw bytes or None for silence."""
+
+    def forged(device, obj, addr, delay=0.0):
+        data = answer(device)
+        if data is not None:
+            device.send(data, addr)
+
+    simulator.schedule = forged
+
+
+def scan_reply(mac, mid="828211", name="fan"):
+    return codec.encode_packet(
+        {"t": "pack", "i": 1, "uid": 0, "cid": mac, "tcid": "",
+         "pack": {"t": "dev", "mac": mac, "mid": mid, "name": name}}
+    )
+
+
+async def test_scan_finds_fleet(metrics):
+    async with DeviceSimulator(20, network=NETWORK, scan_window=0.1) as simulator:
+        discovery = Discovery(allow_loopback=True, metrics=metrics)
+        listener = RecordingListener()
+        discovery.add_listener(listener)
+        try:
+            devices = await discovery.scan(0.5, bcast_ifaces=[simulator.broadcast_address])
+        finally:
+            discovery.close()
+
+        assert sorted(d.mac for d in devices) == sorted(v.mac for v in simulator.devices)
+        assert len(listener.found) == 20
+        for info in devices:
+            virtual = simulator.device(info.mac)
+            assert (info.ip, info.port, info.mid) == (virtual.ip, virtual.port, virtual.mid)
+            assert discovery.registry.get(info.mac) is info
+        assert metrics.discovery.scans == 1
+        assert metrics.discovery.replies == 20
+
+
+async def test_moved_device_is_reported(metrics):
+    async with DeviceSimulator(2, models={"828211": 1}, network=NETWORK, scan_window=0) as simulator:
+        moved, other = simulator.devices
+        discovery = Discovery(allow_loopback=True, metrics=metrics)
+        listener = RecordingListener()
+        discovery.add_listener(listener)
+        try:
+            await discovery.scan(0.5, bcast_ifaces=[simulator.broadcast_address])
+            # The first unit now answers from the address of the second one
+            answer_scans(simulator, lambda d: scan_reply(moved.mac, name=moved.name) if d is other else None)
+            await discovery.scan(0.5, bcast_ifaces=[simulator.broadcast_address])
+        finally:
+            discovery.close()
+
+        assert len(listener.found) == 2
+        assert [(info.mac, info.ip) for info in listener.updated] == [(moved.mac, other.ip)]
+        assert discovery.registry.get(moved.mac).ip == other.ip
+
+
+async def test_sweep_finds_devices_without_broadcast(metrics):
+    async with DeviceSimulator(5, network="127.79.1.0/28") as simulator:
+        discovery = Discovery(allow_loopback=True, metrics=metrics)
+        listener = RecordingListener()
+        discovery.add_listener(listener)
+        try:
+            sent = await discovery.sweep([simulator.network])
+            await asyncio.sleep(0.1)
+        finally:
+            discovery.close()
+
+        # Every host of the network got a unicast scan, the broadcast responder none
+        assert sent == metrics.discovery.scans == simulator.network.num_addresses - 2
+        assert sorted(d.mac for d in discovery.devices) == sorted(v.mac for v in simulator.devices)
+        assert len(listener.found) == 5
+
+
+async def test_sweep_is_rate_limited(metrics):
+    async with DeviceSimulator(1, network="127.79.2.0/27") as simulator:
+        discovery = Discovery(allow_loopback=True, metrics=metrics)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            sent = await discovery.sweep([simulator.network], rate=100)
+        finally:
+            discovery.close()
+
+        assert sent == 30
+        # The first packet goes out right away, then one every 10 ms
+        assert loop.time() - start == pytest.approx(0.29)
+
+
+async def test_repeated_replies_are_dispatched_once(metrics):
+    async with DeviceSimulator(5, network=NETWORK, scan_window=0) as simulator:
+        discovery = Discovery(allow_loopback=True, metrics=metrics)
+        listener = RecordingListener()
+        discovery.add_listener(listener)
+        # Three interfaces on the same network, each unit answers every scan
+        interfaces = [simulator.broadcast_address] * 3
+        try:
+            await discovery.scan(0.5, bcast_ifaces=interfaces)
+            assert len(listener.found) == 5
+            assert metrics.discovery.replies == 15
+            assert metrics.discovery.duplicates == 10
+
+            # A new round lets every unit through once more, the registry
+            # knows them already
+            await discovery.scan(0.5, bcast_ifaces=interfaces)
+        finally:
+            discovery.close()
+
+        assert len(listener.found) == 5
+        assert not listener.updated
+        assert metrics.discovery.duplicates == 20
+
+
+async def test_bad_replies_are_counted(metrics):
+    async with DeviceSimulator(6, network=NETWORK, scan_window=0) as simulator:
+        answers = dict(zip(simulator.devices, (
+            b"garbage",
+            b"[1, 2]",
+            b'{"t": "pack", "i": 1, "pack": "bm90IGJsb2Nrcw=="}',
+            b'{"t": "pack", "i": 1, "pack": {"t": "dev"}}',
+            scan_reply("aabbccddeeff", mid="999999"),
+        )))
+        good = simulator.devices[-1]
+        answer_scans(simulator, lambda d: answers.get(d, scan_reply(good.mac, name=good.name)))
+        discovery = Discovery(allow_loopback=True, metrics=metrics)
+        listener = RecordingListener()
+        discovery.add_listener(listener)
+        try:
+            await discovery.scan(0.5, bcast_ifaces=[simulator.broadcast_address])
+        finally:
+            discovery.close()
+
+        assert [info.mac for info in listener.found] == [good.mac]
+        assert metrics.discovery.replies == 6
+        assert metrics.discovery.malformed == 4
+        assert metrics.discovery.unknown_models == 1
+
+
+async def test_close_stops_the_dispatch_workers(metrics):
+    async with DeviceSimulator(2, network=NETWORK, scan_window=0) as simulator:
+        running = asyncio.all_tasks()
+        discovery = Discovery(allow_loopback=True, metrics=metrics)
+        discovery.add_listener(RecordingListener())
+        await discovery.scan(0.5, bcast_ifaces=[simulator.broadcast_address])
+        # The workers wait for more devices
+        assert asyncio.all_tasks() - running
+        discovery.close()
+        await asyncio.sleep(0)
+
+        assert not asyncio.all_tasks() - running
@@ -0,0 +1,49 @@
+"""Metrics registry counters and export."""
+from custom_components.gree.lib.metrics import Histogram, MetricsRegistry
+
+
+def test_histogram_quantiles():
+    histogram = Histogram((0.01, 0.1, 1.0))
+    assert histogram.quantile(0.5) is None
+    for value in (0.005, 0.005, 0.05, 2.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.75) == 0.1
+    assert histogram.quantile(1.0) == float("inf")
+    assert histogram.as_dict()["buckets"] == {"0.01": 2, "0.1": 1, "1.0": 0, "+Inf": 1}
+
+
+def test_prometheus_export():
+    metrics = MetricsRegistry()
+    device = metrics.device('aa"bb\\cc')
+    device.request("status")
+    device.request("status")
+    device.sent(80)
+    device.rtt.observe(0.003)
+    metrics.discovery.scans = 3
+
+    text = metrics.prometheus()
+    # Label values are escaped
+    assert 'gree_requests_total{mac="aa\\"bb\\\\cc",type="status"} 2' in text
+    assert 'gree_bytes_sent_total{mac="aa\\"bb\\\\cc"} 80' in text
+    assert 'gree_rtt_seconds_bucket{mac="aa\\"bb\\\\cc",le="+Inf"} 1' in text
+    assert "gree_discovery_scans_total 3" in text
+    # No packet arrived yet
+    assert "gree_last_seen_timestamp_seconds{" not in text
+
+
+def test_removed_devices_leave_the_export():
+    metrics = MetricsRegistry()
+    metrics.device("aabbccddeeff").request("bind")
+    metrics.device("112233445566").request("bind")
+    metrics.discovery.replies = 2
+
+    metrics.remove("aabbccddeeff")
+    assert len(metrics) == 1
+    assert 'mac="aabbccddeeff"' not in metrics.prometheus()
+    assert list(metrics.snapshot()["devices"]) == ["112233445566"]
+
+    metrics.clear()
+    assert len(metrics) == 0
+    assert "mac=" not in metrics.prometheus()
+    assert metrics.snapshot()["discovery"]["replies"] == 0
@@ -0,0 +1,338 @@
+"""Device sessions against simulated devices on the loopback network."""
+import asyncio
+import json
+
+import pytest
+
+from custom_components.gree.lib import codec
+from custom_components.gree.lib.device import Device
+from custom_components.gree.lib.network import DeviceSession, SharedEndpoint
+from custom_components.gree.lib.rtt import INITIAL_RTO
+from custom_components.gree.lib.simulator import DeviceSimulator
+
+NETWORK = "127.78.0.0/24"
+
+
+def forge_before_replies(simulator, data):
+    """Make the devices send `data` ahead of every reply."""
+    schedule = simulator.schedule
+
+    def forged(device, obj, addr, delay=0.0):
+        device.send(data, addr)
+        schedule(device, obj, addr, delay)
+
+    simulator.schedule = forged
+
+
+def drop_first_requests(simulator, count=1):
+    """Make the devices ignore the first `count` requests."""
+    schedule = simulator.schedule
+    dropped = []
+
+    def lossy(device, obj, addr, delay=0.0):
+        if len(dropped) < count:
+            dropped.append(obj)
+            device.stats.dropped += 1
+            return
+        schedule(device, obj, addr, delay)
+
+    simulator.schedule = lossy
+    return dropped
+
+
+def delay_replies(simulator, kind, *delays):
+    """Delay the replies to the next requests of a kind, one delay per request."""
+    schedule = simulator.schedule
+    delays = list(delays)
+
+    def delayed(device, obj, addr, delay=0.0):
+        pack = obj.get("pack")
+        if isinstance(pack, dict) and pack.get("t") == kind and delays:
+            delay += delays.pop(0)
+        schedule(device, obj, addr, delay)
+
+    simulator.schedule = delayed
+
+
+@pytest.mark.parametrize("shared", [False, True])
+async def test_bind_status_cmd(device_info, shared):
+    async with DeviceSimulator(1, models={"828211": 1}, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        endpoint = SharedEndpoint() if shared else None
+        device = Device(device_info(virtual), endpoint=endpoint, coalesce_window=0)
+        try:
+            await device.bind()
+            assert device.device_key == virtual.key
+
+            assert await device.update_state()
+            # The firmware id is kept apart from the properties
+            assert device.properties == {k: v for k, v in virtual.state.items() if k != "hid"}
+            assert device.hid == virtual.hid
+            assert device.version == "1.0"
+
+            device.fan_speed = 7
+            device.power = True
+            await device.push_state_update()
+            assert virtual.state["WdSpd"] == 7
+            assert virtual.state["Pow"] == 1
+
+            # Nothing changed on the unit since the ack
+            assert not await device.update_state()
+        finally:
+            device.close()
+            if endpoint is not None:
+                endpoint.close()
+
+
+async def test_session_keeps_its_socket(device_info, metrics):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        session = DeviceSession(device_info(virtual), metrics=metrics)
+        try:
+            key = await session.bind()
+            remote_addr = session.remote_addr
+            for _ in range(3):
+                await session.request_state(["Pow"], key)
+            assert session.remote_addr == remote_addr == virtual.address
+        finally:
+            session.close()
+        assert not session.connected
+
+
+async def test_device_moves_while_a_request_is_in_flight(device_info, metrics):
+    async with DeviceSimulator(2, network=NETWORK, latency=0.1) as simulator:
+        old, new = simulator.devices
+        info = device_info(old)
+        session = DeviceSession(info, metrics=metrics)
+        try:
+            first = asyncio.create_task(session.bind())
+            await asyncio.sleep(0.05)
+            # The unit got a new address, the next request reopens the socket
+            info.ip = new.ip
+            second = asyncio.create_task(session.bind())
+
+            # Neither request fails because the first socket was replaced, the
+            # first one is retransmitted to the new address
+            assert await asyncio.gather(first, second) == [new.key, new.key]
+            assert session.remote_addr == new.address
+        finally:
+            session.close()
+
+
+async def test_shared_endpoint_routes_replies(device_info):
+    async with DeviceSimulator(20, network=NETWORK, latency=0.005, jitter=0.01) as simulator:
+        endpoint = SharedEndpoint()
+        devices = [Device(device_info(v), endpoint=endpoint, coalesce_window=0) for v in simulator.devices]
+        try:
+            await asyncio.gather(*[d.bind() for d in devices])
+            await asyncio.gather(*[d.update_state() for d in devices])
+            assert endpoint.sessions == 20
+            for device, virtual in zip(devices, simulator.devices):
+                assert device.device_key == virtual.key
+                assert device.properties["name"] == virtual.name
+        finally:
+            for device in devices:
+                device.close()
+            endpoint.close()
+        assert endpoint.sessions == 0
+
+
+@pytest.mark.parametrize("shared", [False, True])
+@pytest.mark.parametrize("data", [b"", b"garbage", b"[1, 2]", b"3", b"null", b'{"pack": 5}'])
+async def test_malformed_replies_are_dropped(device_info, metrics, shared, data):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        forge_before_replies(simulator, data)
+        endpoint = SharedEndpoint() if shared else None
+        session = DeviceSession(device_info(virtual), endpoint=endpoint, metrics=metrics)
+        try:
+            assert await session.bind() == virtual.key
+            assert await session.request_state(["Pow"], virtual.key) == {"Pow": 0}
+        finally:
+            session.close()
+            if endpoint is not None:
+                endpoint.close()
+
+        # Each reply came first try, the junk in front of it didn't break the exchange
+        assert metrics.device(virtual.mac).retransmissions == 0
+
+
+async def test_batched_replies_are_routed(device_info, metrics, monkeypatch):
+    batches = []
+    decrypt_payloads = codec.decrypt_payloads
+
+    def recording(payloads, key=codec.GENERIC_KEY):
+        batches.append(len(payloads))
+        return decrypt_payloads(payloads, key)
+
+    monkeypatch.setattr(codec, "decrypt_payloads", recording)
+    async with DeviceSimulator(20, network=NETWORK, latency=0.005) as simulator:
+        endpoint = SharedEndpoint(batch_window=0.001)
+        sessions = [DeviceSession(device_info(v), endpoint=endpoint, metrics=metrics) for v in simulator.devices]
+        try:
+            # Bind replies arrive together under the generic key
+            keys = await asyncio.gather(*[s.bind() for s in sessions])
+            states = await asyncio.gather(*[s.request_state(["name"], key) for s, key in zip(sessions, keys)])
+        finally:
+            for session in sessions:
+                session.close()
+            endpoint.close()
+
+        assert max(batches) > 1
+        assert keys == [virtual.key for virtual in simulator.devices]
+        assert states == [{"name": virtual.name} for virtual in simulator.devices]
+        assert sum(metrics.device(virtual.mac).retransmissions for virtual in simulator.devices) == 0
+
+
+async def test_undecodable_batched_reply_is_counted(device_info, metrics):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        forge_before_replies(simulator, json.dumps(
+            {"t": "pack", "i": 1, "cid": virtual.mac, "pack": "bm90IGJsb2Nrcw=="}
+        ).encode())
+        endpoint = SharedEndpoint(batch_window=0.001)
+        session = DeviceSession(device_info(virtual), endpoint=endpoint, metrics=metrics)
+        try:
+            assert await session.bind() == virtual.key
+        finally:
+            session.close()
+            endpoint.close()
+
+        assert metrics.device(virtual.mac).decrypt_failures == 1
+        assert metrics.device(virtual.mac).retransmissions == 0
+
+
+async def test_lost_request_is_retransmitted(device_info, metrics):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        dropped = drop_first_requests(simulator)
+        session = DeviceSession(device_info(virtual), metrics=metrics)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            assert await session.bind() == virtual.key
+        finally:
+            session.close()
+
+        # Sent again once the initial RTO passed
+        assert loop.time() - start == pytest.approx(INITIAL_RTO)
+        assert len(dropped) == 1
+        assert virtual.stats.received == 2
+        device_metrics = metrics.device(virtual.mac)
+        assert device_metrics.requests == {"bind": 1}
+        assert device_metrics.retransmissions == 1
+        assert device_metrics.packets_sent == 2
+        assert device_metrics.packets_received == 1
+        # Only requests answered on the first try give an RTT sample
+        assert device_metrics.rtt.count == 0
+        assert session.rtt.srtt is None
+
+
+async def test_unanswered_request_times_out(device_info, metrics):
+    async with DeviceSimulator(1, loss=1.0, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        session = DeviceSession(device_info(virtual), timeout=5, metrics=metrics)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await session.bind()
+        finally:
+            session.close()
+
+        assert loop.time() - start == pytest.approx(5)
+        assert metrics.device(virtual.mac).timeouts == {"bind": 1}
+        # Backed off exponentially: 0.5, 1, 2 then capped at 3 seconds
+        assert virtual.stats.received == 4
+
+
+async def test_rto_follows_the_measured_rtt(device_info, metrics):
+    async with DeviceSimulator(1, network=NETWORK, latency=0.02) as simulator:
+        virtual = simulator.devices[0]
+        session = DeviceSession(device_info(virtual), metrics=metrics)
+        try:
+            key = await session.bind()
+            for _ in range(10):
+                await session.request_state(["Pow"], key)
+        finally:
+            session.close()
+
+        assert session.rtt.srtt == pytest.approx(0.02)
+        assert session.rtt.rto < INITIAL_RTO
+        assert session.rtt.p95 == pytest.approx(0.02)
+        assert metrics.device(virtual.mac).rtt.count == 11
+
+
+@pytest.mark.parametrize("hedge, retransmissions", [(False, 1), (True, 2)])
+async def test_slow_reply_is_hedged(device_info, metrics, hedge, retransmissions):
+    async with DeviceSimulator(1, network=NETWORK, latency=0.01) as simulator:
+        virtual = simulator.devices[0]
+        session = DeviceSession(device_info(virtual), metrics=metrics)
+        try:
+            key = await session.bind()
+            for _ in range(10):
+                await session.request_state(["Pow"], key)
+            device_metrics = metrics.device(virtual.mac)
+            assert device_metrics.retransmissions == 0
+
+            # Slower than the p95, but answered before the RTO backs off twice
+            session.hedge = hedge
+            simulator.latency = 0.1
+            assert await session.request_state(["Pow"], key) == {"Pow": 0}
+            assert device_metrics.retransmissions == retransmissions
+        finally:
+            session.close()
+
+
+async def test_pipelined_status_and_cmd(device_info):
+    async with DeviceSimulator(1, models={"828211": 1}, latency=0.02, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        try:
+            await device.bind()
+            device.mode = 2
+            # Both requests are in flight at once, each reply must reach its own request
+            changed, _ = await asyncio.gather(device.update_state(), device.push_state_update())
+            assert changed
+            assert virtual.state["Mod"] == 2
+            assert device.mode == 2
+        finally:
+            device.close()
+
+
+async def test_late_status_reply_does_not_answer_the_next_poll(device_info, metrics):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        session = DeviceSession(device_info(virtual), metrics=metrics)
+        loop = asyncio.get_running_loop()
+        try:
+            key = await session.bind()
+            rto = session.rtt.rto
+            # The first copy of the first poll is answered late, after its
+            # retransmission was, while the second poll waits for its reply
+            delay_replies(simulator, "status", rto * 1.6, 0, rto * 1.2)
+            start = loop.time()
+            assert await session.request_state(["Pow"], key) == {"Pow": 0}
+            loop.call_at(start + rto * 1.8, virtual.state.update, {"Pow": 1})
+            assert await session.request_state(["Pow"], key) == {"Pow": 1}
+        finally:
+            session.close()
+
+        # Both polls were sent twice
+        assert metrics.device(virtual.mac).retransmissions == 2
+
+
+async def test_duplicate_cmd_ack_does_not_answer_the_next_cmd(device_info, metrics):
+    async with DeviceSimulator(1, models={"828211": 1}, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        session = DeviceSession(device_info(virtual), metrics=metrics)
+        try:
+            key = await session.bind()
+            rto = session.rtt.rto
+            delay_replies(simulator, "cmd", rto * 1.6, 0, rto * 1.2)
+            assert await session.send_state({"WdSpd": 3}, key) == {"WdSpd": 3}
+            assert await session.send_state({"WdSpd": 4}, key) == {"WdSpd": 4}
+        finally:
+            session.close()
+
+        assert virtual.state["WdSpd"] == 4
@@ -0,0 +1,35 @@
+"""Registry of discovered devices."""
+from custom_components.gree.lib.device_infos import create_device_info
+from custom_components.gree.lib.registry import DeviceRegistry, RegistryChange
+
+
+def info(ip="192.168.1.20", name="fan", mac="c8f742000001"):
+    return create_device_info("828211", name, ip, 7000, mac)
+
+
+def test_upsert_reports_changes():
+    registry = DeviceRegistry()
+    assert registry.upsert(info()) is RegistryChange.ADDED
+    stored = registry.get("c8f742000001")
+
+    # An equal info keeps the stored object, others may hold on to it
+    assert registry.upsert(info()) is RegistryChange.UNCHANGED
+    assert registry.get("c8f742000001") is stored
+
+    assert registry.upsert(info(name="bedroom")) is RegistryChange.UPDATED
+    assert registry.upsert(info(ip="192.168.1.21", name="bedroom")) is RegistryChange.MOVED
+    assert registry.get("c8f742000001").ip == "192.168.1.21"
+    assert len(registry) == 1
+
+
+def test_attached_objects_follow_the_device():
+    registry = DeviceRegistry()
+    registry.upsert(info())
+    registry.attach("c8f742000001", "coordinator")
+    assert registry.attached("c8f742000001") == "coordinator"
+    assert registry.attached("c8f742000002") is None
+
+    registry.remove("c8f742000001")
+    assert "c8f742000001" not in registry
+    assert registry.attached("c8f742000001") is None
+    assert registry.devices == []
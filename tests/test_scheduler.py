@@ -0,0 +1,218 @@
+"""Fleet poll scheduling, on the virtual clock of the test loop."""
+import asyncio
+
+from custom_components.gree.lib.device import Device
+from custom_components.gree.lib.scheduler import AdaptiveInterval, FleetPoller, PollListener
+from custom_components.gree.lib.simulator import DeviceSimulator
+
+INTERVAL = 0.2
+NETWORK = "127.83.0.0/24"
+LATENCY = 0.01
+
+
+class FakeDevice:
+    """Stands in for a `Device`, records when it was polled."""
+
+    def __init__(self, changed=False, error=None):
+        self.changed = changed
+        self.error = error
+        self.last_acked = None
+        self.polls = []
+
+    async def update_state(self):
+        self.polls.append(asyncio.get_running_loop().time())
+        if self.error is not None:
+            raise self.error
+        return self.changed
+
+
+class RecordingListener(PollListener):
+    def __init__(self):
+        self.results = []
+        self.times = {}
+
+    def poll_finished(self, device, error):
+        self.results.append((device, error))
+        self.times.setdefault(device, []).append(asyncio.get_running_loop().time())
+
+
+def phase(t, start, interval=INTERVAL):
+    return round((t - start) % interval, 9) % interval
+
+
+async def test_phases_are_spread_and_kept():
+    start = asyncio.get_running_loop().time()
+    poller = FleetPoller(interval=INTERVAL, jitter=0)
+    devices = [FakeDevice() for _ in range(5)]
+    listener = RecordingListener()
+    try:
+        for device in devices:
+            poller.add(device, listener)
+        await asyncio.sleep(INTERVAL * 3)
+    finally:
+        poller.stop()
+
+    phases = []
+    for device in devices:
+        polls = [t for t in device.polls if t - start < INTERVAL * 3]
+        # One poll per interval, every round on the same phase
+        assert len(polls) == 3
+        assert len({phase(t, start) for t in polls}) == 1
+        phases.append(phase(polls[0], start))
+    # No two devices share a phase
+    phases.sort()
+    assert min(b - a for a, b in zip(phases, phases[1:])) > INTERVAL / 10
+    assert len(listener.results) == sum(len(d.polls) for d in devices)
+
+
+async def test_polls_in_flight_are_capped():
+    in_flight = []
+
+    class SlowDevice(FakeDevice):
+        async def update_state(self):
+            in_flight.append(1)
+            assert len(in_flight) <= 2
+            await asyncio.sleep(INTERVAL / 2)
+            in_flight.pop()
+            return await super().update_state()
+
+    poller = FleetPoller(interval=INTERVAL, max_in_flight=2, jitter=0)
+    devices = [SlowDevice() for _ in range(8)]
+    try:
+        for device in devices:
+            poller.add(device, RecordingListener())
+        await asyncio.sleep(INTERVAL * 4)
+    finally:
+        poller.stop()
+    assert all(device.polls for device in devices)
+
+
+async def test_failed_poll_is_reported_and_rescheduled():
+    poller = FleetPoller(interval=INTERVAL, jitter=0)
+    device = FakeDevice(error=OSError("unreachable"))
+    listener = RecordingListener()
+    try:
+        poller.add(device, listener)
+        await asyncio.sleep(INTERVAL * 2.5)
+    finally:
+        poller.stop()
+
+    assert len(device.polls) == 3
+    assert [type(error) for _, error in listener.results] == [OSError] * 3
+
+
+async def test_removed_device_is_not_polled():
+    poller = FleetPoller(interval=INTERVAL, jitter=0)
+    kept, removed = FakeDevice(), FakeDevice()
+    listener = RecordingListener()
+    try:
+        poller.add(kept, listener)
+        poller.add(removed, listener)
+        poller.remove(removed)
+        await asyncio.sleep(INTERVAL * 1.5)
+        assert poller.devices == [kept]
+    finally:
+        poller.stop()
+
+    assert poller.devices == []
+    assert kept.polls
+    assert not removed.polls
+
+
+def test_adaptive_interval():
+    interval = AdaptiveInterval(1, 8, fast_window=10)
+    assert interval.current == 1
+    # Fast while the window of the last activity lasts, then backs off while nothing changes
+    interval.activity(0)
+    assert interval.observe(False, 5) == 1
+    assert [interval.observe(False, now) for now in (20, 22, 26, 34, 42)] == [2, 4, 8, 8, 8]
+    # A change or activity brings the fast rate back
+    assert interval.observe(True, 50) == 1
+    interval.observe(False, 100)
+    interval.activity(101)
+    assert interval.current == 1
+
+
+async def test_adaptive_polls_stay_on_their_phase():
+    start = asyncio.get_running_loop().time()
+    poller = FleetPoller(interval=INTERVAL, jitter=0, min_interval=INTERVAL, max_interval=INTERVAL * 4,
+                         fast_window=0)
+    devices = [FakeDevice() for _ in range(3)]
+    try:
+        for device in devices:
+            poller.add(device, RecordingListener())
+        await asyncio.sleep(INTERVAL * 12)
+    finally:
+        poller.stop()
+
+    for device in devices:
+        gaps = [round(b - a, 9) for a, b in zip(device.polls, device.polls[1:])]
+        # Idle devices back off to the maximum, on the grid of their first slot
+        assert gaps[:3] == [INTERVAL * 2, INTERVAL * 4, INTERVAL * 4]
+        assert len({phase(t, start) for t in device.polls}) == 1
+
+
+async def test_activity_polls_early():
+    poller = FleetPoller(interval=INTERVAL, jitter=0, min_interval=INTERVAL, max_interval=INTERVAL * 4,
+                         fast_window=INTERVAL * 2)
+    device = FakeDevice()
+    try:
+        poller.add(device, RecordingListener())
+        # Polled at 0, 2 and 6 intervals, the next poll is due at 10
+        await asyncio.sleep(INTERVAL * 7)
+        polls = len(device.polls)
+        poller.activity(device)
+        await asyncio.sleep(INTERVAL * 1.5)
+    finally:
+        poller.stop()
+
+    # Backed off to the maximum interval, activity brings a poll within the minimum one
+    assert len(device.polls) == polls + 1
+
+
+async def test_status_replies_do_not_postpone_polls(device_info):
+    async with DeviceSimulator(3, network=NETWORK, latency=LATENCY) as simulator:
+        devices = [Device(device_info(v), coalesce_window=0) for v in simulator.devices]
+        listener = RecordingListener()
+        await asyncio.gather(*[device.bind() for device in devices])
+        start = asyncio.get_running_loop().time()
+        poller = FleetPoller(interval=INTERVAL, jitter=0)
+        try:
+            for device in devices:
+                poller.add(device, listener)
+            await asyncio.sleep(3)
+        finally:
+            poller.stop()
+            for device in devices:
+                device.close()
+
+    for device in devices:
+        assert device.last_acked is None
+        polls = [t - LATENCY for t in listener.times[device]]
+        assert len(polls) == 15
+        assert len({phase(t, start) for t in polls}) == 1
+
+
+async def test_poll_confirmed_by_a_cmd_ack_is_skipped(device_info):
+    async with DeviceSimulator(1, models={"828211": 1}, network=NETWORK, latency=LATENCY) as simulator:
+        device = Device(device_info(simulator.devices[0]), coalesce_window=0)
+        listener = RecordingListener()
+        await device.bind()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        poller = FleetPoller(interval=INTERVAL, jitter=0)
+        try:
+            poller.add(device, listener)
+            await asyncio.sleep(INTERVAL * 2.5)
+            device.fan_speed = 3
+            await device.push_state_update()
+            assert device.last_acked == loop.time()
+            await asyncio.sleep(INTERVAL * 5)
+        finally:
+            poller.stop()
+            device.close()
+
+    polls = [round((t - LATENCY - start) / INTERVAL, 6) for t in listener.times[device]]
+    # The ack at 2.5 intervals vouches for the state until 3.5, the poll at 3 is
+    # skipped and the ones after it stay on the same phase
+    assert polls == [0, 1, 2, 4, 5, 6, 7]
@@ -0,0 +1,58 @@
+"""The simulated devices themselves."""
+import asyncio
+
+import pytest
+
+from custom_components.gree.lib.network import DeviceSession
+from custom_components.gree.lib.simulator import DeviceSimulator
+
+NETWORK = "127.81.0.0/24"
+
+
+async def test_devices_answer_with_their_own_key(device_info, metrics):
+    async with DeviceSimulator(2, models={"828211": 1}, network=NETWORK) as simulator:
+        first, second = simulator.devices
+        sessions = [DeviceSession(device_info(v), metrics=metrics) for v in (first, second)]
+        try:
+            keys = [await session.bind() for session in sessions]
+            assert keys == [first.key, second.key]
+            assert first.key != second.key
+
+            state = await sessions[0].request_state(["Pow", "WdSpd"], first.key)
+            assert state == {"Pow": first.state["Pow"], "WdSpd": first.state["WdSpd"]}
+            assert await sessions[0].send_state({"WdSpd": 5}, first.key) == {"WdSpd": 5}
+            assert first.state["WdSpd"] == 5
+        finally:
+            for session in sessions:
+                session.close()
+
+        assert simulator.stats() == {"received": 4, "sent": 4, "dropped": 0, "rejected": 0}
+
+
+async def test_requests_with_the_wrong_key_are_rejected(device_info, metrics):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        session = DeviceSession(device_info(virtual), timeout=1, metrics=metrics)
+        try:
+            await session.bind()
+            with pytest.raises(asyncio.TimeoutError):
+                await session.request_state(["Pow"], "0123456789abcdef")
+        finally:
+            session.close()
+
+        assert virtual.stats.rejected == virtual.stats.received - 1
+        assert virtual.stats.sent == 1
+
+
+async def test_lost_requests_are_counted(device_info, metrics):
+    async with DeviceSimulator(1, loss=1.0, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        session = DeviceSession(device_info(virtual), timeout=1, metrics=metrics)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await session.bind()
+        finally:
+            session.close()
+
+        assert virtual.stats.dropped == virtual.stats.received
+        assert virtual.stats.sent == 0
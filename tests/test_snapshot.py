@@ -0,0 +1,54 @@
+"""Warm start snapshots of known devices."""
+from custom_components.gree.lib.device import Device
+from custom_components.gree.lib.device_infos import create_device_info
+from custom_components.gree.lib.simulator import DeviceSimulator
+from custom_components.gree.lib.snapshot import DeviceSnapshot, load_snapshot, save_snapshot
+
+NETWORK = "127.84.0.0/24"
+
+
+async def test_snapshot_round_trip(device_info, tmp_path):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        try:
+            await device.bind()
+            await device.update_state()
+        finally:
+            device.close()
+
+        snapshot = DeviceSnapshot()
+        assert snapshot.record(device)
+        assert not snapshot.record(device)
+        path = str(tmp_path / "devices.json")
+        save_snapshot(path, snapshot)
+        loaded = load_snapshot(path)
+        assert loaded.as_dict() == snapshot.as_dict()
+
+        # The restored device talks to the unit without binding again
+        received = virtual.stats.received
+        restored = loaded.restore(virtual.mac, coalesce_window=0)
+        try:
+            assert restored.device_key == virtual.key
+            assert (restored.hid, restored.hid_probed) == (device.hid, True)
+            await restored.update_state()
+            assert restored.properties == device.properties
+        finally:
+            restored.close()
+        assert virtual.stats.received == received + 1
+
+
+def test_missing_snapshot_file_is_empty(tmp_path):
+    assert len(load_snapshot(str(tmp_path / "missing.json"))) == 0
+
+
+def test_unbound_and_unknown_devices_are_skipped():
+    snapshot = DeviceSnapshot({"aabbccddeeff": {"ip": "127.0.0.1", "port": 7000, "mid": "999", "device_key": "k"}})
+    assert snapshot.restore("aabbccddeeff") is None
+    assert snapshot.restore("000000000000") is None
+
+    device = Device(create_device_info("828211", "fan", "127.0.0.1", 7000, "001122334455"))
+    assert not snapshot.record(device)
+    assert "001122334455" not in snapshot
+    assert snapshot.remove("aabbccddeeff")
+    assert not snapshot.remove("aabbccddeeff")
@@ -0,0 +1,59 @@
+"""Per-device packet traces."""
+import json
+
+from custom_components.gree.lib.device import Device
+from custom_components.gree.lib.simulator import DeviceSimulator
+from custom_components.gree.lib.trace import REDACTED, PacketTrace
+
+NETWORK = "127.82.0.0/24"
+
+
+async def test_trace_records_exchanges_without_keys(device_info):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        trace = device.enable_trace(2)
+        try:
+            await device.bind()
+            await device.update_state()
+            await device.update_state()
+        finally:
+            device.close()
+
+        assert device.trace is trace
+        assert len(trace) == 2
+        for record in trace:
+            assert record["request"]["pack"]["t"] == "status"
+            assert record["reply"]["pack"]["t"] == "dat"
+            assert record["sent"] == 1
+            assert record["error"] is None
+
+        device.disable_trace()
+        assert device.trace is None
+
+
+async def test_bind_key_is_redacted(device_info):
+    async with DeviceSimulator(1, network=NETWORK) as simulator:
+        virtual = simulator.devices[0]
+        device = Device(device_info(virtual), coalesce_window=0)
+        trace = device.enable_trace()
+        try:
+            await device.bind()
+        finally:
+            device.close()
+
+        # The device keeps the real key, only the trace is masked
+        assert device.device_key == virtual.key
+        record = json.loads(trace.export())
+        assert record["reply"]["pack"]["key"] == REDACTED
+        assert virtual.key not in trace.export()
+
+
+def test_ring_buffer_keeps_the_latest():
+    trace = PacketTrace(3)
+    for i in range(5):
+        trace.record({"t": "scan", "i": i}, None, i, None, "timeout")
+    assert [r["request"]["i"] for r in trace] == [2, 3, 4]
+    assert trace.export().count("\n") == 3
+    trace.clear()
+    assert len(trace) == 0